@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # primeiro: mede a requisição inteira, inclusive os outros middlewares
+    'greenhouse.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,10 +83,50 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # transações já começam com a trava de escrita: sem "database is locked"
+            # quando duas requisições leem e depois tentam gravar ao mesmo tempo
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Precisam ser compartilhados entre os workers. "estado" guarda o estado de cada
+# estufa, o token de versão e o heartbeat do ESP (greenhouse/state.py): é dimensionado
+# por GREENHOUSE_MAX_DEVICES para nunca descartar chaves. "default" guarda o que pode
+# sumir sem erro (marcas do cache de dias do histórico).
+
+# Máximo de ESPs (dispositivos) por servidor: dimensiona o cache "estado" e o segmento
+# de memória compartilhada. Acima dele o estado continua correto, mas o heartbeat pode
+# ser descartado do cache (ESP aparece offline) e os excedentes saem do segmento para o cache
+GREENHOUSE_MAX_DEVICES = 500
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'greenhouse_cache'),
+        'OPTIONS': {
+            # acima de MAX_ENTRIES o FileBasedCache apaga um terço das chaves ao acaso
+            'MAX_ENTRIES': 10_000,
+        },
+    },
+    'estado': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'greenhouse_state_cache'),
+        'OPTIONS': {
+            # 4 chaves por dispositivo (versão, controle, última leitura, heartbeat), com folga de 2x
+            'MAX_ENTRIES': GREENHOUSE_MAX_DEVICES * 8 + 100,
+        },
+    },
+}
+# alias de CACHES usado por greenhouse/state.py
+GREENHOUSE_STATE_CACHE = 'estado'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -134,3 +177,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'login'
 LOGOUT_REDIRECT_URL = 'login' 
 LOGIN_REDIRECT_URL = 'dashboard'    
+
+
+# Retenção de dados (python manage.py run_retention): idade máxima por tabela, None = manter.
+# Só o que muda em relação a greenhouse.retention.POLITICAS_PADRAO (leituras brutas por 1 hora,
+# minutos por 7 dias, o resto para sempre); ex.: {'SensorReading': timedelta(hours=6)}.
+# Lote e pausa: GREENHOUSE_RETENTION_BATCH_SIZE e GREENHOUSE_RETENTION_PAUSE (padrão 500 e 0.05 s).
+GREENHOUSE_RETENTION = {}
+
+# Heartbeat do ESP: o contato fica no cache; o banco recebe uma cópia a cada N segundos
+GREENHOUSE_HEARTBEAT_PERSIST_INTERVAL = 60
+
+# Segmento de estado em memória compartilhada entre os workers (greenhouse/shm.py).
+# None mantém o estado só no cache; ex.: os.path.join(tempfile.gettempdir(), 'greenhouse_state.seg')
+# (o arquivo real recebe o hash do layout como sufixo: greenhouse_state.seg.<hash>)
+GREENHOUSE_STATE_SEGMENT = None
+
+# Métricas (/metrics): cada processo grava um arquivo aqui e o endpoint soma todos
+GREENHOUSE_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'greenhouse_metrics')
+# /metrics exige login ou, para o Prometheus, o cabeçalho "Authorization: Bearer <token>"
+# com este valor (None: só usuários logados)
+GREENHOUSE_METRICS_TOKEN = None
+
+# Cache em memória das séries de dias encerrados do histórico (limite em pontos, por processo;
+# ~0,5 KB por ponto: 50 mil pontos são ~25 MB por worker)
+GREENHOUSE_DAY_CACHE_MAX_POINTS = 50_000
+
+# Escrita adiada das leituras (greenhouse/writebehind.py): sensor_data_api responde 202 ao
+# enfileirar e uma thread grava em grupos a cada INTERVAL_MS ou MAX_ROWS leituras; com a fila
+# cheia (QUEUE leituras, por processo) responde 503
+GREENHOUSE_WRITE_BEHIND = False
+GREENHOUSE_WRITE_BEHIND_INTERVAL_MS = 200
+GREENHOUSE_WRITE_BEHIND_MAX_ROWS = 500
+GREENHOUSE_WRITE_BEHIND_QUEUE = 10_000
@@ -0,0 +1,123 @@
+"""
+Indicadores diários do clima e das cortinas.
+
+O clima sai de uma única consulta agregada sobre os baldes horários
+(GROUP BY dia local): média, extremos, horas fora da faixa ideal e
+graus-hora de superaquecimento. O tempo de cortina aberta vem dos trechos
+de estado (CurtainInterval) do período, cortados nas meias-noites locais
+num passe NumPy.
+
+Cada balde horário conta como uma hora e usa a sua média; horas sem
+leitura não existem na tabela e não entram em nenhum indicador.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db.models import Case, ExpressionWrapper, F, FloatField, IntegerField, Max, Min, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import intervals
+from .models import HourlyAverage
+
+LADOS = intervals.LADOS
+
+
+def _clima_por_dia(inicio, fim, dispositivo, min_temperature, max_temperature, tz):
+    media = ExpressionWrapper(F('temperature_sum') / F('count'), output_field=FloatField())
+    linhas = (
+        HourlyAverage.objects
+        .filter(device_id=dispositivo, timestamp__range=(inicio, fim))
+        .annotate(dia=TruncDate('timestamp', tzinfo=tz), media=media)
+        .values('dia')
+        .annotate(
+            count=Sum('count'),
+            temperature_sum=Sum('temperature_sum'),
+            humidity_sum=Sum('humidity_sum'),
+            temperature_min=Min('temperature_min'),
+            temperature_max=Max('temperature_max'),
+            humidity_min=Min('humidity_min'),
+            humidity_max=Max('humidity_max'),
+            hours=Sum(Value(1), output_field=IntegerField()),
+            hours_below=Sum(Case(When(media__lt=min_temperature, then=Value(1)), default=Value(0))),
+            hours_above=Sum(Case(When(media__gt=max_temperature, then=Value(1)), default=Value(0))),
+            overheat_degree_hours=Sum(Case(
+                When(media__gt=max_temperature, then=F('media') - max_temperature),
+                default=Value(0.0), output_field=FloatField(),
+            )),
+        )
+        .order_by('dia')
+    )
+    return {linha.pop('dia'): linha for linha in linhas}
+
+
+def _segundos_abertas(bordas, inicio, fim, dispositivo):
+    """
+    Segundos de cortina aberta por lado em cada dia. `bordas` (epoch, n+1
+    valores crescentes) delimita os n dias. Com os trechos abertos recortados
+    às bordas, A(t) = tempo aberto acumulado até t sai de uma soma acumulada
+    e de uma busca binária; o tempo de cada dia é a diferença de A nas bordas.
+    """
+    dias = len(bordas) - 1
+    resultado = {}
+    for lado in LADOS:
+        abertos = [t for t in intervals.sobrepostos(lado, inicio, fim, dispositivo) if t.state == 'open']
+        if not abertos:
+            resultado[lado] = np.zeros(dias)
+            continue
+        agora = bordas[-1]
+        s = np.clip([t.start.timestamp() for t in abertos], bordas[0], bordas[-1])
+        e = np.clip([t.end.timestamp() if t.end else agora for t in abertos], bordas[0], bordas[-1])
+        acumulado = np.concatenate(([0.0], np.cumsum(e - s)))
+        # j = trechos que começam até cada borda; o último deles pode estar pela metade
+        j = np.searchsorted(s, bordas, side='right')
+        ultimo = np.maximum(j - 1, 0)
+        parcial = np.where(j > 0, np.clip(np.minimum(bordas, e[ultimo]) - s[ultimo], 0, None), 0.0)
+        resultado[lado] = np.diff(acumulado[ultimo] + parcial)
+    return resultado
+
+
+def _rd(valor):
+    return round(valor, 2) if valor is not None else None
+
+
+def diario(inicio, fim, control):
+    """Lista com um dict por dia local de [inicio, fim] do dispositivo de `control`, com a sua faixa ideal."""
+    tz = timezone.get_current_timezone()
+    primeiro = timezone.localtime(inicio, tz).date()
+    ultimo = timezone.localtime(fim, tz).date()
+    datas = [primeiro + timedelta(days=i) for i in range((ultimo - primeiro).days + 1)]
+
+    clima = _clima_por_dia(inicio, fim, control.device_id, control.min_temperature, control.max_temperature, tz)
+
+    # bordas dos dias, recortadas ao período e ao agora (o futuro não conta como aberto)
+    limite = min(fim, timezone.now()).timestamp()
+    inicios = [datetime.combine(data, time.min, tzinfo=tz).timestamp() for data in datas]
+    bordas = np.clip(np.array(inicios[1:] + [limite]), inicio.timestamp(), limite)
+    bordas = np.concatenate(([min(inicio.timestamp(), limite)], bordas))
+    abertas = _segundos_abertas(bordas, inicio, fim, control.device_id)
+
+    dias = []
+    for i, data in enumerate(datas):
+        linha = clima.get(data)
+        dia = {"date": data.isoformat()}
+        if linha and linha["count"]:
+            count = linha["count"]
+            dia.update({
+                "count": count,
+                "hours": linha["hours"],
+                "temperature": _rd(linha["temperature_sum"] / count),
+                "temperature_min": linha["temperature_min"],
+                "temperature_max": linha["temperature_max"],
+                "humidity": _rd(linha["humidity_sum"] / count),
+                "humidity_min": linha["humidity_min"],
+                "humidity_max": linha["humidity_max"],
+                "hours_below": linha["hours_below"],
+                "hours_above": linha["hours_above"],
+                "overheat_degree_hours": _rd(linha["overheat_degree_hours"]),
+            })
+        else:
+            dia.update({"count": 0, "hours": 0})
+        dia["curtain_open_seconds"] = {lado: round(float(abertas[lado][i])) for lado in LADOS}
+        dias.append(dia)
+    return dias
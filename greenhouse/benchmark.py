@@ -0,0 +1,239 @@
+"""
+Benchmark de carga: N ESPs e M dashboards simulados contra as views reais.
+
+Roda em processo, pelo django.test.Client (URLs, middlewares e views de
+verdade), num banco de teste descartável e com cache e métricas em
+diretórios temporários — nada do ambiente real é tocado. O banco de teste
+do SQLite é um arquivo no diretório temporário (não em memória), com as
+mesmas OPTIONS de settings (transaction_mode IMMEDIATE): cada commit paga
+o fsync e a trava de escrita como em produção. Os clientes se
+revezam em rodadas, sempre na mesma ordem (semente fixa), então duas
+execuções na mesma máquina são comparáveis.
+
+Por endpoint: requisições, latência (média, p50/p95/p99) e consultas ao
+banco por requisição; no total, requisições por segundo.
+"""
+import json
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from . import metrics
+from .models import GreenhouseControl
+
+# a cada quantas rodadas cada ESP confirma um movimento / cada dashboard abre o histórico
+RODADAS_POR_CONFIRMACAO = 5
+RODADAS_POR_HISTORICO = 10
+
+
+class Medidor:
+    """Latência e consultas de cada requisição, agrupadas por endpoint."""
+
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.consultas = defaultdict(int)
+        self.status = defaultdict(lambda: defaultdict(int))
+        self.ativo = True
+
+    def medir(self, nome, chamada):
+        contagem = [0]
+
+        def contar(execute, sql, params, many, context):
+            contagem[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            resposta = chamada()
+            if resposta.streaming:
+                # a consulta do streaming só roda ao consumir o corpo
+                b''.join(resposta.streaming_content)
+            duracao = time.perf_counter() - inicio
+
+        if self.ativo:
+            self.latencias[nome].append(duracao)
+            self.consultas[nome] += contagem[0]
+            self.status[nome][resposta.status_code] += 1
+        return resposta
+
+    def resumo(self, segundos):
+        endpoints = {}
+        for nome, latencias in sorted(self.latencias.items()):
+            ms = [x * 1000 for x in latencias]
+            cortes = statistics.quantiles(ms, n=100, method='inclusive') if len(ms) > 1 else ms * 99
+            endpoints[nome] = {
+                "requests": len(ms),
+                "mean_ms": round(statistics.fmean(ms), 3),
+                "p50_ms": round(cortes[49], 3),
+                "p95_ms": round(cortes[94], 3),
+                "p99_ms": round(cortes[98], 3),
+                "queries_per_request": round(self.consultas[nome] / len(ms), 2),
+                "status": {str(k): v for k, v in sorted(self.status[nome].items())},
+            }
+        total = sum(len(x) for x in self.latencias.values())
+        return {
+            "requests": total,
+            "seconds": round(segundos, 3),
+            "throughput_rps": round(total / segundos, 1) if segundos else None,
+            "endpoints": endpoints,
+        }
+
+
+def dispositivo_esp(indice):
+    return f'esp-{indice:03d}'
+
+
+class Esp:
+    def __init__(self, indice, rng):
+        self.client = Client(REMOTE_ADDR=f'10.0.0.{indice + 1}')
+        self.rng = rng
+        self.dispositivo = dispositivo_esp(indice)
+
+    def rodada(self, medidor, numero):
+        leitura = {
+            'temperature': round(self.rng.uniform(15, 35), 2),
+            'humidity': round(self.rng.uniform(40, 80), 2),
+            'device_id': self.dispositivo,
+        }
+        medidor.medir('sensor_data_api', lambda: self.client.post(
+            '/api/sensor-data/', data=json.dumps(leitura), content_type='application/json',
+        ))
+        medidor.medir('get_status_api[esp]', lambda: self.client.get(
+            '/api/status/', {'device': 'esp32', 'device_id': self.dispositivo},
+        ))
+        if numero % RODADAS_POR_CONFIRMACAO == 0:
+            lado = self.rng.choice(('left', 'right', 'both'))
+            medidor.medir('manual_control_esp_api', lambda: self.client.post(
+                '/api/manual-control-esp/',
+                data=json.dumps({'side': lado, 'action': 'stop', 'device_id': self.dispositivo}),
+                content_type='application/json',
+            ))
+
+
+class Dashboard:
+    def __init__(self, usuario, dispositivo):
+        self.client = Client()
+        self.client.force_login(usuario)
+        self.etag = None
+        self.filtro = {'device_id': dispositivo}
+
+    def rodada(self, medidor, numero):
+        extra = {'HTTP_IF_NONE_MATCH': self.etag} if self.etag else {}
+        resposta = medidor.medir(
+            'get_status_api[dashboard]', lambda: self.client.get('/api/status/', self.filtro, **extra),
+        )
+        self.etag = resposta.get('ETag', self.etag)
+        if numero % RODADAS_POR_HISTORICO == 0:
+            medidor.medir('historico_api', lambda: self.client.get('/api/historico/', self.filtro))
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def executar(esps=10, dashboards=5, rodadas=50, aquecimento=5, semente=0):
+    """Cria o banco de teste, roda a carga e devolve o resultado (dict pronto para JSON)."""
+    parametros = {
+        "esps": esps, "dashboards": dashboards, "rounds": rodadas, "warmup": aquecimento, "seed": semente,
+    }
+    temporario = tempfile.TemporaryDirectory(prefix='greenhouse-bench-')
+    ajuste = override_settings(
+        # mesma configuração de settings, em diretórios temporários
+        CACHES={
+            alias: {**opcoes, 'LOCATION': f'{temporario.name}/cache-{alias}'}
+            for alias, opcoes in settings.CACHES.items()
+        },
+        GREENHOUSE_METRICS_DIR=f'{temporario.name}/metrics',
+    )
+    setup_test_environment()
+    ajuste.enable()
+    nome_original = connection.settings_dict['NAME']
+    teste_original = connection.settings_dict.get('TEST', {})
+    if connection.vendor == 'sqlite':
+        # o padrão do Django para SQLite é um banco em memória, sem fsync
+        connection.settings_dict['TEST'] = {**teste_original, 'NAME': f'{temporario.name}/benchmark.sqlite3'}
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        rng = random.Random(semente)
+        GreenhouseControl.objects.bulk_create(
+            [GreenhouseControl(device_id=dispositivo_esp(i)) for i in range(esps)]
+        )
+        usuario = User.objects.create_user('benchmark', password='benchmark')
+        clientes = [Esp(i, rng) for i in range(esps)] + [
+            Dashboard(usuario, dispositivo_esp(i % max(esps, 1))) for i in range(dashboards)
+        ]
+
+        medidor = Medidor()
+        medidor.ativo = False
+        for numero in range(1, aquecimento + 1):
+            for cliente in clientes:
+                cliente.rodada(medidor, numero)
+
+        medidor.ativo = True
+        inicio = time.perf_counter()
+        for numero in range(1, rodadas + 1):
+            for cliente in clientes:
+                cliente.rodada(medidor, numero)
+        segundos = time.perf_counter() - inicio
+    finally:
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+        connection.settings_dict['TEST'] = teste_original
+        # as métricas da carga simulada não vão para o diretório real no atexit
+        metrics.registro.reiniciar()
+        ajuste.disable()
+        teardown_test_environment()
+        temporario.cleanup()
+
+    return {
+        "meta": {
+            "date": timezone.now().isoformat(),
+            "commit": _commit_atual(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            "transaction_mode": settings.DATABASES['default'].get('OPTIONS', {}).get('transaction_mode'),
+            "parameters": parametros,
+        },
+        **medidor.resumo(segundos),
+    }
+
+
+def comparar(atual, anterior):
+    """Linhas de texto com a variação (%) de latência e vazão em relação a `anterior`."""
+    def variacao(novo, velho):
+        if not velho:
+            return '   n/d'
+        return f'{(novo - velho) / velho * 100:+6.1f}%'
+
+    linhas = [
+        f"vazão: {atual['throughput_rps']} req/s ({variacao(atual['throughput_rps'], anterior['throughput_rps'])})"
+    ]
+    for nome, dados in atual['endpoints'].items():
+        antes = anterior['endpoints'].get(nome)
+        if antes is None:
+            linhas.append(f'{nome}: novo')
+            continue
+        linhas.append(
+            f"{nome}: p50 {variacao(dados['p50_ms'], antes['p50_ms'])}  "
+            f"p95 {variacao(dados['p95_ms'], antes['p95_ms'])}  "
+            f"p99 {variacao(dados['p99_ms'], antes['p99_ms'])}  "
+            f"consultas {antes['queries_per_request']} -> {dados['queries_per_request']}"
+        )
+    return linhas
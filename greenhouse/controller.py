@@ -0,0 +1,98 @@
+"""
+Controle automático das cortinas.
+
+Roda uma vez por nova leitura (chamado pela ingestão) e quando os
+parâmetros ou o modo mudam — nunca no GET de status, que fica só leitura.
+Grava o comando e o CurtainLog apenas quando a decisão muda.
+"""
+from django.db import transaction
+
+from .models import DISPOSITIVO_PADRAO, GreenhouseControl, CurtainLog
+from . import state
+
+
+def decidir(temperatura, control):
+    """Ação desejada ('open'/'close'/'stop') para as duas cortinas."""
+    if temperatura < control.min_temperature:
+        # fecha só se tiver algo aberto
+        if control.left_is_open or control.right_is_open:
+            return 'close'
+        return 'stop'
+
+    if temperatura > control.max_temperature:
+        # abre só se ainda não estiver totalmente aberta
+        if not (control.left_is_open and control.right_is_open):
+            return 'open'
+        return 'stop'
+
+    # entre min e max: não manda abrir nem fechar
+    return 'stop'
+
+
+def _decisao(control, latest):
+    """(ação desejada, mudou?) ou None fora do modo automático ou com o ESP offline."""
+    if control is None or not control.automatic_mode:
+        return None
+    ultimo_ping, _ = state.ultimo_heartbeat(control)
+    if not state.online(ultimo_ping):
+        return None
+    desired_action = decidir(latest.temperature, control)
+    atual = (control.auto_left_action, control.auto_right_action, control.curtain_status)
+    return desired_action, atual != (desired_action,) * 3
+
+
+def avaliar(dispositivo=DISPOSITIVO_PADRAO):
+    """
+    Aplica o modo automático à última leitura do dispositivo. Retorna a ação decidida ou None.
+
+    A decisão sai primeiro do estado em cache, sem trava: na maioria das
+    leituras o comando não muda e nada é gravado. Só quando muda o controle é
+    relido com select_for_update e a decisão refeita antes de gravar.
+    """
+    control, latest = state.obter_estado(dispositivo)
+    if control is None or latest is None:
+        return None
+    decisao = _decisao(control, latest)
+    if decisao is None:
+        return None
+    if not decisao[1]:
+        return decisao[0]
+
+    with transaction.atomic():
+        control = GreenhouseControl.objects.select_for_update().filter(device_id=dispositivo).first()
+        decisao = _decisao(control, latest)
+        if decisao is None:
+            return None
+        desired_action, mudou = decisao
+        # outro worker pode ter gravado o mesmo comando entre a leitura e a trava
+        if not mudou:
+            return desired_action
+
+        # guarda o status anterior para saber se o comando mudou
+        previous_status = control.curtain_status
+        control.auto_left_action = desired_action
+        control.auto_right_action = desired_action
+        control.curtain_status = desired_action
+        control.save(update_fields=["auto_left_action", "auto_right_action", "curtain_status"])
+        state.invalidar(dispositivo)
+
+        # REGISTRA LOG AUTOMÁTICO SOMENTE QUANDO O COMANDO MUDA
+        if desired_action in ['open', 'close'] and desired_action != previous_status:
+            # evita log idêntico em sequência
+            ultimo_log = CurtainLog.objects.filter(device_id=dispositivo).order_by("-timestamp").first()
+            if not (
+                ultimo_log and
+                ultimo_log.action == desired_action and
+                ultimo_log.side == 'both' and
+                ultimo_log.triggered_by_id is None
+            ):
+                CurtainLog.objects.create(
+                    device_id=dispositivo,
+                    side='both',
+                    action=desired_action,
+                    temperature=latest.temperature,
+                    humidity=latest.humidity,
+                    triggered_by=None,        # marca como "modo automático" no histórico
+                )
+
+    return desired_action
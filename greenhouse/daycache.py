@@ -0,0 +1,186 @@
+"""
+Cache por dia das séries do histórico.
+
+Um dia local já encerrado não muda mais, então a série de cada dia (e o seu
+resumo) fica guardada em um LRU em memória, limitado pelo total de pontos.
+Só o dia de hoje e as faltas no cache vão ao banco.
+
+Exceções à imutabilidade — lote do ESP com timestamp de um dia passado, ou
+retenção apagando agregados — trocam uma marca no cache compartilhado
+(por dia, ou uma época global) e as cópias antigas de todos os workers
+deixam de valer. O cache "default" pode descartar marcas; uma marca
+ausente conta como invalidação: o leitor cria uma nova (cache.add) em vez
+de voltar a casar com cópias anteriores à troca descartada.
+
+Memória: cada ponto guardado ocupa cerca de 0,5 KB em Python, então o
+limite padrão (50 mil pontos) fica perto de 25 MB por processo. Com a
+retenção padrão (minutos por 7 dias) isso cobre a semana em minutos de
+uns 5 dispositivos; dias mais antigos usam o nível horário, de 24 pontos.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import rollups
+from .models import DISPOSITIVO_PADRAO
+
+CHAVE_EPOCA = 'greenhouse:dias:epoca'
+MAX_PONTOS_PADRAO = 50_000
+
+
+def _cache():
+    return caches['default']
+
+
+def _chave_marca(dispositivo, data):
+    return f'greenhouse:dias:marca:{dispositivo}:{data.isoformat()}'
+
+
+class _LRU:
+    """LRU limitado pela soma de pontos guardados (não pelo número de dias)."""
+
+    def __init__(self):
+        self.itens = OrderedDict()
+        self.pontos = 0
+        self.lock = threading.Lock()
+
+    def obter(self, chave, marca):
+        with self.lock:
+            item = self.itens.get(chave)
+            if item is None or item[0] != marca:
+                return None
+            self.itens.move_to_end(chave)
+            return item[1], item[2]
+
+    def guardar(self, chave, marca, pontos, resumo):
+        limite = getattr(settings, 'GREENHOUSE_DAY_CACHE_MAX_POINTS', MAX_PONTOS_PADRAO)
+        with self.lock:
+            antigo = self.itens.pop(chave, None)
+            if antigo is not None:
+                self.pontos -= len(antigo[1])
+            self.itens[chave] = (marca, pontos, resumo)
+            self.pontos += len(pontos)
+            while self.pontos > limite and len(self.itens) > 1:
+                _, (_, removidos, _) = self.itens.popitem(last=False)
+                self.pontos -= len(removidos)
+
+    def limpar(self):
+        with self.lock:
+            self.itens.clear()
+            self.pontos = 0
+
+
+lru = _LRU()
+
+
+def _limites_do_dia(data, tz):
+    inicio = datetime.combine(data, time.min, tzinfo=tz)
+    return inicio, datetime.combine(data + timedelta(days=1), time.min, tzinfo=tz) - timedelta(microseconds=1)
+
+
+def _resumo(pontos):
+    """Resumo diário (média ponderada pela contagem, extremos) a partir dos baldes."""
+    if not pontos:
+        return None
+    count = sum(p["count"] for p in pontos)
+    return {
+        "count": count,
+        "temperature": round(sum(p["temperature"] * p["count"] for p in pontos) / count, 2),
+        "humidity": round(sum(p["humidity"] * p["count"] for p in pontos) / count, 2),
+        "temperature_min": min(p["temperature_min"] for p in pontos),
+        "temperature_max": max(p["temperature_max"] for p in pontos),
+        "humidity_min": min(p["humidity_min"] for p in pontos),
+        "humidity_max": max(p["humidity_max"] for p in pontos),
+    }
+
+
+def marcar_dias_alterados(datas, dispositivo=DISPOSITIVO_PADRAO):
+    """Invalida (após o commit) os dias encerrados do dispositivo que receberam dados atrasados."""
+    hoje = timezone.localdate()
+    chaves = {_chave_marca(dispositivo, data): uuid.uuid4().hex[:16] for data in set(datas) if data < hoje}
+    if chaves:
+        transaction.on_commit(lambda: _cache().set_many(chaves, timeout=None))
+
+
+def marcar_epoca():
+    """Invalida todos os dias (ex.: retenção apagou agregados antigos)."""
+    transaction.on_commit(lambda: _cache().set(CHAVE_EPOCA, uuid.uuid4().hex[:16], timeout=None))
+
+
+def _marcas(chaves):
+    """{chave: marca} das chaves, criando um token novo para as que faltarem."""
+    cache = _cache()
+    marcas = cache.get_many(chaves)
+    faltando = [chave for chave in chaves if chave not in marcas]
+    if faltando:
+        for chave in faltando:
+            cache.add(chave, uuid.uuid4().hex[:16], timeout=None)
+        marcas.update(cache.get_many(faltando))
+        # cache indisponível: um token local não casa com nenhuma cópia guardada
+        for chave in faltando:
+            marcas.setdefault(chave, uuid.uuid4().hex[:16])
+    return marcas
+
+
+def series_por_dia(nivel, inicio, fim, dispositivo=DISPOSITIVO_PADRAO):
+    """
+    Gera (data, pontos, resumo) para cada dia local do intervalo. Dias encerrados
+    vêm do LRU quando possível; hoje e faltas consultam o banco. Os pontos de
+    dias nas bordas são recortados para [inicio, fim].
+    """
+    tz = timezone.get_current_timezone()
+    hoje = timezone.localdate()
+    primeiro = timezone.localtime(inicio, tz).date()
+    ultimo = timezone.localtime(fim, tz).date()
+    datas = [primeiro + timedelta(days=i) for i in range((ultimo - primeiro).days + 1)]
+
+    fechados = [data for data in datas if data < hoje]
+    marcas = _marcas([CHAVE_EPOCA] + [_chave_marca(dispositivo, data) for data in fechados]) if fechados else {}
+    epoca = marcas.get(CHAVE_EPOCA)
+
+    for data in datas:
+        dia_inicio, dia_fim = _limites_do_dia(data, tz)
+        if data < hoje:
+            marca = (epoca, marcas.get(_chave_marca(dispositivo, data)))
+            chave = (dispositivo, nivel.nome, str(tz), data)
+            item = lru.obter(chave, marca)
+            if item is None:
+                pontos = list(rollups.iterar_pontos(nivel, dia_inicio, dia_fim, dispositivo=dispositivo))
+                item = (pontos, _resumo(pontos))
+                lru.guardar(chave, marca, *item)
+            pontos, resumo = item
+        else:
+            pontos = list(rollups.iterar_pontos(nivel, dia_inicio, dia_fim, dispositivo=dispositivo))
+            resumo = _resumo(pontos)
+
+        if dia_inicio < inicio or dia_fim > fim:
+            pontos = [p for p in pontos if inicio <= datetime.fromisoformat(p["timestamp"]) <= fim]
+        yield data, pontos, resumo
+
+
+def iterar_pontos(nivel, inicio, fim, depois=None, resumos=None, dispositivo=DISPOSITIVO_PADRAO):
+    """
+    Como rollups.iterar_pontos, mas passando pelo cache por dia. Se `resumos`
+    (lista) for dado, recebe {"date": ..., **resumo} de cada dia depois do
+    seu último ponto: quem para no meio do dia (página com limit) não leva o
+    resumo, que sai na página que termina o dia. O nível diário já tem um
+    ponto por dia e vai direto ao banco.
+    """
+    if nivel is rollups.DIA:
+        yield from rollups.iterar_pontos(nivel, inicio, fim, depois, dispositivo)
+        return
+    if depois is not None:
+        inicio = max(inicio, depois + timedelta(microseconds=1))
+    if inicio > fim:
+        return
+    for data, pontos, resumo in series_por_dia(nivel, inicio, fim, dispositivo):
+        yield from pontos
+        # depois do cursor, um dia sem pontos restantes já saiu inteiro na página anterior
+        if resumos is not None and resumo is not None and (pontos or depois is None):
+            resumos.append({"date": data.isoformat(), **resumo})
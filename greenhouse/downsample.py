@@ -0,0 +1,88 @@
+"""
+Redução de séries para o gráfico (Largest-Triangle-Three-Buckets, com NumPy).
+
+Mantém a forma visual — inclusive os picos — com um número fixo de pontos.
+"""
+from datetime import datetime
+
+import numpy as np
+
+
+def lttb(x, y, alvo):
+    """Índices dos `alvo` pontos escolhidos pelo LTTB (sempre inclui o primeiro e o último)."""
+    if alvo < 3:
+        raise ValueError('LTTB precisa de pelo menos 3 pontos (primeiro, último e um balde)')
+    n = len(x)
+    if alvo >= n:
+        return np.arange(n)
+
+    # pontos internos (1..n-2) divididos em alvo-2 baldes
+    bordas = np.linspace(1, n - 1, alvo - 1).astype(np.int64)
+    indices = np.empty(alvo, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(alvo - 2):
+        inicio, fim = bordas[i], bordas[i + 1]
+        # vértice C: média do balde seguinte (no último balde, o último ponto)
+        if i + 2 < len(bordas):
+            cx = x[bordas[i + 1]:bordas[i + 2]].mean()
+            cy = y[bordas[i + 1]:bordas[i + 2]].mean()
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+        ax, ay = x[a], y[a]
+        # área (x2) do triângulo A-B-C para todos os candidatos B do balde de uma vez
+        areas = np.abs((ax - cx) * (y[inicio:fim] - ay) - (ax - x[inicio:fim]) * (cy - ay))
+        a = inicio + int(areas.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def _extremos(x, series, alvo):
+    """Para alvos pequenos demais para o LTTB: primeiro, último e os picos de cada série."""
+    candidatos = [0, len(x) - 1]
+    extremos = [(int(y.argmax()), int(y.argmin())) for y in series]
+    # primeiro o pico mais afastado da mediana de cada série, depois o outro extremo
+    for y, (maximo, minimo) in zip(series, extremos):
+        mediana = np.median(y)
+        candidatos.append(maximo if y[maximo] - mediana >= mediana - y[minimo] else minimo)
+    for par in extremos:
+        candidatos += par
+    return np.sort(np.fromiter(dict.fromkeys(candidatos), dtype=np.int64)[:alvo])
+
+
+def reduzir_serie(pontos, alvo):
+    """
+    Subconjunto de `pontos` (dicts com timestamp/temperature/humidity) com no
+    máximo `alvo` itens: o LTTB roda em cada série e os índices são unidos.
+    Como as séries compartilham pontos, o alvo de cada uma cresce enquanto a
+    união ainda couber em `alvo`.
+    """
+    if len(pontos) <= alvo:
+        return pontos
+
+    x = np.fromiter(
+        (datetime.fromisoformat(p["timestamp"]).timestamp() for p in pontos),
+        dtype=np.float64, count=len(pontos),
+    )
+    temperaturas = np.fromiter((p["temperature"] for p in pontos), dtype=np.float64, count=len(pontos))
+    humidades = np.fromiter((p["humidity"] for p in pontos), dtype=np.float64, count=len(pontos))
+
+    # abaixo de 3 pontos por série o LTTB não tem balde interno
+    if alvo < 6:
+        return [pontos[i] for i in _extremos(x, (temperaturas, humidades), alvo)]
+
+    def unir(metade):
+        return np.union1d(lttb(x, temperaturas, metade), lttb(x, humidades, metade))
+
+    metade = alvo // 2
+    indices = unir(metade)
+    while len(indices) < alvo and metade < len(pontos):
+        # cada passo fecha cerca de metade da folga que sobrou
+        metade += max(1, (alvo - len(indices)) // 2)
+        maiores = unir(metade)
+        if len(maiores) > alvo:
+            break
+        indices = maiores
+    return [pontos[i] for i in indices]
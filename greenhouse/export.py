@@ -0,0 +1,108 @@
+"""
+Exportação de dados em CSV ou NDJSON, gerada aos poucos.
+
+As linhas vêm do banco em chunks (values_list().iterator()), são formatadas
+em blocos e, opcionalmente, comprimidas com gzip na hora — a memória fica
+constante qualquer que seja o período. Nos logs de cortina o nome do
+usuário vem no mesmo SELECT (JOIN), não uma consulta por linha.
+"""
+import csv
+import io
+import json
+import zlib
+
+from .models import DISPOSITIVO_PADRAO, SensorReading, MinuteAverage, HourlyAverage, DailyAverage, CurtainLog
+
+TAMANHO_CHUNK = 2000
+FORMATOS = ('csv', 'ndjson')
+
+CAMPOS_ROLLUP = (
+    'timestamp', 'count', 'temperature_sum', 'humidity_sum',
+    'temperature_min', 'temperature_max', 'humidity_min', 'humidity_max',
+)
+COLUNAS_ROLLUP = (
+    'timestamp', 'count', 'temperature', 'humidity',
+    'temperature_min', 'temperature_max', 'humidity_min', 'humidity_max',
+)
+
+
+def _rollup(linha):
+    ts, count, t_sum, h_sum, t_min, t_max, h_min, h_max = linha
+    return (ts, count, t_sum / count if count else None, h_sum / count if count else None,
+            t_min, t_max, h_min, h_max)
+
+
+class Fonte:
+    def __init__(self, model, campos, colunas=None, converter=None):
+        self.model = model
+        self.campos = campos
+        self.colunas = colunas or campos
+        self.converter = converter
+
+    def linhas(self, inicio, fim, dispositivo=DISPOSITIVO_PADRAO):
+        consulta = (
+            self.model.objects
+            .filter(device_id=dispositivo, timestamp__range=(inicio, fim))
+            .order_by('timestamp')
+            .values_list(*self.campos)
+        )
+        for linha in consulta.iterator(chunk_size=TAMANHO_CHUNK):
+            yield self.converter(linha) if self.converter else linha
+
+
+FONTES = {
+    'readings': Fonte(SensorReading, ('timestamp', 'temperature', 'humidity')),
+    'minute': Fonte(MinuteAverage, CAMPOS_ROLLUP, COLUNAS_ROLLUP, _rollup),
+    'hourly': Fonte(HourlyAverage, CAMPOS_ROLLUP, COLUNAS_ROLLUP, _rollup),
+    'daily': Fonte(DailyAverage, CAMPOS_ROLLUP, COLUNAS_ROLLUP, _rollup),
+    'curtain': Fonte(
+        CurtainLog,
+        ('timestamp', 'side', 'action', 'temperature', 'humidity', 'triggered_by__username'),
+        ('timestamp', 'side', 'action', 'temperature', 'humidity', 'triggered_by'),
+    ),
+}
+
+
+def _valor(valor):
+    return valor.isoformat() if hasattr(valor, 'isoformat') else valor
+
+
+def _csv(colunas, linhas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    for i, linha in enumerate(linhas, 1):
+        escritor.writerow([_valor(v) for v in linha])
+        if i % TAMANHO_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson(colunas, linhas):
+    bloco = []
+    for linha in linhas:
+        bloco.append(json.dumps(dict(zip(colunas, (_valor(v) for v in linha)))))
+        if len(bloco) == TAMANHO_CHUNK:
+            yield "\n".join(bloco) + "\n"
+            bloco = []
+    if bloco:
+        yield "\n".join(bloco) + "\n"
+
+
+def _gzip(blocos):
+    compressor = zlib.compressobj(wbits=31)  # 31 = cabeçalho gzip
+    for bloco in blocos:
+        comprimido = compressor.compress(bloco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+
+def gerar(fonte, inicio, fim, formato='csv', comprimir=False, dispositivo=DISPOSITIVO_PADRAO):
+    """Gerador de bytes com a exportação de `fonte` do dispositivo no intervalo."""
+    fonte = FONTES[fonte]
+    formatar = _csv if formato == 'csv' else _ndjson
+    blocos = (texto.encode('utf-8') for texto in formatar(fonte.colunas, fonte.linhas(inicio, fim, dispositivo)))
+    return _gzip(blocos) if comprimir else blocos
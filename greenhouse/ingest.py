@@ -0,0 +1,41 @@
+"""Gravação de leituras do sensor: tabela bruta, agregados e controle automático."""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SensorReading
+from . import controller, daycache, metrics, rollups, state
+
+
+def salvar_leituras(leituras):
+    """
+    Um único INSERT para o lote, um upsert por balde afetado e uma avaliação do
+    controle por dispositivo. Um lote do ESP é de um só dispositivo; um grupo
+    da escrita adiada (writebehind.py) pode misturar vários.
+    """
+    dias = {}
+    ultimas = {}
+    for leitura in leituras:
+        dias.setdefault(leitura.device_id, set()).add(timezone.localdate(leitura.timestamp))
+        ultima = ultimas.get(leitura.device_id)
+        if ultima is None or leitura.timestamp >= ultima.timestamp:
+            ultimas[leitura.device_id] = leitura
+    with transaction.atomic():
+        # o primeiro lote de um ESP novo é o que cria o seu controle
+        for dispositivo in dias:
+            if state.obter_controle(dispositivo) is None:
+                state.provisionar(dispositivo)
+        SensorReading.objects.bulk_create(leituras)
+        baldes = rollups.registrar_leituras(leituras)
+        for dispositivo, datas in dias.items():
+            # só a última leitura muda no estado em cache: o controle continua válido
+            state.publicar_leitura(dispositivo, ultimas[dispositivo])
+            # leituras atrasadas (lote do ESP) podem mudar dias já encerrados
+            daycache.marcar_dias_alterados(datas, dispositivo)
+
+    metrics.incrementar('greenhouse_readings_ingested_total', len(leituras))
+    for nivel, quantidade in baldes.items():
+        metrics.incrementar('greenhouse_rollup_buckets_upserted_total', quantidade, tier=nivel)
+
+    # fora da transação: o controle vê a leitura já confirmada
+    for dispositivo in dias:
+        controller.avaliar(dispositivo)
@@ -0,0 +1,59 @@
+"""
+Trechos de estado das cortinas (CurtainInterval).
+
+Mantidos de forma incremental: quando o ESP confirma um 'stop', o trecho
+atual do lado é fechado e outro começa, se a posição mudou. Os trechos de
+um lado não se sobrepõem, então "qual era o estado em t" e "o que aconteceu
+em [inicio, fim]" são buscas pelo índice (device_id, side, start), sem reler o log.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DISPOSITIVO_PADRAO, CurtainInterval, GreenhouseControl
+
+LADOS = ('left', 'right')
+
+
+def sincronizar(control, momento=None):
+    """Alinha o trecho atual de cada lado à posição gravada em `control`."""
+    momento = momento or timezone.now()
+    with transaction.atomic():
+        # a trava no controle serializa as confirmações concorrentes do ESP
+        control = GreenhouseControl.objects.select_for_update().get(pk=control.pk)
+        atuais = {
+            trecho.side: trecho
+            for trecho in CurtainInterval.objects.filter(device_id=control.device_id, side__in=LADOS, end__isnull=True)
+        }
+        for lado in LADOS:
+            estado = 'open' if getattr(control, f'{lado}_is_open') else 'closed'
+            atual = atuais.get(lado)
+            if atual is not None and atual.state == estado:
+                continue
+            if atual is not None:
+                atual.end = momento
+                atual.save(update_fields=['end'])
+            CurtainInterval.objects.create(device_id=control.device_id, side=lado, state=estado, start=momento)
+
+
+def trecho_em(lado, momento, dispositivo=DISPOSITIVO_PADRAO):
+    """Trecho em vigor no instante `momento` (None se anterior ao primeiro registro)."""
+    return (
+        CurtainInterval.objects
+        .filter(device_id=dispositivo, side=lado, start__lte=momento)
+        .order_by('-start')
+        .first()
+    )
+
+
+def sobrepostos(lado, inicio, fim, dispositivo=DISPOSITIVO_PADRAO):
+    """Trechos de `lado` que tocam [inicio, fim], em ordem de início."""
+    trechos = list(
+        CurtainInterval.objects
+        .filter(device_id=dispositivo, side=lado, start__gt=inicio, start__lte=fim)
+        .order_by('start')
+    )
+    # o trecho que já vinha de antes do início
+    anterior = trecho_em(lado, inicio, dispositivo)
+    if anterior is not None and (anterior.end is None or anterior.end >= inicio):
+        trechos.insert(0, anterior)
+    return trechos
@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from greenhouse import export, periodos
+from greenhouse.models import DISPOSITIVO_PADRAO
+
+
+class Command(BaseCommand):
+    help = 'Exporta leituras, agregados ou logs de cortina em CSV/NDJSON, em streaming'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fonte', choices=sorted(export.FONTES))
+        parser.add_argument('--start', help='Data (YYYY-MM-DD) ou data e hora ISO. Padrão: 7 dias atrás.')
+        parser.add_argument('--end', help='Data (YYYY-MM-DD) ou data e hora ISO. Padrão: hoje.')
+        parser.add_argument('--format', choices=export.FORMATOS, default='csv')
+        parser.add_argument('--device', default=DISPOSITIVO_PADRAO, help='Dispositivo (estufa) exportado.')
+        parser.add_argument('--gzip', action='store_true', help='Comprime a saída com gzip.')
+        parser.add_argument('--output', '-o', default='-', help='Arquivo de saída (padrão: stdout).')
+
+    def handle(self, *args, **options):
+        try:
+            inicio, fim = periodos.periodo(options['start'], options['end'])
+        except ValueError as e:
+            raise CommandError(f"Período inválido: {e}")
+
+        blocos = export.gerar(
+            options['fonte'], inicio, fim, options['format'], options['gzip'], dispositivo=options['device'],
+        )
+        if options['output'] == '-':
+            destino = sys.stdout.buffer
+            for bloco in blocos:
+                destino.write(bloco)
+            destino.flush()
+            return
+
+        total = 0
+        with open(options['output'], 'wb') as destino:
+            for bloco in blocos:
+                destino.write(bloco)
+                total += len(bloco)
+        self.stderr.write(self.style.SUCCESS(f"{total} bytes gravados em {options['output']}."))
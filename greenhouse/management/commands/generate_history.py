@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from greenhouse import synthetic
+from greenhouse.models import DISPOSITIVO_PADRAO
+
+
+class Command(BaseCommand):
+    help = 'Gera histórico sintético (leituras, agregados e cortinas) em massa, para testes de desempenho'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='Dias locais de histórico (padrão: 365).')
+        parser.add_argument('--interval', type=int, default=10,
+                            help='Segundos entre leituras (padrão: 10; 365 dias = ~3,2M leituras).')
+        parser.add_argument('--end', help='Fim do histórico, ISO 8601 (padrão: agora).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--device', default=DISPOSITIVO_PADRAO, help='Dispositivo (estufa) dos dados.')
+        parser.add_argument('--days-per-batch', type=int, default=synthetic.DIAS_POR_BLOCO,
+                            help='Dias por transação.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Apaga leituras, agregados e histórico das cortinas do dispositivo antes de gerar.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['interval'] < 1 or options['days_per_batch'] < 1:
+            raise CommandError('--days, --interval e --days-per-batch precisam ser positivos.')
+        fim = None
+        if options['end']:
+            fim = parse_datetime(options['end'])
+            if fim is None:
+                raise CommandError(f"Data inválida: {options['end']}")
+            if timezone.is_naive(fim):
+                fim = timezone.make_aware(fim)
+
+        inicio = time.perf_counter()
+        try:
+            leituras = synthetic.gerar(
+                dias=options['days'],
+                passo=options['interval'],
+                fim=fim,
+                semente=options['seed'],
+                apagar=options['clear'],
+                dias_por_bloco=options['days_per_batch'],
+                escrever=self.stdout.write if options['verbosity'] > 1 else None,
+                dispositivo=options['device'],
+            )
+        except synthetic.BancoNaoVazio as e:
+            raise CommandError(f'O dispositivo já tem dados ({e}); use --clear para apagá-los antes.')
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{leituras} leituras geradas em {segundos:.1f}s ({leituras / segundos:.0f} leituras/s).'
+        ))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from greenhouse import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de carga (ESPs e dashboards simulados) num banco de teste descartável; salva o resultado em JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--esps', type=int, default=10, help='ESPs simulados.')
+        parser.add_argument('--dashboards', type=int, default=5, help='Dashboards consultando o status.')
+        parser.add_argument('--rounds', type=int, default=50, help='Rodadas medidas.')
+        parser.add_argument('--warmup', type=int, default=5, help='Rodadas de aquecimento (não medidas).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o', help='Arquivo JSON (padrão: benchmark-<data>.json).')
+        parser.add_argument('--compare', help='JSON de uma execução anterior para comparar.')
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    anterior = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Não foi possível ler {options['compare']}: {e}")
+
+        resultado = benchmark.executar(
+            esps=options['esps'],
+            dashboards=options['dashboards'],
+            rodadas=options['rounds'],
+            aquecimento=options['warmup'],
+            semente=options['seed'],
+        )
+
+        destino = options['output'] or f"benchmark-{timezone.localtime():%Y%m%d-%H%M%S}.json"
+        with open(destino, 'w') as f:
+            json.dump(resultado, f, indent=2)
+
+        self.stdout.write(f"{resultado['requests']} requisições em {resultado['seconds']}s "
+                          f"({resultado['throughput_rps']} req/s)")
+        for nome, dados in resultado['endpoints'].items():
+            self.stdout.write(
+                f"  {nome:28} n={dados['requests']:<6} p50={dados['p50_ms']:.2f}ms "
+                f"p95={dados['p95_ms']:.2f}ms p99={dados['p99_ms']:.2f}ms "
+                f"consultas/req={dados['queries_per_request']}"
+            )
+        if anterior:
+            self.stdout.write('Comparação com ' + options['compare'] + ':')
+            for linha in benchmark.comparar(resultado, anterior):
+                self.stdout.write('  ' + linha)
+        self.stdout.write(self.style.SUCCESS(f'Resultado salvo em {destino}.'))
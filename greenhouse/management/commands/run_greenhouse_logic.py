@@ -1,41 +1,54 @@
-import time
-import random
-from django.core.management.base import BaseCommand
-from greenhouse.models import SensorReading, GreenhouseControl
+import asyncio
 
-class Command(BaseCommand):
-    help = 'Executa a lógica de simulação da estufa inteligente'
+from django.core.management.base import BaseCommand, CommandError
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write(self.style.SUCCESS('Iniciando simulação da estufa...'))
+from greenhouse import simulator
 
-        control, _ = GreenhouseControl.objects.get_or_create(singleton=True)
 
-        while True:
-            # 1. Simular leitura do sensor
-            current_temp = round(random.uniform(15.0, 35.0), 2)
-            current_humidity = round(random.uniform(40.0, 80.0), 2)
+class Command(BaseCommand):
+    help = 'Simula centenas de ESP32 (asyncio) contra a API HTTP, para teste de carga'
 
-            SensorReading.objects.create(temperature=current_temp, humidity=current_humidity)
-            self.stdout.write(f'Nova leitura: Temp={current_temp}°C, Umidade={current_humidity}%')
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Endereço do servidor (só http://).')
+        parser.add_argument('--devices', type=int, default=100, help='ESPs virtuais.')
+        parser.add_argument('--reading-interval', type=float, default=10.0,
+                            help='Segundos entre leituras de cada ESP.')
+        parser.add_argument('--status-interval', type=float, default=2.0,
+                            help='Segundos entre consultas de status (heartbeat) de cada ESP.')
+        parser.add_argument('--batch', type=int, default=1,
+                            help='Leituras acumuladas por POST (1 = uma por requisição, como o firmware).')
+        parser.add_argument('--connections', type=int, default=50, help='Conexões HTTP simultâneas.')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Aceleração do relógio simulado (curva do dia e curso das cortinas).')
+        parser.add_argument('--duration', type=float, default=0, help='Duração em segundos (0 = até Ctrl+C).')
+        parser.add_argument('--report-interval', type=float, default=10.0)
+        parser.add_argument('--seed', type=int, default=0)
 
-            # 2. Obter a configuração atual
-            control.refresh_from_db()
-            desired_temp = control.desired_temperature
+    def handle(self, *args, **options):
+        if options['devices'] < 1 or options['connections'] < 1 or options['batch'] < 1:
+            raise CommandError('--devices, --connections e --batch devem ser pelo menos 1.')
+        if options['speed'] <= 0:
+            raise CommandError('--speed deve ser positivo.')
 
-            # 3. Aplicar a lógica de controle
-            # Se a temperatura atual for maior que a desejada, abre a cortina.
-            # Se for menor, fecha a cortina.
-            if current_temp > desired_temp:
-                if not control.curtain_is_open:
-                    control.curtain_is_open = True
-                    control.save()
-                    self.stdout.write(self.style.WARNING('Temperatura alta! Abrindo a cortina.'))
-            else:
-                if control.curtain_is_open:
-                    control.curtain_is_open = False
-                    control.save()
-                    self.stdout.write(self.style.SUCCESS('Temperatura OK! Fechando a cortina.'))
-            
-            # Espera 10 segundos para a próxima simulação
-            time.sleep(10)
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(
+            f"Simulando {options['devices']} ESPs contra {options['url']} "
+            f"(leitura a cada {options['reading_interval']}s, status a cada {options['status_interval']}s)."
+        ))
+        try:
+            asyncio.run(simulator.executar(
+                options['url'],
+                dispositivos=options['devices'],
+                intervalo_leitura=options['reading_interval'],
+                intervalo_status=options['status_interval'],
+                lote=options['batch'],
+                conexoes=options['connections'],
+                velocidade=options['speed'],
+                duracao=options['duration'],
+                intervalo_relatorio=options['report_interval'],
+                semente=options['seed'],
+                escrever=self.stdout.write,
+            ))
+        except ValueError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            self.stdout.write('Simulação interrompida.')
@@ -0,0 +1,51 @@
+import fcntl
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from greenhouse import retention
+
+
+class Command(BaseCommand):
+    help = 'Apaga dados antigos conforme as políticas de retenção (GREENHOUSE_RETENTION), em lotes pequenos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Fica em execução, aplicando as políticas a cada --interval segundos.')
+        parser.add_argument('--interval', type=int, default=300,
+                            help='Intervalo entre execuções no modo --loop (padrão: 300s).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Registros por lote (padrão: GREENHOUSE_RETENTION_BATCH_SIZE ou 500).')
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Pausa em segundos entre lotes (padrão: GREENHOUSE_RETENTION_PAUSE ou 0.05).')
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help='Tempo máximo por execução; o restante fica para a próxima.')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self._executar(options)
+            return
+
+        # Garante um único agendador mesmo que o comando seja iniciado mais de uma vez
+        caminho = os.path.join(tempfile.gettempdir(), 'greenhouse_retention.lock')
+        lock = open(caminho, 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise CommandError('Já existe um agendador de retenção em execução.')
+
+        self.stdout.write(self.style.SUCCESS(f"Agendador de retenção iniciado (a cada {options['interval']}s)."))
+        while True:
+            self._executar(options)
+            time.sleep(options['interval'])
+
+    def _executar(self, options):
+        resultados = retention.aplicar(
+            tamanho_lote=options['batch_size'],
+            pausa=options['pause'],
+            max_segundos=options['max_seconds'],
+        )
+        for resultado in resultados:
+            self.stdout.write(str(resultado))
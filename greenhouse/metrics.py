@@ -0,0 +1,317 @@
+"""
+Métricas no formato texto do Prometheus (GET /metrics).
+
+Cada processo (workers do servidor, run_retention, ...) soma em memória e,
+no máximo a cada INTERVALO_GRAVACAO segundos, grava um arquivo próprio em
+GREENHOUSE_METRICS_DIR (escrita atômica via os.replace). O /metrics lê e
+soma os arquivos de todos os processos, então os totais batem com qualquer
+número de workers. Os arquivos de processos que já terminaram (pid do nome
+sem processo vivo) são somados em ARQUIVO_ENCERRADOS e apagados: os
+contadores continuam só crescendo sem acumular um arquivo por processo.
+
+O custo por requisição é um punhado de somas em dicionário sob uma trava;
+a serialização fica de fora do caminho quente na maior parte das vezes.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+# limites (segundos) dos baldes do histograma de latência
+BALDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INTERVALO_GRAVACAO = 1.0
+# soma dos arquivos de processos encerrados
+ARQUIVO_ENCERRADOS = 'encerrados.json'
+
+AJUDA = {
+    'greenhouse_http_requests_total': ('counter', 'Requisições por view, método e status.'),
+    'greenhouse_http_request_duration_seconds': ('histogram', 'Latência das requisições por view.'),
+    'greenhouse_db_queries_total': ('counter', 'Consultas ao banco feitas pelas requisições, por view.'),
+    'greenhouse_db_query_seconds_total': ('counter', 'Tempo gasto no banco pelas requisições, por view.'),
+    'greenhouse_readings_ingested_total': ('counter', 'Leituras do sensor gravadas.'),
+    'greenhouse_rollup_buckets_upserted_total': ('counter', 'Baldes de agregado atualizados, por nível.'),
+    'greenhouse_retention_deleted_total': ('counter', 'Registros apagados pela retenção, por tabela.'),
+    'greenhouse_write_behind_groups_total': ('counter', 'Grupos de leituras gravados pela escrita adiada.'),
+    'greenhouse_write_behind_flush_seconds': ('histogram', 'Duração da gravação de cada grupo adiado.'),
+    'greenhouse_write_behind_rejected_total': ('counter', 'Leituras recusadas com a fila adiada cheia (503).'),
+    'greenhouse_write_behind_dropped_total': ('counter', 'Leituras adiadas perdidas por erro na gravação.'),
+    'greenhouse_write_behind_queued': ('gauge', 'Leituras na fila de escrita adiada deste processo.'),
+    'greenhouse_esp_online': ('gauge', '1 se o ESP fez contato recentemente.'),
+    'greenhouse_esp_last_contact_seconds': ('gauge', 'Segundos desde o último contato do ESP.'),
+}
+
+
+def _diretorio():
+    return getattr(settings, 'GREENHOUSE_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'greenhouse_metrics'))
+
+
+def _gravar_json(destino, dados):
+    """Escrita atômica: quem lê nunca vê um arquivo pela metade."""
+    with open(destino + '.tmp', 'w') as f:
+        json.dump(dados, f)
+    os.replace(destino + '.tmp', destino)
+
+
+class _Registro:
+    """Valores deste processo: contadores e histogramas indexados por (nome, rótulos)."""
+
+    def __init__(self):
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Zera os valores; usado no filho de um fork (senão herdaria os do pai)."""
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.ultima_gravacao = 0.0
+        # pid + sufixo: um pid reaproveitado não sobrescreve o arquivo de outro processo
+        self.arquivo = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+        self._talvez_gravar()
+
+    def observar(self, nome, valor, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            hist = self.histogramas.get(chave)
+            if hist is None:
+                # contagem por balde (não acumulada; o último é +Inf) e a soma no fim
+                hist = self.histogramas[chave] = [0] * (len(BALDES) + 1) + [0.0]
+            hist[bisect.bisect_left(BALDES, valor)] += 1
+            hist[-1] += valor
+        self._talvez_gravar()
+
+    def _talvez_gravar(self):
+        if time.monotonic() - self.ultima_gravacao >= INTERVALO_GRAVACAO:
+            self.gravar()
+
+    def gravar(self):
+        with self.lock:
+            self.ultima_gravacao = time.monotonic()
+            if not self.contadores and not self.histogramas:
+                return
+            dados = {
+                'contadores': [[n, r, v] for (n, r), v in self.contadores.items()],
+                'histogramas': [[n, r, h] for (n, r), h in self.histogramas.items()],
+            }
+        diretorio = _diretorio()
+        try:
+            os.makedirs(diretorio, exist_ok=True)
+            _gravar_json(os.path.join(diretorio, self.arquivo), dados)
+        except OSError:
+            # métricas nunca derrubam uma requisição
+            pass
+
+
+registro = _Registro()
+atexit.register(registro.gravar)
+os.register_at_fork(after_in_child=registro.reiniciar)
+
+incrementar = registro.incrementar
+observar = registro.observar
+
+
+def _listar(diretorio):
+    try:
+        return [n for n in os.listdir(diretorio) if n.endswith('.json')]
+    except OSError:
+        return []
+
+
+def _encerrado(nome):
+    """O arquivo `{pid}-{sufixo}.json` é de um processo que já terminou?"""
+    pid = nome.split('-', 1)[0]
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # existe, só é de outro usuário
+        pass
+    return False
+
+
+def _recolher_encerrados(diretorio, nomes):
+    """Soma os arquivos de processos encerrados em ARQUIVO_ENCERRADOS e os apaga."""
+    encerrados = [nome for nome in nomes if _encerrado(nome)]
+    if not encerrados:
+        return
+    try:
+        with open(os.path.join(diretorio, '.trava'), 'w') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            # outro processo pode ter recolhido os mesmos enquanto esperávamos a trava
+            encerrados = [nome for nome in encerrados if os.path.exists(os.path.join(diretorio, nome))]
+            if not encerrados:
+                return
+            contadores, histogramas = _ler(diretorio, [ARQUIVO_ENCERRADOS] + encerrados)
+            _gravar_json(os.path.join(diretorio, ARQUIVO_ENCERRADOS), {
+                'contadores': [[n, r, v] for (n, r), v in contadores.items()],
+                'histogramas': [[n, r, h] for (n, r), h in histogramas.items()],
+            })
+            for nome in encerrados:
+                os.unlink(os.path.join(diretorio, nome))
+    except OSError:
+        pass
+
+
+def _somar_processos():
+    """Soma os arquivos de todos os processos (inclusive este, gravado agora)."""
+    registro.gravar()
+    diretorio = _diretorio()
+    _recolher_encerrados(diretorio, _listar(diretorio))
+    return _ler(diretorio, _listar(diretorio))
+
+
+def _ler(diretorio, nomes):
+    """({(métrica, rótulos): valor}, {(métrica, rótulos): histograma}) somados dos arquivos."""
+    contadores, histogramas = {}, {}
+    for nome in nomes:
+        try:
+            with open(os.path.join(diretorio, nome)) as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metrica, rotulos, valor in dados['contadores']:
+            chave = (metrica, tuple(tuple(par) for par in rotulos))
+            contadores[chave] = contadores.get(chave, 0) + valor
+        for metrica, rotulos, hist in dados['histogramas']:
+            chave = (metrica, tuple(tuple(par) for par in rotulos))
+            atual = histogramas.setdefault(chave, [0] * len(hist))
+            for i, valor in enumerate(hist):
+                atual[i] += valor
+    return contadores, histogramas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(pares):
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exportar(medidores=()):
+    """Texto de exposição do Prometheus; `medidores` = [(nome, rótulos, valor)] calculados agora."""
+    contadores, histogramas = _somar_processos()
+    linhas = []
+    vistos = set()
+
+    def cabecalho(nome):
+        if nome not in vistos:
+            vistos.add(nome)
+            tipo, ajuda = AJUDA.get(nome, ('untyped', ''))
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} {tipo}')
+
+    for (nome, rotulos), valor in sorted(contadores.items()):
+        cabecalho(nome)
+        linhas.append(f'{nome}{_rotulos(rotulos)} {_numero(valor)}')
+
+    for (nome, rotulos), hist in sorted(histogramas.items()):
+        cabecalho(nome)
+        acumulado = 0
+        for limite, quantidade in zip(BALDES + ('+Inf',), hist[:-1]):
+            acumulado += quantidade
+            linhas.append(f'{nome}_bucket{_rotulos(rotulos + (("le", limite),))} {acumulado}')
+        linhas.append(f'{nome}_sum{_rotulos(rotulos)} {_numero(hist[-1])}')
+        linhas.append(f'{nome}_count{_rotulos(rotulos)} {acumulado}')
+
+    for nome, rotulos, valor in medidores:
+        cabecalho(nome)
+        linhas.append(f'{nome}{_rotulos(tuple(rotulos))} {_numero(valor)}')
+    return '\n'.join(linhas) + '\n'
+
+
+class _Medicao:
+    """Tempo e consultas ao banco de uma requisição, registrados quando a resposta termina."""
+
+    def __init__(self, request):
+        self.request = request
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.segundos_banco = 0.0
+
+    def consulta(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.segundos_banco += time.perf_counter() - inicio
+
+    def registrar(self, response):
+        match = getattr(self.request, 'resolver_match', None)
+        view = (match.url_name if match else None) or 'unmatched'
+        incrementar(
+            'greenhouse_http_requests_total', view=view, method=self.request.method, status=response.status_code,
+        )
+        observar('greenhouse_http_request_duration_seconds', time.perf_counter() - self.inicio, view=view)
+        incrementar('greenhouse_db_queries_total', self.consultas, view=view)
+        incrementar('greenhouse_db_query_seconds_total', self.segundos_banco, view=view)
+
+    def concluir(self, response):
+        if not response.streaming:
+            self.registrar(response)
+        # as consultas do streaming rodam enquanto o corpo é consumido
+        elif response.is_async:
+            response.streaming_content = self._medir_async(response.streaming_content, response)
+        else:
+            response.streaming_content = self._medir(response.streaming_content, response)
+        return response
+
+    def _medir(self, conteudo, response):
+        with connection.execute_wrapper(self.consulta):
+            yield from conteudo
+        self.registrar(response)
+
+    async def _medir_async(self, conteudo, response):
+        with connection.execute_wrapper(self.consulta):
+            async for parte in conteudo:
+                yield parte
+        self.registrar(response)
+
+
+class MetricsMiddleware:
+    """Contagem, latência e consultas ao banco de cada requisição, por nome de URL (WSGI e ASGI)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicao = _Medicao(request)
+        with connection.execute_wrapper(medicao.consulta):
+            response = self.get_response(request)
+        return medicao.concluir(response)
+
+    async def __acall__(self, request):
+        medicao = _Medicao(request)
+        with connection.execute_wrapper(medicao.consulta):
+            response = await self.get_response(request)
+        return medicao.concluir(response)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0011_greenhousecontrol_curtain_move_time_seconds'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sensorreading',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
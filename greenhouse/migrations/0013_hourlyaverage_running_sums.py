@@ -0,0 +1,78 @@
+from django.db import migrations, models
+
+
+def preencher_somas(apps, schema_editor):
+    HourlyAverage = apps.get_model('greenhouse', 'HourlyAverage')
+    for media in HourlyAverage.objects.all().iterator():
+        media.temperature_sum = media.temperature * media.count
+        media.humidity_sum = media.humidity * media.count
+        # min/max das leituras brutas já não existem; a média é a melhor aproximação
+        media.temperature_min = media.temperature_max = media.temperature
+        media.humidity_min = media.humidity_max = media.humidity
+        media.save()
+
+
+def restaurar_medias(apps, schema_editor):
+    HourlyAverage = apps.get_model('greenhouse', 'HourlyAverage')
+    for media in HourlyAverage.objects.all().iterator():
+        media.temperature = media.temperature_sum / media.count if media.count else 0
+        media.humidity = media.humidity_sum / media.count if media.count else 0
+        media.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0012_sensorreading_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='temperature_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='humidity_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='temperature_min',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='temperature_max',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='humidity_min',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='humidity_max',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(preencher_somas, restaurar_medias),
+        migrations.RemoveField(
+            model_name='hourlyaverage',
+            name='temperature',
+        ),
+        migrations.RemoveField(
+            model_name='hourlyaverage',
+            name='humidity',
+        ),
+        migrations.AlterField(
+            model_name='hourlyaverage',
+            name='count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:07
+
+from datetime import datetime, time
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def _somar(baldes, chave, count, t_sum, h_sum, t_min, t_max, h_min, h_max):
+    balde = baldes.get(chave)
+    if balde is None:
+        baldes[chave] = [count, t_sum, h_sum, t_min, t_max, h_min, h_max]
+        return
+    balde[0] += count
+    balde[1] += t_sum
+    balde[2] += h_sum
+    balde[3] = min(balde[3], t_min)
+    balde[4] = max(balde[4], t_max)
+    balde[5] = min(balde[5], h_min)
+    balde[6] = max(balde[6], h_max)
+
+
+def _gravar(model, baldes):
+    model.objects.bulk_create(
+        [
+            model(
+                timestamp=ts, count=b[0], temperature_sum=b[1], humidity_sum=b[2],
+                temperature_min=b[3], temperature_max=b[4], humidity_min=b[5], humidity_max=b[6],
+            )
+            for ts, b in baldes.items()
+        ],
+        batch_size=500,
+    )
+
+
+def preencher_niveis(apps, schema_editor):
+    """Dias a partir das médias horárias; minutos a partir das leituras brutas que ainda existem."""
+    HourlyAverage = apps.get_model('greenhouse', 'HourlyAverage')
+    DailyAverage = apps.get_model('greenhouse', 'DailyAverage')
+    MinuteAverage = apps.get_model('greenhouse', 'MinuteAverage')
+    SensorReading = apps.get_model('greenhouse', 'SensorReading')
+    tz = timezone.get_default_timezone()
+
+    dias = {}
+    for h in HourlyAverage.objects.all().iterator():
+        dia = datetime.combine(timezone.localtime(h.timestamp, tz).date(), time.min, tzinfo=tz)
+        _somar(dias, dia, h.count, h.temperature_sum, h.humidity_sum,
+               h.temperature_min, h.temperature_max, h.humidity_min, h.humidity_max)
+    _gravar(DailyAverage, dias)
+
+    minutos = {}
+    for r in SensorReading.objects.all().iterator():
+        minuto = r.timestamp.replace(second=0, microsecond=0)
+        _somar(minutos, minuto, 1, r.temperature, r.humidity,
+               r.temperature, r.temperature, r.humidity, r.humidity)
+    _gravar(MinuteAverage, minutos)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0013_hourlyaverage_running_sums'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('humidity_min', models.FloatField()),
+                ('humidity_max', models.FloatField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MinuteAverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('humidity_min', models.FloatField()),
+                ('humidity_max', models.FloatField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(preencher_niveis, migrations.RunPython.noop),
+    ]
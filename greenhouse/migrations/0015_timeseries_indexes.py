@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0014_minuteaverage_dailyaverage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='curtainlog',
+            index=models.Index(fields=['timestamp'], name='curtainlog_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='curtainlog',
+            index=models.Index(fields=['action', 'timestamp'], name='curtainlog_action_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['timestamp'], name='sensorreading_ts_idx'),
+        ),
+    ]
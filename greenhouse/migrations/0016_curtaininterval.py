@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:19
+
+from django.db import migrations, models
+from django.utils import timezone
+
+LADOS = ('left', 'right')
+
+
+def preencher_trechos(apps, schema_editor):
+    """
+    Reconstrói os trechos a partir do CurtainLog com a mesma regra da
+    manual_control_esp_api: um 'stop' confirma o último open/close do lado.
+    O trecho atual termina alinhado à posição gravada no controle.
+    """
+    CurtainLog = apps.get_model('greenhouse', 'CurtainLog')
+    CurtainInterval = apps.get_model('greenhouse', 'CurtainInterval')
+    GreenhouseControl = apps.get_model('greenhouse', 'GreenhouseControl')
+
+    pendente = {lado: None for lado in LADOS}
+    atual = {lado: None for lado in LADOS}
+    trechos = []
+
+    def mudar(lado, estado, momento):
+        if atual[lado] is not None and atual[lado].state == estado:
+            return
+        if atual[lado] is not None:
+            atual[lado].end = momento
+        atual[lado] = CurtainInterval(side=lado, state=estado, start=momento)
+        trechos.append(atual[lado])
+
+    logs = CurtainLog.objects.order_by('timestamp', 'pk').values_list('timestamp', 'side', 'action')
+    for momento, side, action in logs.iterator(chunk_size=2000):
+        lados = LADOS if side == 'both' else (side,)
+        for lado in lados:
+            if action in ('open', 'close'):
+                pendente[lado] = action
+            elif pendente[lado] is not None:
+                mudar(lado, 'open' if pendente[lado] == 'open' else 'closed', momento)
+                pendente[lado] = None
+
+    control = GreenhouseControl.objects.first()
+    if control is not None:
+        agora = timezone.now()
+        mudar('left', 'open' if control.left_is_open else 'closed', agora)
+        mudar('right', 'open' if control.right_is_open else 'closed', agora)
+
+    CurtainInterval.objects.bulk_create(trechos, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0015_timeseries_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurtainInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('left', 'Esquerda'), ('right', 'Direita')], max_length=6)),
+                ('state', models.CharField(choices=[('open', 'Aberta'), ('closed', 'Fechada')], max_length=6)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['side', 'start'], name='curtaininterval_side_start_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('end__isnull', True)), fields=('side',), name='curtaininterval_atual_por_lado')],
+            },
+        ),
+        migrations.RunPython(preencher_trechos, migrations.RunPython.noop),
+    ]
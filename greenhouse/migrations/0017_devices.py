@@ -0,0 +1,125 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0016_curtaininterval'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='curtaininterval',
+            name='curtaininterval_atual_por_lado',
+        ),
+        migrations.RemoveIndex(
+            model_name='curtaininterval',
+            name='curtaininterval_side_start_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='curtainlog',
+            name='curtainlog_action_ts_idx',
+        ),
+        migrations.RemoveField(
+            model_name='greenhousecontrol',
+            name='singleton',
+        ),
+        migrations.AddField(
+            model_name='curtaininterval',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='curtainlog',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='dailyaverage',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='greenhousecontrol',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32, unique=True),
+        ),
+        migrations.AddField(
+            model_name='hourlyaverage',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='minuteaverage',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='device_id',
+            field=models.CharField(default='default', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='dailyaverage',
+            name='timestamp',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='hourlyaverage',
+            name='timestamp',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='minuteaverage',
+            name='timestamp',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='curtaininterval',
+            index=models.Index(fields=['device_id', 'side', 'start'], name='curtaininterval_dev_side_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='curtainlog',
+            index=models.Index(fields=['device_id', 'timestamp'], name='curtainlog_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='curtainlog',
+            index=models.Index(fields=['device_id', 'action', 'timestamp'], name='curtainlog_dev_action_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyaverage',
+            index=models.Index(fields=['timestamp'], name='dailyaverage_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyaverage',
+            index=models.Index(fields=['timestamp'], name='hourlyaverage_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='minuteaverage',
+            index=models.Index(fields=['timestamp'], name='minuteaverage_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['device_id', 'timestamp'], name='sensorreading_device_ts_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='curtaininterval',
+            constraint=models.UniqueConstraint(condition=models.Q(('end__isnull', True)), fields=('device_id', 'side'), name='curtaininterval_atual_por_lado'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyaverage',
+            constraint=models.UniqueConstraint(fields=('device_id', 'timestamp'), name='dailyaverage_device_ts_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyaverage',
+            constraint=models.UniqueConstraint(fields=('device_id', 'timestamp'), name='hourlyaverage_device_ts_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='minuteaverage',
+            constraint=models.UniqueConstraint(fields=('device_id', 'timestamp'), name='minuteaverage_device_ts_uniq'),
+        ),
+    ]
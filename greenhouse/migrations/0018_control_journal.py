@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('greenhouse', '0017_devices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='greenhousecontrol',
+            name='state_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ControlChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(default='default', max_length=32)),
+                ('version', models.PositiveBigIntegerField()),
+                ('fields', models.CharField(max_length=255)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device_id', 'version'), name='controlchange_device_version_uniq')],
+            },
+        ),
+    ]
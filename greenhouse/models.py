@@ -1,27 +1,92 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+# Estufa/ESP dos dados; instalações com um só equipamento usam sempre este
+DISPOSITIVO_PADRAO = 'default'
+
+
+def _campo_dispositivo(**extra):
+    return models.CharField(max_length=32, default=DISPOSITIVO_PADRAO, **extra)
+
 
 class SensorReading(models.Model):
+    device_id = _campo_dispositivo()
     temperature = models.FloatField()
     humidity = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # default (e não auto_now_add) para aceitar o horário informado pelo ESP em lotes
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # última leitura (status) e intervalos por dispositivo
+            models.Index(fields=['device_id', 'timestamp'], name='sensorreading_device_ts_idx'),
+            # retenção (todas as estufas de uma vez)
+            models.Index(fields=['timestamp'], name='sensorreading_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.timestamp.strftime('%d/%m/%Y %H:%M')} - T: {self.temperature}°C, H: {self.humidity}%"
 
 
-class HourlyAverage(models.Model):
-    timestamp = models.DateTimeField(unique=True)
-    temperature = models.FloatField()
-    humidity = models.FloatField()
-    count = models.IntegerField(default=1)  # Para cálculo incremental da média
+class Rollup(models.Model):
+    """Agregado de leituras em um balde de tempo (minuto, hora ou dia)."""
+
+    device_id = _campo_dispositivo()
+    timestamp = models.DateTimeField()
+    # Somas acumuladas (atualizadas por upsert no banco); a média é derivada na leitura
+    count = models.IntegerField(default=0)
+    temperature_sum = models.FloatField(default=0)
+    humidity_sum = models.FloatField(default=0)
+    temperature_min = models.FloatField()
+    temperature_max = models.FloatField()
+    humidity_min = models.FloatField()
+    humidity_max = models.FloatField()
+
+    class Meta:
+        abstract = True
+        constraints = [
+            # alvo do upsert (ON CONFLICT): um balde por dispositivo e início
+            models.UniqueConstraint(fields=['device_id', 'timestamp'], name='%(class)s_device_ts_uniq'),
+        ]
+        indexes = [
+            # retenção
+            models.Index(fields=['timestamp'], name='%(class)s_ts_idx'),
+        ]
+
+    @property
+    def temperature(self):
+        return self.temperature_sum / self.count if self.count else None
+
+    @property
+    def humidity(self):
+        return self.humidity_sum / self.count if self.count else None
 
     def __str__(self):
         return f"{self.timestamp.strftime('%d/%m/%Y %H:%M')} - T: {self.temperature:.2f}°C, H: {self.humidity:.2f}%"
 
 
+class MinuteAverage(Rollup):
+    class Meta(Rollup.Meta):
+        pass
+
+
+class HourlyAverage(Rollup):
+    class Meta(Rollup.Meta):
+        pass
+
+
+class DailyAverage(Rollup):
+    """Balde diário, alinhado à meia-noite do fuso local (TIME_ZONE)."""
+
+    class Meta(Rollup.Meta):
+        pass
+
+
 class GreenhouseControl(models.Model):
-    """Armazena o estado da estufa e parâmetros"""
+    """Armazena o estado da estufa e parâmetros (uma linha por dispositivo)"""
+
+    device_id = _campo_dispositivo(unique=True)
 
     # parâmetros de temperatura
     min_temperature = models.FloatField(default=22.0)
@@ -45,16 +110,117 @@ class GreenhouseControl(models.Model):
 
     esp_ip = models.CharField(max_length=50, blank=True, null=True)
     automatic_mode = models.BooleanField(default=True)
-    singleton = models.BooleanField(default=True, editable=False, unique=True)
     last_esp_ping = models.DateTimeField(null=True, blank=True)
     curtain_move_time_seconds = models.PositiveIntegerField(
         default=120,  # 2 minutos
         help_text="Tempo em segundos para a cortina abrir/fechar totalmente."
     )
+    # sobe a cada gravação que muda um campo do status; o que mudou fica em ControlChange
+    state_version = models.PositiveBigIntegerField(default=0)
+
+    # campo do model -> campos do status (get_status_api) que dependem dele
+    CAMPOS_STATUS = {
+        'min_temperature': ('min_temperature',),
+        'max_temperature': ('max_temperature',),
+        'curtain_move_time_seconds': ('move_timeout_ms',),
+        'left_is_open': ('left_is_open',),
+        'right_is_open': ('right_is_open',),
+        'curtain_status': ('curtain_status',),
+        'automatic_mode': ('automatic_mode', 'left', 'right'),
+        'auto_left_action': ('left',),
+        'manual_left_action': ('left',),
+        'auto_right_action': ('right',),
+        'manual_right_action': ('right',),
+        'esp_ip': ('esp_ip',),
+    }
+
     def __str__(self):
         status = "Aberta" if self.curtain_is_open else "Fechada"
         return f"Configuração da Estufa - Faixa Ideal: {self.min_temperature}°C a {self.max_temperature}°C, Cortina: {status}"
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # valores carregados, para o save() saber o que mudou
+        instancia._carregado = {campo: getattr(instancia, campo) for campo in cls.CAMPOS_STATUS if campo in field_names}
+        return instancia
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        carregado = getattr(self, '_carregado', {})
+        update_fields = kwargs.get('update_fields')
+        alterados = [
+            campo for campo in self.CAMPOS_STATUS
+            if (update_fields is None or campo in update_fields)
+            and (campo not in carregado or carregado[campo] != getattr(self, campo))
+        ]
+        if not alterados:
+            # state_version só muda pelo banco: a cópia em memória pode estar atrasada
+            if update_fields is None:
+                update_fields = [
+                    campo.name for campo in self._meta.concrete_fields
+                    if not campo.primary_key and campo.name != 'state_version'
+                ]
+            kwargs['update_fields'] = [campo for campo in update_fields if campo != 'state_version']
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            self.state_version = self._proxima_versao()
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['state_version']
+            super().save(*args, **kwargs)
+            self._registrar_mudanca(alterados)
+        carregado.update((campo, getattr(self, campo)) for campo in alterados)
+        self._carregado = carregado
+
+    def _proxima_versao(self):
+        # lida sob a trava de escrita: gravações concorrentes não repetem a versão
+        atual = GreenhouseControl.objects.select_for_update().filter(pk=self.pk).values_list(
+            'state_version', flat=True,
+        ).get()
+        return atual + 1
+
+    def _registrar_mudanca(self, campos):
+        status = sorted({saida for campo in campos for saida in self.CAMPOS_STATUS[campo]})
+        ControlChange.objects.create(device_id=self.device_id, version=self.state_version, fields=','.join(status))
+        if self.state_version % ControlChange.TAMANHO_JORNAL == 0:
+            ControlChange.objects.filter(
+                device_id=self.device_id, version__lte=self.state_version - ControlChange.TAMANHO_JORNAL,
+            ).delete()
+
+    def registrar_alteracao(self, **valores):
+        """UPDATE só dos `valores` (sem carregar o resto), com versão e jornal como no save()."""
+        with transaction.atomic():
+            self.state_version = self._proxima_versao()
+            GreenhouseControl.objects.filter(pk=self.pk).update(state_version=self.state_version, **valores)
+            for campo, valor in valores.items():
+                setattr(self, campo, valor)
+            alterados = [campo for campo in valores if campo in self.CAMPOS_STATUS]
+            if alterados:
+                self._registrar_mudanca(alterados)
+
+
+class ControlChange(models.Model):
+    """
+    Jornal das mudanças do GreenhouseControl: quais campos do status mudaram
+    em cada state_version. Guarda as últimas TAMANHO_JORNAL versões por
+    dispositivo; o status em delta de um cliente mais atrasado volta a ser completo.
+    """
+    TAMANHO_JORNAL = 64
+
+    device_id = _campo_dispositivo()
+    version = models.PositiveBigIntegerField()
+    # campos do status separados por vírgula
+    fields = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'version'], name='controlchange_device_version_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} v{self.version}: {self.fields}"
+
 
 
 class CurtainLog(models.Model):
@@ -69,6 +235,7 @@ class CurtainLog(models.Model):
         ('close', 'Fechada'),
     ]
 
+    device_id = _campo_dispositivo()
     side = models.CharField(max_length=6, choices=SIDE_CHOICES, default='both')
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
     temperature = models.FloatField()
@@ -76,5 +243,52 @@ class CurtainLog(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     triggered_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # retenção
+            models.Index(fields=['timestamp'], name='curtainlog_ts_idx'),
+            # último log do dispositivo (deduplicação)
+            models.Index(fields=['device_id', 'timestamp'], name='curtainlog_device_ts_idx'),
+            # logs por ação em ordem de tempo (histórico, análises)
+            models.Index(fields=['device_id', 'action', 'timestamp'], name='curtainlog_dev_action_ts_idx'),
+        ]
+
     def __str__(self):
         return f"{self.get_side_display()} - {self.get_action_display()} em {self.timestamp.strftime('%d/%m %H:%M')}"
+
+
+class CurtainInterval(models.Model):
+    """
+    Trecho contínuo em que uma cortina ficou aberta ou fechada, derivado dos
+    'stop' confirmados pelo ESP. end=None é o trecho atual (um por lado).
+    """
+    SIDE_CHOICES = [
+        ('left', 'Esquerda'),
+        ('right', 'Direita'),
+    ]
+    STATE_CHOICES = [
+        ('open', 'Aberta'),
+        ('closed', 'Fechada'),
+    ]
+
+    device_id = _campo_dispositivo()
+    side = models.CharField(max_length=6, choices=SIDE_CHOICES)
+    state = models.CharField(max_length=6, choices=STATE_CHOICES)
+    start = models.DateTimeField()
+    end = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # estado em um instante e trechos de um período: busca pelo início
+            models.Index(fields=['device_id', 'side', 'start'], name='curtaininterval_dev_side_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device_id', 'side'], condition=models.Q(end__isnull=True),
+                name='curtaininterval_atual_por_lado',
+            ),
+        ]
+
+    def __str__(self):
+        fim = self.end.strftime('%d/%m %H:%M') if self.end else 'agora'
+        return f"{self.get_side_display()} {self.get_state_display()} de {self.start.strftime('%d/%m %H:%M')} até {fim}"
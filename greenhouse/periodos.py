@@ -0,0 +1,36 @@
+"""
+Limites de período aceitos pela API (?start=/?end=/?after=) e pelos comandos
+(--start/--end): data (YYYY-MM-DD) ou data e hora ISO 8601.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# período padrão quando início e fim não são informados
+DIAS_PADRAO = 7
+
+
+def parse_limite(valor, fim=False):
+    """
+    Data vira o começo do dia (ou o último instante dele, com `fim`) no fuso
+    atual; data e hora sem fuso também é lida no fuso atual. ValueError se inválido.
+    """
+    if len(valor) == 10:
+        data = datetime.strptime(valor, "%Y-%m-%d").date()
+        return datetime.combine(data, time.max if fim else time.min, tzinfo=timezone.get_current_timezone())
+    ts = parse_datetime(valor)
+    if ts is None:
+        raise ValueError(f"data inválida: {valor}")
+    if timezone.is_naive(ts):
+        ts = timezone.make_aware(ts)
+    return ts
+
+
+def periodo(inicio=None, fim=None):
+    """(início, fim) a partir dos textos informados; padrão: de DIAS_PADRAO dias atrás até o fim de hoje."""
+    hoje = timezone.localdate()
+    return (
+        parse_limite(inicio or (hoje - timedelta(days=DIAS_PADRAO)).isoformat()),
+        parse_limite(fim or hoje.isoformat(), fim=True),
+    )
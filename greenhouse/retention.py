@@ -0,0 +1,118 @@
+"""
+Retenção de dados: apaga registros antigos em lotes pequenos.
+
+Cada lote é uma transação curta (no máximo `tamanho_lote` linhas), com uma
+pausa entre lotes para que as gravações do ESP não fiquem esperando o lock
+de escrita do SQLite. As políticas (idade máxima por tabela) são
+POLITICAS_PADRAO com as entradas de settings.GREENHOUSE_RETENTION por cima;
+os padrões ficam só aqui.
+"""
+import time as time_mod
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import daycache, metrics, state
+
+# Idade máxima por modelo; None mantém para sempre
+POLITICAS_PADRAO = {
+    'SensorReading': timedelta(hours=1),
+    'MinuteAverage': timedelta(days=7),
+    'HourlyAverage': None,
+    'DailyAverage': None,
+    'CurtainLog': None,
+}
+TAMANHO_LOTE_PADRAO = 500
+PAUSA_PADRAO = 0.05  # segundos entre lotes
+
+
+class Resultado:
+    def __init__(self, modelo, limite):
+        self.modelo = modelo
+        self.limite = limite
+        self.removidos = 0
+        self.lotes = 0
+        self.segundos = 0.0
+        self.interrompido = False  # prazo esgotado antes de terminar
+
+    @property
+    def linhas_por_segundo(self):
+        return self.removidos / self.segundos if self.segundos else 0.0
+
+    def __str__(self):
+        texto = (
+            f"{self.modelo}: {self.removidos} registros removidos em {self.lotes} lotes, "
+            f"{self.segundos:.2f}s ({self.linhas_por_segundo:.0f} linhas/s), anteriores a {self.limite}"
+        )
+        if self.interrompido:
+            texto += " — prazo esgotado, continua na próxima execução"
+        return texto
+
+
+def politicas():
+    """{nome do modelo: idade máxima} com os valores de settings sobre os padrões."""
+    configuradas = dict(POLITICAS_PADRAO)
+    configuradas.update(getattr(settings, 'GREENHOUSE_RETENTION', {}))
+    return configuradas
+
+
+def limites(agora=None):
+    """{nome do modelo: instante mais antigo ainda guardado} das tabelas com política."""
+    agora = agora or timezone.now()
+    return {nome: agora - idade for nome, idade in politicas().items() if idade is not None}
+
+
+def apagar_anteriores(model, limite, tamanho_lote=TAMANHO_LOTE_PADRAO, pausa=PAUSA_PADRAO, prazo=None):
+    """
+    Apaga registros com timestamp < limite, do mais antigo para o mais novo,
+    em lotes de `tamanho_lote`. `prazo` (time.monotonic) interrompe entre lotes.
+    """
+    resultado = Resultado(model.__name__, limite)
+    inicio = time_mod.monotonic()
+    antigos = model.objects.filter(timestamp__lt=limite).order_by('timestamp')
+
+    while True:
+        if prazo is not None and time_mod.monotonic() >= prazo:
+            resultado.interrompido = True
+            break
+
+        with transaction.atomic():
+            pks = list(antigos.values_list('pk', flat=True)[:tamanho_lote])
+            if not pks:
+                break
+            apagados, _ = model.objects.filter(pk__in=pks).delete()
+
+        resultado.removidos += apagados
+        metrics.incrementar('greenhouse_retention_deleted_total', apagados, model=model.__name__)
+        resultado.lotes += 1
+        if len(pks) < tamanho_lote:
+            break
+        if pausa:
+            time_mod.sleep(pausa)
+
+    if resultado.removidos and model.__name__ == 'SensorReading':
+        # a última leitura em cache pode ter sido apagada
+        state.invalidar()
+    elif resultado.removidos and model.__name__.endswith('Average'):
+        # séries de dias encerrados em cache deixaram de existir no banco
+        daycache.marcar_epoca()
+    resultado.segundos = time_mod.monotonic() - inicio
+    return resultado
+
+
+def aplicar(tamanho_lote=None, pausa=None, max_segundos=None):
+    """Aplica todas as políticas; devolve um Resultado por tabela com política."""
+    if tamanho_lote is None:
+        tamanho_lote = getattr(settings, 'GREENHOUSE_RETENTION_BATCH_SIZE', TAMANHO_LOTE_PADRAO)
+    if pausa is None:
+        pausa = getattr(settings, 'GREENHOUSE_RETENTION_PAUSE', PAUSA_PADRAO)
+    prazo = time_mod.monotonic() + max_segundos if max_segundos else None
+
+    resultados = []
+    for nome, limite in limites().items():
+        model = apps.get_model('greenhouse', nome)
+        resultados.append(apagar_anteriores(model, limite, tamanho_lote, pausa, prazo))
+    return resultados
@@ -0,0 +1,247 @@
+"""
+Agregados (rollups) das leituras do sensor em três níveis: minuto, hora e dia.
+
+Cada balde (dispositivo, início) guarda contagem, somas e min/max; a média
+é derivada na leitura.
+A atualização é um único INSERT ... ON CONFLICT DO UPDATE no banco, sem
+ler a linha antes, então é correta mesmo com vários workers gravando a
+mesma hora ao mesmo tempo.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Value
+from django.db.models.functions import Least, Greatest
+from django.utils import timezone
+
+from . import retention
+from .models import DISPOSITIVO_PADRAO, MinuteAverage, HourlyAverage, DailyAverage
+
+
+class Acumulador:
+    """Soma parcial de um balde, montada em Python antes do upsert."""
+
+    __slots__ = (
+        'count', 'temperature_sum', 'humidity_sum',
+        'temperature_min', 'temperature_max', 'humidity_min', 'humidity_max',
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.temperature_sum = 0.0
+        self.humidity_sum = 0.0
+        self.temperature_min = self.temperature_max = None
+        self.humidity_min = self.humidity_max = None
+
+    def adicionar(self, temperature, humidity):
+        self.count += 1
+        self.temperature_sum += temperature
+        self.humidity_sum += humidity
+        if self.count == 1:
+            self.temperature_min = self.temperature_max = temperature
+            self.humidity_min = self.humidity_max = humidity
+        else:
+            self.temperature_min = min(self.temperature_min, temperature)
+            self.temperature_max = max(self.temperature_max, temperature)
+            self.humidity_min = min(self.humidity_min, humidity)
+            self.humidity_max = max(self.humidity_max, humidity)
+
+
+CAMPOS_SOMA = ('count', 'temperature_sum', 'humidity_sum')
+CAMPOS_MIN = ('temperature_min', 'humidity_min')
+CAMPOS_MAX = ('temperature_max', 'humidity_max')
+CAMPOS = CAMPOS_SOMA + CAMPOS_MIN + CAMPOS_MAX
+
+# Linhas por comando: 11 parâmetros por linha, abaixo do limite de 999 do SQLite antigo
+BALDES_POR_COMANDO = 90
+
+
+# Limite de pontos por série: escolhe o nível mais fino que não passe disso
+MAX_PONTOS = 1000
+
+
+def inicio_do_minuto(ts):
+    return ts.replace(second=0, microsecond=0)
+
+
+def inicio_da_hora(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def inicio_do_dia(ts):
+    """Meia-noite local (TIME_ZONE) do dia que contém `ts`."""
+    tz = timezone.get_default_timezone()
+    return datetime.combine(timezone.localtime(ts, tz).date(), time.min, tzinfo=tz)
+
+
+class Nivel:
+    def __init__(self, nome, model, passo, truncar):
+        self.nome = nome
+        self.model = model
+        self.passo = passo
+        self.truncar = truncar
+
+
+MINUTO = Nivel('minute', MinuteAverage, timedelta(minutes=1), inicio_do_minuto)
+HORA = Nivel('hour', HourlyAverage, timedelta(hours=1), inicio_da_hora)
+DIA = Nivel('day', DailyAverage, timedelta(days=1), inicio_do_dia)
+
+# Do mais fino para o mais grosso
+NIVEIS = (MINUTO, HORA, DIA)
+NIVEIS_POR_NOME = {nivel.nome: nivel for nivel in NIVEIS}
+
+
+def agrupar(leituras, truncar):
+    """{(dispositivo, início do balde): Acumulador} para uma lista de SensorReading."""
+    baldes = {}
+    for leitura in leituras:
+        chave = (leitura.device_id, truncar(leitura.timestamp))
+        acumulador = baldes.get(chave)
+        if acumulador is None:
+            acumulador = baldes[chave] = Acumulador()
+        acumulador.adicionar(leitura.temperature, leitura.humidity)
+    return baldes
+
+
+def _comando_upsert(model, linhas):
+    """INSERT ... ON CONFLICT para `linhas` linhas de (device_id, timestamp, *CAMPOS)."""
+    if connection.vendor == 'sqlite':
+        f_min, f_max = 'MIN', 'MAX'
+    else:
+        f_min, f_max = 'LEAST', 'GREATEST'
+
+    qn = connection.ops.quote_name
+    tabela = qn(model._meta.db_table)
+    colunas = ('device_id', 'timestamp') + CAMPOS
+    atribuicoes = []
+    for campo in CAMPOS_SOMA:
+        atribuicoes.append(f"{qn(campo)} = {tabela}.{qn(campo)} + excluded.{qn(campo)}")
+    for campo in CAMPOS_MIN:
+        atribuicoes.append(f"{qn(campo)} = {f_min}({tabela}.{qn(campo)}, excluded.{qn(campo)})")
+    for campo in CAMPOS_MAX:
+        atribuicoes.append(f"{qn(campo)} = {f_max}({tabela}.{qn(campo)}, excluded.{qn(campo)})")
+
+    linha = "(" + ", ".join(["%s"] * len(colunas)) + ")"
+    return (
+        f"INSERT INTO {tabela} ({', '.join(qn(c) for c in colunas)}) "
+        f"VALUES {', '.join([linha] * linhas)} "
+        f"ON CONFLICT ({qn('device_id')}, {qn('timestamp')}) DO UPDATE SET {', '.join(atribuicoes)}"
+    )
+
+
+def _upsert_sql(model, baldes):
+    sql = _comando_upsert(model, len(baldes))
+    params = []
+    for (dispositivo, ts), acumulador in baldes.items():
+        params.append(dispositivo)
+        params.append(connection.ops.adapt_datetimefield_value(ts))
+        params.extend(getattr(acumulador, campo) for campo in CAMPOS)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _upsert_orm(model, baldes):
+    """Fallback para bancos sem ON CONFLICT: UPDATE com F(); se não havia linha, INSERT."""
+    for (dispositivo, ts), acumulador in baldes.items():
+        alteracoes = {campo: F(campo) + getattr(acumulador, campo) for campo in CAMPOS_SOMA}
+        alteracoes.update({campo: Least(F(campo), Value(getattr(acumulador, campo))) for campo in CAMPOS_MIN})
+        alteracoes.update({campo: Greatest(F(campo), Value(getattr(acumulador, campo))) for campo in CAMPOS_MAX})
+        balde = model.objects.filter(device_id=dispositivo, timestamp=ts)
+        if balde.update(**alteracoes):
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(
+                    device_id=dispositivo, timestamp=ts, **{campo: getattr(acumulador, campo) for campo in CAMPOS},
+                )
+        except IntegrityError:
+            # outro worker criou a linha entre o UPDATE e o INSERT
+            balde.update(**alteracoes)
+
+
+def upsert(model, baldes):
+    """Incorpora os acumuladores {(dispositivo, timestamp): Acumulador} na tabela de rollup."""
+    if not baldes:
+        return
+    if connection.vendor in ('sqlite', 'postgresql'):
+        itens = list(baldes.items())
+        for i in range(0, len(itens), BALDES_POR_COMANDO):
+            _upsert_sql(model, dict(itens[i:i + BALDES_POR_COMANDO]))
+    else:
+        _upsert_orm(model, baldes)
+
+
+def upsert_em_massa(model, linhas):
+    """
+    Variante de `upsert` para carga em massa: `linhas` são tuplas
+    (dispositivo, timestamp já adaptado ao banco, *CAMPOS), num único executemany.
+    """
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.executemany(_comando_upsert(model, 1), linhas)
+        return
+    baldes = {}
+    for dispositivo, ts, *valores in linhas:
+        acumulador = baldes[(dispositivo, ts)] = Acumulador()
+        for campo, valor in zip(CAMPOS, valores):
+            setattr(acumulador, campo, valor)
+    _upsert_orm(model, baldes)
+
+
+def registrar_leituras(leituras):
+    """Atualiza os três níveis de agregado com um lote de leituras; devolve {nível: baldes}."""
+    atualizados = {}
+    for nivel in NIVEIS:
+        baldes = agrupar(leituras, nivel.truncar)
+        upsert(nivel.model, baldes)
+        atualizados[nivel.nome] = len(baldes)
+    return atualizados
+
+
+def escolher_nivel(inicio, fim, max_pontos=MAX_PONTOS, agora=None):
+    """
+    Nível mais fino cuja quantidade de baldes no intervalo cabe em `max_pontos`
+    e cuja retenção (retention.politicas) ainda guarda dados desde `inicio`.
+    """
+    duracao = fim - inicio
+    limite_retencao = retention.limites(agora)
+    for nivel in NIVEIS:
+        limite = limite_retencao.get(nivel.model.__name__)
+        if limite is not None and inicio < limite:
+            continue
+        if duracao / nivel.passo <= max_pontos:
+            return nivel
+    return NIVEIS[-1]
+
+
+# Linhas buscadas por vez do banco ao percorrer uma série
+TAMANHO_CHUNK = 500
+
+
+def _ponto(linha):
+    ts, count, t_sum, h_sum, t_min, h_min, t_max, h_max = linha
+    return {
+        "timestamp": ts.isoformat(),
+        "temperature": round(t_sum / count, 2),
+        "humidity": round(h_sum / count, 2),
+        "temperature_min": t_min,
+        "temperature_max": t_max,
+        "humidity_min": h_min,
+        "humidity_max": h_max,
+        "count": count,
+    }
+
+
+def iterar_pontos(nivel, inicio, fim, depois=None, dispositivo=DISPOSITIVO_PADRAO):
+    """
+    Série do intervalo em ordem de tempo, sem materializar tudo: percorre o
+    banco em chunks de TAMANHO_CHUNK. `depois` (exclusivo) é o cursor da
+    paginação por chave (timestamp do último ponto já entregue).
+    """
+    linhas = nivel.model.objects.filter(device_id=dispositivo, timestamp__range=(inicio, fim))
+    if depois is not None:
+        linhas = linhas.filter(timestamp__gt=depois)
+    linhas = linhas.order_by('timestamp').values_list('timestamp', *CAMPOS)
+    for linha in linhas.iterator(chunk_size=TAMANHO_CHUNK):
+        if linha[1]:
+            yield _ponto(linha)
@@ -0,0 +1,382 @@
+"""
+Segmento de estado em memória compartilhada (mmap), lido por todos os workers.
+
+Um arquivo de layout fixo (settings.GREENHOUSE_STATE_SEGMENT) mapeado por
+todos os processos: um cabeçalho e um registro por dispositivo com o
+GreenhouseControl, a última leitura e o heartbeat do ESP. Ler o estado vira
+uma cópia de bytes da memória, sem cache em arquivo nem banco.
+
+Leitura sem trava (seqlock): o escritor deixa o contador do registro ímpar
+enquanto grava e par ao terminar; o leitor copia o registro e confere se o
+contador continuou o mesmo e par, senão tenta de novo. Os escritores se
+revezam por flock no próprio arquivo (entre processos) e por uma trava de
+thread (dentro do processo).
+
+A validade segue o mesmo esquema do cache versionado de state.py: invalidar
+incrementa a geração do registro (após o commit) e o primeiro leitor que a
+encontrar diferente da carregada relê o banco e publica o estado novo. O
+heartbeat não depende da geração: é gravado direto no segmento.
+
+Cada layout (campos dos models e número de registros) tem o seu arquivo,
+GREENHOUSE_STATE_SEGMENT com o hash do layout como sufixo: depois de uma
+migração os workers novos abrem outro arquivo e os antigos, ainda em
+execução, seguem no deles sem ter o mapeamento truncado. Arquivos de
+layouts antigos não são apagados.
+
+Dispositivos além do número de registros ficam de fora (aviso no log uma
+vez por processo); state.py os atende pelo cache.
+"""
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import models
+
+from .models import GreenhouseControl, SensorReading
+
+logger = logging.getLogger(__name__)
+
+MAGIA = b'GHST'
+# registros (dispositivos) por segmento, se GREENHOUSE_MAX_DEVICES não estiver definido
+SLOTS = 512
+TAMANHO_DISPOSITIVO = 32
+TENTATIVAS_LEITURA = 100
+# texto None (esp_ip nulo): primeiro byte impossível em UTF-8
+NULO = b'\xff'
+
+SEQ = struct.Struct('<Q')
+
+
+def _formato_campo(campo):
+    """(formato struct, codificar, decodificar, valor vazio) de um campo concreto do model."""
+    if isinstance(campo, models.BooleanField):
+        return '?', bool, bool, False
+    if isinstance(campo, models.FloatField):
+        return 'd', float, float, 0.0
+    if isinstance(campo, models.IntegerField):  # inclui BigAutoField
+        return 'q', int, int, 0
+    if isinstance(campo, models.DateTimeField):
+        return 'd', _codificar_data, _decodificar_data, math.nan
+    if isinstance(campo, models.CharField):
+        # até 4 bytes por caractere em UTF-8
+        return f'{campo.max_length * 4}s', _codificar_texto, _decodificar_texto, b''
+    raise TypeError(f'campo sem formato no segmento: {campo.name}')
+
+
+def _codificar_data(valor):
+    return valor.timestamp() if valor is not None else math.nan
+
+
+def _decodificar_data(valor):
+    return None if math.isnan(valor) else datetime.fromtimestamp(valor, dt_timezone.utc)
+
+
+def _codificar_texto(valor):
+    return NULO if valor is None else valor.encode()
+
+
+def _decodificar_texto(valor):
+    valor = valor.rstrip(b'\0')
+    return None if valor == NULO else valor.decode(errors='replace')
+
+
+class _Bloco:
+    """Campos concretos de um model serializados em sequência, com um byte de presença na frente."""
+
+    def __init__(self, model):
+        self.model = model
+        self.campos = [campo.attname for campo in model._meta.concrete_fields]
+        formatos = [_formato_campo(campo) for campo in model._meta.concrete_fields]
+        self.formato = '?' + ''.join(f[0] for f in formatos)
+        self.codificadores = [f[1] for f in formatos]
+        self.decodificadores = [f[2] for f in formatos]
+        self.vazio = [False] + [f[3] for f in formatos]
+
+    def __len__(self):
+        return len(self.vazio)
+
+    def valores(self, objeto):
+        if objeto is None:
+            return list(self.vazio)
+        return [True] + [
+            codificar(getattr(objeto, campo)) for campo, codificar in zip(self.campos, self.codificadores)
+        ]
+
+    def objeto(self, valores):
+        if not valores[0]:
+            return None
+        decodificados = [decodificar(v) for decodificar, v in zip(self.decodificadores, valores[1:])]
+        return self.model.from_db('default', self.campos, decodificados)
+
+
+class Segmento:
+    def __init__(self, caminho, slots=SLOTS):
+        self.caminho = caminho
+        self.slots = slots
+        self.controle = _Bloco(GreenhouseControl)
+        self.leitura = _Bloco(SensorReading)
+        # geração, geração carregada, dispositivo | controle | leitura | heartbeat (presente, momento, ip, persistido)
+        self.corpo = struct.Struct(
+            f'<QQ{TAMANHO_DISPOSITIVO}s' + self.controle.formato + self.leitura.formato + '?d200sd'
+        )
+        self.tamanho_registro = SEQ.size + self.corpo.size
+        self.tamanho_registro += -self.tamanho_registro % 8  # contador alinhado
+        # o layout muda com os models (migração): outro hash, outro arquivo
+        self.layout = hashlib.sha1(f'{self.corpo.format}:{slots}'.encode()).digest()[:8]
+        self.arquivo = f'{caminho}.{self.layout.hex()}'
+        self.cabecalho = struct.Struct('<4s8s')
+        self.indices = {}
+        # dispositivos sem registro livre (registros nunca são liberados)
+        self.excedentes = set()
+        self.lock = threading.Lock()
+        self._abrir()
+
+    def _abrir(self):
+        tamanho = self.cabecalho.size + self.slots * self.tamanho_registro
+        tamanho += -tamanho % mmap.PAGESIZE
+        if not os.path.exists(self.arquivo):
+            self._criar(tamanho)
+        self.fd = os.open(self.arquivo, os.O_RDWR)
+        atual = os.pread(self.fd, self.cabecalho.size, 0)
+        if atual != self.cabecalho.pack(MAGIA, self.layout) or os.fstat(self.fd).st_size != tamanho:
+            os.close(self.fd)
+            raise RuntimeError(f'segmento de estado inválido: {self.arquivo}')
+        self.mm = mmap.mmap(self.fd, tamanho)
+
+    def _criar(self, tamanho):
+        """
+        Monta o arquivo num temporário e publica com link(), que falha se outro
+        processo chegou antes: ninguém mapeia um arquivo sem cabeçalho.
+        """
+        temporario = f'{self.arquivo}.{os.getpid()}-{threading.get_ident()}.tmp'
+        fd = os.open(temporario, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, tamanho)
+            os.pwrite(fd, self.cabecalho.pack(MAGIA, self.layout), 0)
+            try:
+                os.link(temporario, self.arquivo)
+            except FileExistsError:
+                pass
+        finally:
+            os.close(fd)
+            os.unlink(temporario)
+
+    def _trava(self):
+        return _Trava(self.lock, self.fd)
+
+    def _base(self, slot):
+        return self.cabecalho.size + slot * self.tamanho_registro
+
+    # ---------- registros ----------
+    def _ler_corpo(self, slot):
+        base = self._base(slot)
+        for _ in range(TENTATIVAS_LEITURA):
+            antes = SEQ.unpack_from(self.mm, base)[0]
+            if antes & 1:
+                continue
+            corpo = self.corpo.unpack_from(self.mm, base + SEQ.size)
+            if SEQ.unpack_from(self.mm, base)[0] == antes:
+                return list(corpo)
+        # escritor parado no meio (processo morto durante a gravação): lê sob a trava
+        with self._trava():
+            return list(self.corpo.unpack_from(self.mm, base + SEQ.size))
+
+    def _gravar_corpo(self, slot, corpo):
+        """Só com a trava: contador ímpar, corpo, contador par."""
+        base = self._base(slot)
+        seq = SEQ.unpack_from(self.mm, base)[0]
+        SEQ.pack_into(self.mm, base, seq | 1)
+        self.corpo.pack_into(self.mm, base + SEQ.size, *corpo)
+        SEQ.pack_into(self.mm, base, (seq | 1) + 1)
+
+    def _slot(self, dispositivo, reservar=False):
+        """Índice do registro do dispositivo; com `reservar`, ocupa um livre se ele não tiver (None se cheio)."""
+        slot = self.indices.get(dispositivo)
+        if slot is not None or dispositivo in self.excedentes:
+            return slot
+        nome = dispositivo.encode()[:TAMANHO_DISPOSITIVO]
+        deslocamento = SEQ.size + struct.calcsize('<QQ')
+        with self._trava():
+            livre = None
+            for i in range(self.slots):
+                atual = self.mm[self._base(i) + deslocamento:self._base(i) + deslocamento + TAMANHO_DISPOSITIVO]
+                atual = atual.rstrip(b'\0')
+                if atual == nome:
+                    self.indices[dispositivo] = i
+                    return i
+                if not atual and livre is None:
+                    livre = i
+            if not reservar:
+                return None
+            if livre is None:
+                self.excedentes.add(dispositivo)
+                logger.warning(
+                    'Segmento de estado cheio (%d registros): %s fica no cache. '
+                    'Aumente GREENHOUSE_MAX_DEVICES.', self.slots, dispositivo,
+                )
+                return None
+            corpo = [1, 0, nome] + self.controle.valores(None) + self.leitura.valores(None) + [
+                False, math.nan, b'', math.nan,
+            ]
+            self._gravar_corpo(livre, corpo)
+            self.indices[dispositivo] = livre
+            return livre
+
+    def _partes(self, corpo):
+        n_controle, n_leitura = len(self.controle), len(self.leitura)
+        controle = corpo[3:3 + n_controle]
+        leitura = corpo[3 + n_controle:3 + n_controle + n_leitura]
+        heartbeat = corpo[3 + n_controle + n_leitura:]
+        return controle, leitura, heartbeat
+
+    # ---------- API ----------
+    def tem_registro(self, dispositivo):
+        """O dispositivo já tem um registro no segmento? Não reserva nada."""
+        return self._slot(dispositivo) is not None
+
+    def reservar(self, dispositivo):
+        """Ocupa um registro para um dispositivo provisionado; False se o segmento estiver cheio."""
+        return self._slot(dispositivo, reservar=True) is not None
+
+    def ler_estado(self, dispositivo):
+        """
+        (geração, control, latest, válido). Com `válido` falso o estado é
+        antigo ou nunca foi publicado: recarregue e chame publicar(geração, ...).
+        """
+        slot = self._slot(dispositivo)
+        if slot is None:
+            return None, None, None, False
+        corpo = self._ler_corpo(slot)
+        geracao, carregada = corpo[0], corpo[1]
+        if geracao != carregada:
+            return geracao, None, None, False
+        controle, leitura, _ = self._partes(corpo)
+        return geracao, self.controle.objeto(controle), self.leitura.objeto(leitura), True
+
+    def publicar(self, dispositivo, geracao, control, latest):
+        """Grava o estado carregado do banco, se nenhuma invalidação aconteceu desde `geracao`."""
+        slot = self._slot(dispositivo)
+        if slot is None or geracao is None:
+            return False
+        with self._trava():
+            corpo = list(self.corpo.unpack_from(self.mm, self._base(slot) + SEQ.size))
+            if corpo[0] != geracao:
+                return False
+            _, _, heartbeat = self._partes(corpo)
+            corpo = [geracao, geracao, corpo[2]] + self.controle.valores(control) \
+                + self.leitura.valores(latest) + heartbeat
+            self._gravar_corpo(slot, corpo)
+        return True
+
+    def publicar_leitura(self, dispositivo, latest):
+        """
+        Troca só a última leitura, numa geração nova já marcada como carregada:
+        publicar() de um leitor que carregou antes é recusado. Com o estado
+        inválido apenas incrementa a geração; leitura mais antiga é ignorada.
+        """
+        slot = self._slot(dispositivo)
+        if slot is None:
+            return False
+        with self._trava():
+            corpo = list(self.corpo.unpack_from(self.mm, self._base(slot) + SEQ.size))
+            controle, leitura, heartbeat = self._partes(corpo)
+            valido = corpo[0] == corpo[1]
+            anterior = self.leitura.objeto(leitura) if valido else None
+            if anterior is not None and anterior.timestamp >= latest.timestamp:
+                return False
+            corpo[0] += 1
+            if valido:
+                corpo = [corpo[0], corpo[0], corpo[2]] + controle + self.leitura.valores(latest) + heartbeat
+            self._gravar_corpo(slot, corpo)
+        return valido
+
+    def invalidar(self, dispositivo=None):
+        """Nova geração no registro do dispositivo ou, sem ele, em todos os registros em uso."""
+        if dispositivo is not None:
+            slot = self._slot(dispositivo)
+            slots = [] if slot is None else [slot]
+        else:
+            slots = range(self.slots)
+        with self._trava():
+            for slot in slots:
+                base = self._base(slot) + SEQ.size
+                corpo = list(self.corpo.unpack_from(self.mm, base))
+                if not corpo[2].rstrip(b'\0'):
+                    continue
+                corpo[0] += 1
+                self._gravar_corpo(slot, corpo)
+
+    def ler_heartbeat(self, dispositivo):
+        """(momento, ip, persistido_em) ou None."""
+        slot = self._slot(dispositivo)
+        if slot is None:
+            return None
+        presente, momento, ip, persistido = self._partes(self._ler_corpo(slot))[2]
+        if not presente:
+            return None
+        return _decodificar_data(momento), _decodificar_texto(ip), _decodificar_data(persistido)
+
+    def gravar_heartbeat(self, dispositivo, momento, ip, persistido_em):
+        slot = self._slot(dispositivo)
+        if slot is None:
+            return False
+        with self._trava():
+            corpo = list(self.corpo.unpack_from(self.mm, self._base(slot) + SEQ.size))
+            corpo[-4:] = [True, _codificar_data(momento), _codificar_texto(ip), _codificar_data(persistido_em)]
+            self._gravar_corpo(slot, corpo)
+        return True
+
+    def fechar(self):
+        self.mm.close()
+        os.close(self.fd)
+
+
+class _Trava:
+    def __init__(self, lock, fd):
+        self.lock = lock
+        self.fd = fd
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+_segmentos = {}
+_lock_segmentos = threading.Lock()
+
+
+def segmento():
+    """Segmento configurado em GREENHOUSE_STATE_SEGMENT, aberto uma vez por processo; None se desligado."""
+    caminho = getattr(settings, 'GREENHOUSE_STATE_SEGMENT', None)
+    if not caminho:
+        return None
+    atual = _segmentos.get(caminho)
+    if atual is None:
+        with _lock_segmentos:
+            atual = _segmentos.get(caminho)
+            if atual is None:
+                slots = getattr(settings, 'GREENHOUSE_MAX_DEVICES', SLOTS)
+                atual = _segmentos[caminho] = Segmento(caminho, slots)
+    return atual
+
+
+def fechar():
+    """Fecha os segmentos abertos neste processo; o próximo segmento() reabre."""
+    for atual in _segmentos.values():
+        atual.fechar()
+    _segmentos.clear()
+
+
+# o flock é do descritor aberto: pai e filho não se excluiriam com o mesmo fd
+os.register_at_fork(after_in_child=fechar)
@@ -0,0 +1,337 @@
+"""
+Simulador de ESP32 em asyncio para teste de carga (run_greenhouse_logic).
+
+Cada ESP virtual é um dispositivo (device_id próprio) com a sua estufa: a
+temperatura segue o dia (externa mais ganho solar), com inércia térmica, e
+cai quando as cortinas abrem. O ESP envia leituras, consulta o status
+(heartbeat) e, quando o servidor manda abrir/fechar um lado, avisa o início
+do movimento, leva move_timeout_ms para chegar e confirma com 'stop' — o
+mesmo protocolo do firmware.
+
+O tráfego sai por HTTP/1.1 puro (asyncio.open_connection, keep-alive) num
+pool de conexões compartilhado, sem dependências externas. `velocidade`
+acelera o relógio simulado (curva do dia e tempo de cortina), não a taxa
+de requisições.
+"""
+import asyncio
+import json
+import math
+import random
+import statistics
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+LADOS = ('left', 'right')
+TEMPO_LIMITE = 30.0  # s por requisição
+
+
+class ErroHttp(Exception):
+    pass
+
+
+class ConexaoHttp:
+    """Uma conexão HTTP/1.1 persistente; reabre sozinha quando o servidor fecha."""
+
+    def __init__(self, host, porta):
+        self.host = host
+        self.porta = porta
+        self.leitor = self.escritor = None
+
+    async def _abrir(self):
+        self.leitor, self.escritor = await asyncio.open_connection(self.host, self.porta)
+
+    def fechar(self):
+        if self.escritor is not None:
+            self.escritor.close()
+        self.leitor = self.escritor = None
+
+    async def requisitar(self, metodo, caminho, corpo=None):
+        """(status, corpo em bytes). Tenta uma vez de novo se a conexão reaproveitada caiu."""
+        for tentativa in range(2):
+            reaproveitada = self.escritor is not None
+            if not reaproveitada:
+                await self._abrir()
+            try:
+                return await self._trocar(metodo, caminho, corpo)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.fechar()
+                if not reaproveitada or tentativa:
+                    raise
+        raise ErroHttp('inalcançável')
+
+    async def _trocar(self, metodo, caminho, corpo):
+        cabecalhos = [f'{metodo} {caminho} HTTP/1.1', f'Host: {self.host}:{self.porta}', 'Connection: keep-alive']
+        if corpo is not None:
+            cabecalhos += ['Content-Type: application/json', f'Content-Length: {len(corpo)}']
+        self.escritor.write(('\r\n'.join(cabecalhos) + '\r\n\r\n').encode() + (corpo or b''))
+        await self.escritor.drain()
+
+        linha = await self.leitor.readuntil(b'\r\n')
+        partes = linha.split(None, 2)
+        if len(partes) < 2:
+            raise ErroHttp(f'resposta inválida: {linha!r}')
+        status = int(partes[1])
+        recebidos = {}
+        while True:
+            linha = await self.leitor.readuntil(b'\r\n')
+            if linha == b'\r\n':
+                break
+            nome, _, valor = linha.decode('latin-1').partition(':')
+            recebidos[nome.strip().lower()] = valor.strip()
+
+        if status == 304 or metodo == 'HEAD':
+            dados = b''
+        elif 'content-length' in recebidos:
+            dados = await self.leitor.readexactly(int(recebidos['content-length']))
+        elif recebidos.get('transfer-encoding', '').lower() == 'chunked':
+            dados = await self._ler_chunked()
+        else:
+            dados = await self.leitor.read()
+            self.fechar()
+            return status, dados
+
+        if recebidos.get('connection', '').lower() == 'close':
+            self.fechar()
+        return status, dados
+
+    async def _ler_chunked(self):
+        blocos = []
+        while True:
+            tamanho = int((await self.leitor.readuntil(b'\r\n')).split(b';')[0], 16)
+            if tamanho == 0:
+                await self.leitor.readuntil(b'\r\n')
+                return b''.join(blocos)
+            blocos.append(await self.leitor.readexactly(tamanho))
+            await self.leitor.readexactly(2)
+
+
+class Cliente:
+    """Pool de conexões com estatísticas por tipo de requisição."""
+
+    def __init__(self, url, conexoes):
+        partes = urlsplit(url)
+        if partes.scheme != 'http':
+            raise ValueError('só http:// é suportado')
+        self.base = partes.path.rstrip('/')
+        self.livres = asyncio.Queue()
+        for _ in range(conexoes):
+            self.livres.put_nowait(ConexaoHttp(partes.hostname, partes.port or 80))
+        self.latencias = defaultdict(list)
+        self.totais = defaultdict(int)
+        self.erros = defaultdict(int)
+
+    async def requisitar(self, nome, metodo, caminho, dados=None):
+        corpo = json.dumps(dados).encode() if dados is not None else None
+        conexao = await self.livres.get()
+        inicio = time.perf_counter()
+        try:
+            status, resposta = await asyncio.wait_for(
+                conexao.requisitar(metodo, self.base + caminho, corpo), TEMPO_LIMITE,
+            )
+        except (OSError, ErroHttp, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            conexao.fechar()
+            self.erros[nome] += 1
+            return None, None
+        finally:
+            self.livres.put_nowait(conexao)
+        self.latencias[nome].append(time.perf_counter() - inicio)
+        self.totais[nome] += 1
+        if status >= 400:
+            self.erros[nome] += 1
+        return status, resposta
+
+    def relatorio(self):
+        """Linhas com o intervalo desde o último relatório (p50/p95) e os totais."""
+        linhas = []
+        for nome in sorted(self.totais.keys() | self.erros.keys()):
+            ms = sorted(x * 1000 for x in self.latencias[nome])
+            if len(ms) > 1:
+                cortes = statistics.quantiles(ms, n=100, method='inclusive')
+                faixa = f'p50={cortes[49]:.1f}ms p95={cortes[94]:.1f}ms'
+            else:
+                faixa = f'{ms[0]:.1f}ms' if ms else '-'
+            linhas.append(f'{nome:15} +{len(ms):<6} {faixa:28} total={self.totais[nome]} erros={self.erros[nome]}')
+        self.latencias.clear()
+        return linhas
+
+
+class Relogio:
+    """Relógio simulado: anda `velocidade` vezes mais rápido que o real."""
+
+    def __init__(self, velocidade, hora_inicial):
+        self.velocidade = velocidade
+        self.zero = time.monotonic()
+        self.inicio = hora_inicial * 3600
+
+    def segundos(self):
+        return self.inicio + (time.monotonic() - self.zero) * self.velocidade
+
+    def hora_do_dia(self):
+        return (self.segundos() / 3600) % 24
+
+    async def dormir(self, segundos_simulados):
+        await asyncio.sleep(segundos_simulados / self.velocidade)
+
+
+class Cortina:
+    """Posição (0 fechada .. 1 aberta) com movimento linear no tempo de curso."""
+
+    def __init__(self):
+        self.alvo = 0.0
+        self.inicio = self.posicao_inicial = 0.0
+        self.duracao = 0.0
+
+    def mover(self, alvo, agora, duracao):
+        self.posicao_inicial = self.atual(agora)
+        self.alvo = alvo
+        self.inicio = agora
+        self.duracao = duracao * abs(alvo - self.posicao_inicial)
+
+    def atual(self, agora):
+        if self.duracao <= 0:
+            return self.alvo
+        fracao = min(1.0, (agora - self.inicio) / self.duracao)
+        return self.posicao_inicial + (self.alvo - self.posicao_inicial) * fracao
+
+
+class Estufa:
+    """Modelo térmico de primeira ordem: a temperatura persegue um alvo que depende da hora e das cortinas."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.media_externa = rng.uniform(17, 23)
+        self.amplitude = rng.uniform(5, 9)
+        self.ganho_solar = rng.uniform(8, 15)
+        self.constante = rng.uniform(900, 2400)  # s simulados
+        self.temperatura = self.media_externa
+        self.cortinas = {lado: Cortina() for lado in LADOS}
+
+    def avancar(self, agora, hora, dt):
+        externa = self.media_externa + self.amplitude * math.sin(2 * math.pi * (hora - 9) / 24)
+        sol = max(0.0, math.sin(math.pi * (hora - 6) / 12)) * self.ganho_solar
+        abertura = sum(c.atual(agora) for c in self.cortinas.values()) / len(LADOS)
+        # cortina aberta troca ar com o exterior: perde a maior parte do ganho solar
+        alvo = externa + sol * (1 - 0.7 * abertura)
+        self.temperatura += (alvo - self.temperatura) * (1 - math.exp(-dt / self.constante))
+        self.temperatura += self.rng.gauss(0, 0.05)
+        umidade = 95 - 1.6 * (self.temperatura - 15) + 8 * abertura + self.rng.gauss(0, 1)
+        return round(self.temperatura, 2), round(min(100.0, max(10.0, umidade)), 2)
+
+
+class EspVirtual:
+    def __init__(self, indice, cliente, relogio, rng, intervalo_leitura, intervalo_status, lote):
+        self.indice = indice
+        self.dispositivo = f'esp-{indice:04d}'
+        self.cliente = cliente
+        self.relogio = relogio
+        self.rng = rng
+        self.intervalo_leitura = intervalo_leitura
+        self.intervalo_status = intervalo_status
+        self.lote = lote
+        self.estufa = Estufa(rng)
+        self.movendo = {lado: None for lado in LADOS}
+        self.tempo_curso = 120.0
+        self.movimentos = set()
+
+    async def executar(self):
+        # espalha o início para não chegarem todos no mesmo instante
+        await asyncio.sleep(self.rng.uniform(0, max(self.intervalo_leitura, self.intervalo_status)))
+        try:
+            await asyncio.gather(self._leituras(), self._status())
+        finally:
+            for tarefa in self.movimentos:
+                tarefa.cancel()
+
+    def _disparar(self, corrotina):
+        tarefa = asyncio.create_task(corrotina)
+        self.movimentos.add(tarefa)
+        tarefa.add_done_callback(self.movimentos.discard)
+
+    async def _leituras(self):
+        pendentes = []
+        ultimo = self.relogio.segundos()
+        while True:
+            agora = self.relogio.segundos()
+            temperatura, umidade = self.estufa.avancar(agora, self.relogio.hora_do_dia(), agora - ultimo)
+            ultimo = agora
+            pendentes.append({'temperature': temperatura, 'humidity': umidade})
+            if len(pendentes) >= self.lote:
+                dados = pendentes[0] if self.lote == 1 else {'readings': pendentes}
+                dados['device_id'] = self.dispositivo
+                await self.cliente.requisitar('sensor-data', 'POST', '/api/sensor-data/', dados)
+                pendentes = []
+            await asyncio.sleep(self.intervalo_leitura)
+
+    async def _status(self):
+        while True:
+            status, corpo = await self.cliente.requisitar(
+                'status', 'GET', f'/api/status/?device=esp32&device_id={self.dispositivo}',
+            )
+            if status == 200:
+                try:
+                    self._obedecer(json.loads(corpo))
+                except ValueError:
+                    pass
+            await asyncio.sleep(self.intervalo_status)
+
+    def _obedecer(self, status):
+        self.tempo_curso = status.get('move_timeout_ms', 120000) / 1000
+        agora = self.relogio.segundos()
+        for lado in LADOS:
+            comando = status.get(lado)
+            if comando not in ('open', 'close') or self.movendo[lado] == comando:
+                continue
+            cortina = self.estufa.cortinas[lado]
+            alvo = 1.0 if comando == 'open' else 0.0
+            parada = self.movendo[lado] is None and cortina.atual(agora) == alvo
+            self.movendo[lado] = comando
+            if parada:
+                # já está na posição: só confirma
+                self._disparar(self._confirmar(lado))
+                continue
+            cortina.mover(alvo, agora, self.tempo_curso)
+            self._disparar(self._mover(lado, comando, cortina.duracao))
+
+    async def _mover(self, lado, comando, duracao):
+        await self.cliente.requisitar('esp-control', 'POST', '/api/manual-control-esp/', {
+            'side': lado, 'action': comando, 'device_id': self.dispositivo,
+        })
+        await self.relogio.dormir(duracao)
+        if self.movendo[lado] == comando:
+            await self._confirmar(lado)
+
+    async def _confirmar(self, lado):
+        self.movendo[lado] = None
+        await self.cliente.requisitar('esp-control', 'POST', '/api/manual-control-esp/', {
+            'side': lado, 'action': 'stop', 'device_id': self.dispositivo,
+        })
+
+
+async def executar(url, dispositivos=100, intervalo_leitura=10.0, intervalo_status=2.0, lote=1,
+                   conexoes=50, velocidade=1.0, duracao=0, intervalo_relatorio=10.0, semente=0, escrever=print):
+    """Roda o simulador até `duracao` segundos (0 = até ser interrompido)."""
+    rng = random.Random(semente)
+    cliente = Cliente(url, conexoes)
+    relogio = Relogio(velocidade, hora_inicial=rng.uniform(0, 24))
+    esps = [
+        EspVirtual(i, cliente, relogio, random.Random(rng.random()), intervalo_leitura, intervalo_status, lote)
+        for i in range(dispositivos)
+    ]
+    tarefas = [asyncio.create_task(esp.executar()) for esp in esps]
+    inicio = time.monotonic()
+    try:
+        while not duracao or time.monotonic() - inicio < duracao:
+            espera = intervalo_relatorio if not duracao else min(intervalo_relatorio, duracao - (time.monotonic() - inicio))
+            await asyncio.sleep(max(0.0, espera))
+            hora = relogio.hora_do_dia()
+            escrever(f'--- {time.monotonic() - inicio:.0f}s, hora simulada {int(hora):02d}:{int(hora % 1 * 60):02d}')
+            for linha in cliente.relatorio():
+                escrever(linha)
+    finally:
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        while not cliente.livres.empty():
+            cliente.livres.get_nowait().fechar()
+    return cliente
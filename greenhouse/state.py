@@ -0,0 +1,315 @@
+"""
+Cache de leitura do estado da estufa (GreenhouseControl + última leitura).
+
+O estado fica no cache compartilhado do Django (o alias de CACHES em
+settings.GREENHOUSE_STATE_CACHE, dimensionado por GREENHOUSE_MAX_DEVICES), marcado
+com um token de versão. Toda gravação troca o token depois do commit, então
+qualquer worker que leia o token novo descarta a cópia antiga e recarrega do
+banco uma única vez. Em regime permanente, ler o estado não faz consulta.
+
+Uma leitura nova do sensor não troca o token: depois do commit ela é
+publicada como a última leitura, com um token só dela (publicar_leitura), e
+o controle em cache continua valendo.
+
+O heartbeat do ESP também fica só no cache; o banco (last_esp_ping/esp_ip)
+recebe uma cópia a cada GREENHOUSE_HEARTBEAT_PERSIST_INTERVAL segundos ou
+quando o ESP volta a ficar online.
+
+Com GREENHOUSE_STATE_SEGMENT configurado, estado e heartbeat ficam no
+segmento de memória compartilhada (shm.py) em vez do cache: a leitura é uma
+cópia de memória, sem ir ao cache em arquivo. Dispositivos que não couberem
+no segmento continuam no cache.
+
+Só o primeiro lote de leituras de um ESP (provisionar) cria o seu controle e
+o seu registro no segmento; ler o status de um device_id desconhecido não
+grava nada.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import shm
+from .models import DISPOSITIVO_PADRAO, ControlChange, GreenhouseControl, SensorReading
+
+# versão global (invalida todos os dispositivos) e chaves por dispositivo
+CHAVE_VERSAO = 'greenhouse:estado:versao'
+CHAVE_VERSAO_DISPOSITIVO = 'greenhouse:estado:versao:{}'
+CHAVE_CONTROLE = 'greenhouse:estado:controle:{}'
+CHAVE_LEITURA = 'greenhouse:estado:ultima_leitura:{}'
+# a última leitura tem também um token próprio: uma leitura nova não invalida o controle
+CHAVE_VERSAO_LEITURA = 'greenhouse:estado:versao_leitura:{}'
+CHAVE_HEARTBEAT = 'greenhouse:esp:heartbeat:{}'
+
+logger = logging.getLogger(__name__)
+
+MAX_DISPOSITIVOS_PADRAO = 500
+
+# ESP é considerado online se fez contato nos últimos 20 segundos
+TEMPO_ONLINE = timedelta(seconds=20)
+
+
+def _cache():
+    return caches[getattr(settings, 'GREENHOUSE_STATE_CACHE', 'default')]
+
+
+def _novo_token():
+    return uuid.uuid4().hex[:16]
+
+
+def _garantir_versao(cache, chave):
+    cache.add(chave, _novo_token(), timeout=None)
+    return cache.get(chave)
+
+
+def versao(dispositivo=DISPOSITIVO_PADRAO):
+    """Token da versão atual do estado do dispositivo (muda a cada gravação)."""
+    cache = _cache()
+    chaves = (CHAVE_VERSAO, CHAVE_VERSAO_DISPOSITIVO.format(dispositivo))
+    valores = cache.get_many(chaves)
+    return tuple(valores.get(chave) or _garantir_versao(cache, chave) for chave in chaves)
+
+
+def _trocar_versao(dispositivo):
+    chave = CHAVE_VERSAO if dispositivo is None else CHAVE_VERSAO_DISPOSITIVO.format(dispositivo)
+    _cache().set(chave, _novo_token(), timeout=None)
+    segmento = shm.segmento()
+    if segmento is not None:
+        segmento.invalidar(dispositivo)
+
+
+def _segmento(dispositivo):
+    """Segmento com registro para o dispositivo; None (usa o cache) se desligado, cheio ou sem registro."""
+    segmento = shm.segmento()
+    if segmento is None or not segmento.tem_registro(dispositivo):
+        return None
+    return segmento
+
+
+def invalidar(dispositivo=None):
+    """
+    Troca o token de versão (e a geração do segmento) assim que a transação
+    atual fizer commit; sem `dispositivo`, de todos.
+    """
+    transaction.on_commit(lambda: _trocar_versao(dispositivo))
+
+
+def carregar_controle(dispositivo):
+    """
+    GreenhouseControl do banco (para gravar); None se o dispositivo não foi
+    provisionado. Só o dispositivo padrão é criado aqui, na primeira vez.
+    """
+    if dispositivo == DISPOSITIVO_PADRAO:
+        return GreenhouseControl.objects.get_or_create(device_id=dispositivo)[0]
+    return GreenhouseControl.objects.filter(device_id=dispositivo).first()
+
+
+def _provisionado(dispositivo):
+    return dispositivo == DISPOSITIVO_PADRAO or GreenhouseControl.objects.filter(device_id=dispositivo).exists()
+
+
+def _reservar_registro(dispositivo):
+    segmento = shm.segmento()
+    if segmento is not None:
+        segmento.reservar(dispositivo)
+
+
+def provisionar(dispositivo):
+    """
+    Cria o controle de um dispositivo novo (primeiro lote de leituras) e, após
+    o commit, reserva o seu registro no segmento. Ler o status nunca cria nada.
+    """
+    control, criado = GreenhouseControl.objects.get_or_create(device_id=dispositivo)
+    if criado:
+        limite = getattr(settings, 'GREENHOUSE_MAX_DEVICES', MAX_DISPOSITIVOS_PADRAO)
+        total = GreenhouseControl.objects.count()
+        if total > limite:
+            logger.warning(
+                'Dispositivo %s é o %dº, acima de GREENHOUSE_MAX_DEVICES (%d): '
+                'cache de estado e segmento não foram dimensionados para ele.', dispositivo, total, limite,
+            )
+        transaction.on_commit(lambda: _reservar_registro(dispositivo))
+    return control
+
+
+def _carregar_leitura(dispositivo):
+    return SensorReading.objects.filter(device_id=dispositivo).order_by('-timestamp').first()
+
+
+def obter_estado(dispositivo=DISPOSITIVO_PADRAO):
+    """
+    (control, latest) do dispositivo com uma ida ao cache; recarrega do banco só
+    o que estiver ausente ou de versão antiga. Os objetos são cópias: não use
+    para gravar campos além dos que você mesmo alterou (save com update_fields).
+    Dispositivo não provisionado: (None, None), sem gravar no cache nem no segmento.
+    """
+    segmento = _segmento(dispositivo)
+    if segmento is not None:
+        return _obter_estado_segmento(segmento, dispositivo)
+
+    cache = _cache()
+    chaves_versao = (
+        CHAVE_VERSAO, CHAVE_VERSAO_DISPOSITIVO.format(dispositivo), CHAVE_VERSAO_LEITURA.format(dispositivo),
+    )
+    chave_controle = CHAVE_CONTROLE.format(dispositivo)
+    chave_leitura = CHAVE_LEITURA.format(dispositivo)
+    valores = cache.get_many(chaves_versao + (chave_controle, chave_leitura))
+    # sem token do dispositivo: pode ser um device_id qualquer, que não deve ocupar o cache
+    if valores.get(chaves_versao[1]) is None and not _provisionado(dispositivo):
+        return None, None
+    atual = tuple(valores.get(chave) or _garantir_versao(cache, chave) for chave in chaves_versao)
+
+    resultado = []
+    novos = {}
+    # o controle depende das versões global e do dispositivo; a leitura, também da sua
+    for chave, carregar, versao in (
+        (chave_controle, carregar_controle, atual[:2]), (chave_leitura, _carregar_leitura, atual),
+    ):
+        entrada = valores.get(chave)
+        if entrada is not None and entrada[0] == versao:
+            resultado.append(entrada[1])
+        else:
+            valor = carregar(dispositivo)
+            novos[chave] = (versao, valor)
+            resultado.append(valor)
+
+    if novos:
+        cache.set_many(novos, timeout=None)
+        if chave_controle in novos and resultado[0] is not None:
+            # provisionado antes do segmento existir (ou de outro layout): reserva agora
+            _reservar_registro(dispositivo)
+    return tuple(resultado)
+
+
+def _obter_estado_segmento(segmento, dispositivo):
+    geracao, control, latest, valido = segmento.ler_estado(dispositivo)
+    if not valido:
+        control, latest = carregar_controle(dispositivo), _carregar_leitura(dispositivo)
+        # recusado se houve invalidação durante a carga: o próximo leitor recarrega
+        segmento.publicar(dispositivo, geracao, control, latest)
+    return control, latest
+
+
+def publicar_leitura(dispositivo, leitura):
+    """
+    Após o commit, põe `leitura` como a última do dispositivo sem invalidar o
+    controle. A leitura ganha um token novo (no segmento, uma geração nova):
+    um leitor que carregou a anterior do banco antes do commit não consegue
+    gravá-la por cima.
+    """
+    transaction.on_commit(lambda: _publicar_leitura(dispositivo, leitura))
+
+
+def _publicar_leitura(dispositivo, leitura):
+    segmento = _segmento(dispositivo)
+    if segmento is not None:
+        segmento.publicar_leitura(dispositivo, leitura)
+        return
+
+    cache = _cache()
+    chaves_versao = (CHAVE_VERSAO, CHAVE_VERSAO_DISPOSITIVO.format(dispositivo))
+    chave_leitura = CHAVE_LEITURA.format(dispositivo)
+    valores = cache.get_many(chaves_versao + (chave_leitura,))
+    anterior = valores.get(chave_leitura)
+    if anterior is not None and anterior[1] is not None and anterior[1].timestamp >= leitura.timestamp:
+        # lote atrasado: a leitura em cache já é mais nova
+        return
+    token = _novo_token()
+    novos = {CHAVE_VERSAO_LEITURA.format(dispositivo): token}
+    atual = tuple(valores.get(chave) for chave in chaves_versao)
+    if None not in atual:
+        novos[chave_leitura] = (atual + (token,), leitura)
+    # sem as versões em cache, só o token muda: o próximo leitor carrega do banco
+    cache.set_many(novos, timeout=None)
+
+
+def obter_controle(dispositivo=DISPOSITIVO_PADRAO):
+    return obter_estado(dispositivo)[0]
+
+
+def obter_ultima_leitura(dispositivo=DISPOSITIVO_PADRAO):
+    return obter_estado(dispositivo)[1]
+
+
+def campos_alterados(dispositivo, desde, ate):
+    """
+    Campos do status alterados nas versões (desde, ate] do controle, pelo
+    jornal; None se ele não cobre o intervalo inteiro (já podado).
+    """
+    if desde > ate:
+        return None
+    linhas = list(
+        ControlChange.objects.filter(device_id=dispositivo, version__gt=desde, version__lte=ate)
+        .values_list('fields', flat=True)
+    )
+    if len(linhas) != ate - desde:
+        return None
+    return {campo for linha in linhas for campo in linha.split(',')}
+
+
+# ---------- Heartbeat do ESP ----------
+def _intervalo_persistencia():
+    return timedelta(seconds=getattr(settings, 'GREENHOUSE_HEARTBEAT_PERSIST_INTERVAL', 60))
+
+
+def _ler_heartbeat(dispositivo):
+    segmento = _segmento(dispositivo)
+    if segmento is not None:
+        return segmento.ler_heartbeat(dispositivo)
+    return _cache().get(CHAVE_HEARTBEAT.format(dispositivo))
+
+
+def _gravar_heartbeat(dispositivo, momento, ip, persistido_em):
+    segmento = _segmento(dispositivo)
+    if segmento is not None:
+        segmento.gravar_heartbeat(dispositivo, momento, ip, persistido_em)
+    else:
+        _cache().set(CHAVE_HEARTBEAT.format(dispositivo), (momento, ip, persistido_em), timeout=None)
+
+
+def ultimo_heartbeat(control):
+    """(momento, ip) do último contato do ESP; sem nada no cache, usa o que está no banco."""
+    heartbeat = _ler_heartbeat(control.device_id)
+    if heartbeat is not None:
+        return heartbeat[0], heartbeat[1]
+    return control.last_esp_ping, control.esp_ip
+
+
+def online(momento, agora=None):
+    if not momento:
+        return False
+    return ((agora or timezone.now()) - momento) < TEMPO_ONLINE
+
+
+def registrar_heartbeat(control, ip):
+    """
+    Registra o contato do ESP no cache. Grava no banco só quando o ESP estava
+    offline (mudança de estado), trocou de IP ou passou o intervalo de persistência.
+    """
+    agora = timezone.now()
+    anterior = _ler_heartbeat(control.device_id)
+    if anterior is None:
+        anterior = (control.last_esp_ping, control.esp_ip, control.last_esp_ping)
+    momento_anterior, ip_anterior, persistido_em = anterior
+
+    persistir = (
+        not online(momento_anterior, agora)
+        or ip != ip_anterior
+        or persistido_em is None
+        or agora - persistido_em >= _intervalo_persistencia()
+    )
+    _gravar_heartbeat(control.device_id, agora, ip, agora if persistir else persistido_em)
+
+    if persistir:
+        if ip != ip_anterior:
+            # o IP faz parte do status: entra no jornal (ControlChange) e troca a versão
+            control.registrar_alteracao(last_esp_ping=agora, esp_ip=ip)
+            invalidar(control.device_id)
+        else:
+            # o status lê o momento do heartbeat acima, não do controle em cache: não invalida
+            GreenhouseControl.objects.filter(pk=control.pk).update(last_esp_ping=agora)
+    return persistir
@@ -0,0 +1,95 @@
+"""
+Transmissão do status para os dashboards (Server-Sent Events, só sob ASGI).
+
+Cada processo tem um único Difusor: uma tarefa asyncio lê o estado
+compartilhado a cada INTERVALO segundos e, quando algo muda, coloca a
+diferença na fila de cada navegador conectado. O custo cresce com as
+mudanças de estado, não com o número de abas abertas.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+
+INTERVALO = 0.5
+# sem mudanças, manda um "ping" (com last_contact_seconds) para manter a conexão
+INTERVALO_PING = 15
+TAMANHO_FILA = 50
+
+# muda a cada segundo; vai só no ping, senão todo tick viraria um delta
+CAMPOS_FORA_DO_DELTA = ("last_contact_seconds",)
+
+
+def _sem_contagem(status):
+    return {k: v for k, v in status.items() if k not in CAMPOS_FORA_DO_DELTA}
+
+
+def formatar(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados)}\n\n"
+
+
+class Difusor:
+    def __init__(self, montar_status, intervalo=INTERVALO):
+        self.montar_status = montar_status
+        self.intervalo = intervalo
+        self.inscritos = set()
+        self.tarefa = None
+        self.ultimo = None
+
+    def inscrever(self):
+        fila = asyncio.Queue(maxsize=TAMANHO_FILA)
+        if self.ultimo is not None:
+            fila.put_nowait(("status", self.ultimo))
+        self.inscritos.add(fila)
+        if self.tarefa is None or self.tarefa.done():
+            self.tarefa = asyncio.create_task(self._executar())
+        return fila
+
+    def cancelar(self, fila):
+        self.inscritos.discard(fila)
+
+    def _enviar(self, fila, evento, dados):
+        try:
+            fila.put_nowait((evento, dados))
+        except asyncio.QueueFull:
+            # navegador lento: descarta a fila e recomeça com o estado completo
+            while not fila.empty():
+                fila.get_nowait()
+            fila.put_nowait(("status", self.ultimo))
+
+    async def _executar(self):
+        montar = sync_to_async(self.montar_status)
+        try:
+            while self.inscritos:
+                status = await montar()
+                anterior = self.ultimo
+                self.ultimo = status
+                if anterior is None:
+                    for fila in list(self.inscritos):
+                        self._enviar(fila, "status", status)
+                else:
+                    atual, antes = _sem_contagem(status), _sem_contagem(anterior)
+                    delta = {k: v for k, v in atual.items() if antes.get(k) != v}
+                    if delta:
+                        for fila in list(self.inscritos):
+                            self._enviar(fila, "delta", delta)
+                await asyncio.sleep(self.intervalo)
+        finally:
+            # sem ninguém ouvindo, o próximo inscrito parte de um estado novo
+            self.ultimo = None
+
+    async def eventos(self):
+        """Gerador de eventos SSE para uma conexão."""
+        fila = self.inscrever()
+        try:
+            while True:
+                try:
+                    evento, dados = await asyncio.wait_for(fila.get(), timeout=INTERVALO_PING)
+                except asyncio.TimeoutError:
+                    if self.ultimo is None:
+                        continue
+                    evento = "ping"
+                    dados = {campo: self.ultimo.get(campo) for campo in CAMPOS_FORA_DO_DELTA}
+                yield formatar(evento, dados)
+        finally:
+            self.cancelar(fila)
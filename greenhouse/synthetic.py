@@ -0,0 +1,265 @@
+"""
+Histórico sintético em massa para testes de desempenho (generate_history).
+
+As leituras são geradas vetorizadas (NumPy) num passo fixo. A temperatura é
+a soma de uma senoide diária, uma sazonal (verão em janeiro), uma anomalia
+de "tempo" que varia de um dia para o outro e ruído; a umidade acompanha a
+temperatura no sentido inverso. As cortinas seguem a mesma regra do controle
+automático (controller.decidir), avaliada na média de cada hora, e esfriam a
+estufa enquanto estão abertas.
+
+A carga vai em blocos de dias locais inteiros, cada bloco numa transação:
+um executemany para as leituras brutas e um para cada nível de agregado,
+com os baldes já somados no NumPy (nenhum balde atravessa dois blocos).
+CurtainLog e CurtainInterval são gravados do mesmo jeito, com os horários
+simulados.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import controller, daycache, intervals, rollups, state
+from .models import (
+    DISPOSITIVO_PADRAO, CurtainInterval, CurtainLog, DailyAverage, GreenhouseControl, HourlyAverage,
+    MinuteAverage, SensorReading,
+)
+
+MODELOS = (SensorReading, MinuteAverage, HourlyAverage, DailyAverage, CurtainLog, CurtainInterval)
+DIAS_POR_BLOCO = 7
+RESFRIAMENTO = 4.0  # °C a menos com as cortinas abertas
+
+
+class BancoNaoVazio(Exception):
+    pass
+
+
+def _adaptar(epocas):
+    """Timestamps (epoch, s) no formato que o backend grava para DateTimeField."""
+    if connection.vendor == 'sqlite':
+        # o mesmo texto de adapt_datetimefield_value (UTC, sem microssegundos)
+        texto = np.datetime_as_string(epocas.astype('datetime64[s]'), unit='s')
+        return np.char.replace(texto, 'T', ' ').tolist()
+    return [
+        connection.ops.adapt_datetimefield_value(datetime.fromtimestamp(x, dt_timezone.utc))
+        for x in epocas.tolist()
+    ]
+
+
+def _baldes(chaves, temperatura, umidade):
+    """Agrega leituras ordenadas por `chaves`: arrays (início, *rollups.CAMPOS), um item por balde."""
+    inicios = np.concatenate(([0], np.flatnonzero(np.diff(chaves)) + 1))
+    contagem = np.diff(np.concatenate((inicios, [len(chaves)])))
+    return (
+        chaves[inicios],
+        contagem,
+        np.add.reduceat(temperatura, inicios),
+        np.add.reduceat(umidade, inicios),
+        np.minimum.reduceat(temperatura, inicios),
+        np.minimum.reduceat(umidade, inicios),
+        np.maximum.reduceat(temperatura, inicios),
+        np.maximum.reduceat(umidade, inicios),
+    )
+
+
+def _linhas_rollup(dispositivo, baldes):
+    inicio, *campos = baldes
+    return list(zip([dispositivo] * len(inicio), _adaptar(inicio), *(coluna.tolist() for coluna in campos)))
+
+
+class Gerador:
+    """Estado que atravessa os blocos: anomalias diárias, posição das cortinas e trechos abertos."""
+
+    def __init__(self, inicio, fim, passo, semente, control):
+        self.tz = timezone.get_default_timezone()
+        self.inicio = inicio
+        self.fim = fim
+        self.passo = passo
+        self.rng = np.random.default_rng(semente)
+        self.control = control
+        self.dispositivo = control.device_id
+        self.movimento = control.curtain_move_time_seconds
+        dias = (fim - inicio).days + 2
+        # anomalia AR(1): frentes frias e ondas de calor de alguns dias
+        ruido = self.rng.normal(0, 1.5, dias)
+        self.anomalia = np.empty(dias)
+        self.anomalia[0] = ruido[0]
+        for i in range(1, dias):
+            self.anomalia[i] = 0.7 * self.anomalia[i - 1] + ruido[i]
+        self.cortinas = SimpleNamespace(
+            min_temperature=control.min_temperature,
+            max_temperature=control.max_temperature,
+            left_is_open=False,
+            right_is_open=False,
+        )
+        self.trecho = ('closed', inicio.timestamp())  # trecho atual (estado, início)
+        self.leituras = 0
+
+    def _meia_noite(self, data):
+        return datetime.combine(data, time.min, tzinfo=self.tz).timestamp()
+
+    def _hora_local(self, t):
+        """Hora do dia local (fração) de cada t, com o deslocamento do fuso por hora UTC."""
+        horas, inverso = np.unique(t // 3600, return_inverse=True)
+        deslocamentos = np.array([
+            datetime.fromtimestamp(h * 3600, self.tz).utcoffset().total_seconds() for h in horas.tolist()
+        ])
+        return ((t + deslocamentos[inverso]) / 3600) % 24
+
+    def bloco(self, primeiro, dias):
+        """Gera e grava os dias locais [primeiro, primeiro + dias)."""
+        datas = [primeiro + timedelta(days=i) for i in range(dias + 1)]
+        bordas = np.array([self._meia_noite(d) for d in datas])
+        t0 = self.inicio.timestamp()
+        b0 = max(bordas[0], t0)
+        b1 = min(bordas[-1], self.fim.timestamp() + 1)
+        k0 = int(np.ceil((b0 - t0) / self.passo))
+        k1 = int(np.ceil((b1 - t0) / self.passo))
+        if k1 <= k0:
+            return 0
+        t = (t0 + np.arange(k0, k1) * self.passo).astype(np.int64)
+
+        indice_dia = np.searchsorted(bordas, t, side='right') - 1
+        dia_do_ano = np.array([d.timetuple().tm_yday for d in datas[:-1]])[indice_dia]
+        dia_global = (t - t0) / 86400
+        hora = self._hora_local(t)
+
+        bruta = (
+            21.0
+            + 4.0 * np.cos(2 * np.pi * (dia_do_ano - 15) / 365.25)
+            + 7.0 * np.sin(2 * np.pi * (hora - 9) / 24)
+            + np.interp(dia_global, np.arange(len(self.anomalia)), self.anomalia)
+            + self.rng.normal(0, 0.3, len(t))
+        )
+
+        # cortinas: decisão no início de cada hora pela média da hora anterior
+        chave_hora = t // 3600 * 3600
+        horas, inverso = np.unique(chave_hora, return_inverse=True)
+        media_hora = np.bincount(inverso, bruta) / np.bincount(inverso)
+        aberta = np.zeros(len(horas), dtype=bool)
+        logs, trechos = [], []
+        estado = self.cortinas
+        for j, media in enumerate(media_hora.tolist()):
+            aberta[j] = estado.left_is_open
+            acao = controller.decidir(media, estado)
+            momento = float(horas[j]) + 3600
+            if acao == 'stop' or momento + self.movimento > b1:
+                continue
+            logs.append((acao, momento, media))
+            estado.left_is_open = estado.right_is_open = acao == 'open'
+            trechos.append((self.trecho[0], self.trecho[1], momento + self.movimento))
+            self.trecho = ('open' if acao == 'open' else 'closed', momento + self.movimento)
+
+        temperatura = np.round(bruta - RESFRIAMENTO * aberta[inverso], 2)
+        umidade = np.round(np.clip(
+            88 - 1.8 * (temperatura - 15) + self.rng.normal(0, 2.0, len(t)), 25, 99,
+        ), 2)
+
+        with transaction.atomic():
+            self._gravar_leituras(t, temperatura, umidade)
+            for model, chaves in (
+                (MinuteAverage, t // 60 * 60),
+                (HourlyAverage, chave_hora),
+                (DailyAverage, bordas[indice_dia].astype(np.int64)),
+            ):
+                rollups.upsert_em_massa(
+                    model, _linhas_rollup(self.dispositivo, _baldes(chaves, temperatura, umidade)),
+                )
+            self._gravar_cortinas(logs, trechos, temperatura, umidade, t)
+        self.leituras += len(t)
+        return len(t)
+
+    def _gravar_leituras(self, t, temperatura, umidade):
+        qn = connection.ops.quote_name
+        sql = (
+            f"INSERT INTO {qn(SensorReading._meta.db_table)} "
+            f"({qn('device_id')}, {qn('temperature')}, {qn('humidity')}, {qn('timestamp')}) VALUES (%s, %s, %s, %s)"
+        )
+        linhas = zip([self.dispositivo] * len(t), temperatura.tolist(), umidade.tolist(), _adaptar(t))
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, list(linhas))
+
+    def _gravar_cortinas(self, logs, trechos, temperatura, umidade, t):
+        if not logs:
+            return
+        qn = connection.ops.quote_name
+        # timestamp é auto_now_add: insert direto para gravar o horário simulado
+        sql = (
+            f"INSERT INTO {qn(CurtainLog._meta.db_table)} "
+            f"({qn('device_id')}, {qn('side')}, {qn('action')}, {qn('temperature')}, {qn('humidity')}, "
+            f"{qn('timestamp')}) VALUES (%s, %s, %s, %s, %s, %s)"
+        )
+        momentos = np.array([m for _, m, _ in logs])
+        fins = momentos + self.movimento
+        # umidade da leitura mais próxima do comando
+        posicoes = np.clip(np.searchsorted(t, momentos), 0, len(t) - 1)
+        linhas = []
+        for (acao, _, media), quando, parada, i in zip(logs, _adaptar(momentos), _adaptar(fins), posicoes.tolist()):
+            linhas.append((self.dispositivo, 'both', acao, round(media, 2), umidade[i].item(), quando))
+            linhas.append((self.dispositivo, 'both', 'stop', temperatura[i].item(), umidade[i].item(), parada))
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, linhas)
+
+        CurtainInterval.objects.bulk_create([
+            CurtainInterval(
+                device_id=self.dispositivo, side=lado, state=estado,
+                start=datetime.fromtimestamp(inicio, dt_timezone.utc),
+                end=datetime.fromtimestamp(fim, dt_timezone.utc),
+            )
+            for estado, inicio, fim in trechos
+            for lado in intervals.LADOS
+        ])
+
+    def finalizar(self):
+        """Trecho atual em aberto (end=None) e o controle com a posição final das cortinas."""
+        estado, inicio = self.trecho
+        with transaction.atomic():
+            CurtainInterval.objects.bulk_create([
+                CurtainInterval(
+                    device_id=self.dispositivo, side=lado, state=estado,
+                    start=datetime.fromtimestamp(inicio, dt_timezone.utc),
+                )
+                for lado in intervals.LADOS
+            ])
+            aberta = estado == 'open'
+            self.control.registrar_alteracao(left_is_open=aberta, right_is_open=aberta, curtain_is_open=aberta)
+            state.invalidar(self.dispositivo)
+            daycache.marcar_epoca()
+
+
+def limpar(dispositivo=DISPOSITIVO_PADRAO):
+    """Apaga leituras, agregados e histórico das cortinas do dispositivo."""
+    with transaction.atomic():
+        for model in MODELOS:
+            model.objects.filter(device_id=dispositivo).delete()
+
+
+def gerar(dias, passo=10, fim=None, semente=0, apagar=False, dias_por_bloco=DIAS_POR_BLOCO, escrever=None,
+          dispositivo=DISPOSITIVO_PADRAO):
+    """
+    Gera `dias` dias locais de histórico do dispositivo terminando em `fim`
+    (padrão: agora), uma leitura a cada `passo` segundos. Recusa um dispositivo
+    que já tem dados, a não ser com `apagar`. Devolve o total de leituras gravadas.
+    """
+    escrever = escrever or (lambda texto: None)
+    if apagar:
+        limpar(dispositivo)
+    else:
+        ocupados = [model.__name__ for model in MODELOS if model.objects.filter(device_id=dispositivo).exists()]
+        if ocupados:
+            raise BancoNaoVazio(', '.join(ocupados))
+
+    tz = timezone.get_default_timezone()
+    fim = fim or timezone.now()
+    primeiro = timezone.localtime(fim, tz).date() - timedelta(days=dias - 1)
+    inicio = datetime.combine(primeiro, time.min, tzinfo=tz)
+    control = GreenhouseControl.objects.get_or_create(device_id=dispositivo)[0]
+
+    gerador = Gerador(inicio, fim, passo, semente, control)
+    for i in range(0, dias, dias_por_bloco):
+        quantidade = gerador.bloco(primeiro + timedelta(days=i), min(dias_por_bloco, dias - i))
+        escrever(f"{primeiro + timedelta(days=i)}: {quantidade} leituras (total {gerador.leituras})")
+    gerador.finalizar()
+    return gerador.leituras
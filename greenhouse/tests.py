@@ -1,3 +1,1500 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time as time_mod
+import unittest
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+
+from . import (
+    analytics, controller, daycache, downsample, ingest, intervals, metrics, periodos, retention, rollups, shm, state,
+    simulator, stream, synthetic, views, wire, writebehind,
+)
+from .models import (
+    SensorReading, MinuteAverage, HourlyAverage, DailyAverage, CurtainLog, CurtainInterval, GreenhouseControl,
+    ControlChange, DISPOSITIVO_PADRAO,
+)
+
+# os dois aliases no mesmo LocMemCache (mesmo LOCATION): cache.clear() limpa ambos
+LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'estado': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+# Tabelas que crescem com o tempo: toda consulta nelas precisa usar índice
+TABELAS_SERIES = (
+    'greenhouse_sensorreading',
+    'greenhouse_curtainlog',
+    'greenhouse_minuteaverage',
+    'greenhouse_hourlyaverage',
+    'greenhouse_dailyaverage',
+    'greenhouse_curtaininterval',
+    'greenhouse_controlchange',
+)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN é específico do SQLite')
+@override_settings(CACHES=LOCMEM)
+class HotQueryPlanTests(TestCase):
+    """Executa os caminhos quentes e confere o plano de cada consulta capturada."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='senha')
+        self.client.force_login(self.user)
+        GreenhouseControl.objects.create()
+        self.client.post(
+            '/api/sensor-data/',
+            data=json.dumps({'temperature': 25, 'humidity': 60}),
+            content_type='application/json',
+        )
+        CurtainLog.objects.create(side='left', action='open', temperature=25, humidity=60)
+
+    def _planos(self, executar):
+        with CaptureQueriesContext(connection) as consultas:
+            executar()
+        planos = []
+        with connection.cursor() as cursor:
+            for consulta in consultas.captured_queries:
+                sql = consulta['sql']
+                if not re.match(r'\s*(SELECT|DELETE|UPDATE)', sql, re.I):
+                    continue
+                if not any(tabela in sql for tabela in TABELAS_SERIES):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                planos.append((sql, [linha[-1] for linha in cursor.fetchall()]))
+        self.assertTrue(planos, 'nenhuma consulta em tabela de série foi capturada')
+        return planos
+
+    def assertUsaIndices(self, executar):
+        for sql, plano in self._planos(executar):
+            for passo in plano:
+                with self.subTest(sql=sql, passo=passo):
+                    self.assertNotRegex(passo, r'^SCAN \w+$', 'varredura completa da tabela')
+                    self.assertNotIn('TEMP B-TREE', passo, 'ordenação sem índice')
+
+    def test_status_sem_cache(self):
+        self.assertUsaIndices(lambda: (cache.clear(), self.client.get('/api/status/')))
+
+    def test_historico(self):
+        self.assertUsaIndices(lambda: self.client.get('/historico/'))
+
+    def test_historico_api_todas_resolucoes(self):
+        for resolucao in ('minute', 'hour', 'day'):
+            # resposta em streaming: a consulta só roda ao consumir o corpo
+            self.assertUsaIndices(lambda: b''.join(
+                self.client.get(f'/api/historico/?resolution={resolucao}').streaming_content
+            ))
+
+    def test_manual_control_esp(self):
+        self.assertUsaIndices(lambda: self.client.post(
+            '/api/manual-control-esp/',
+            data=json.dumps({'side': 'left', 'action': 'stop'}),
+            content_type='application/json',
+        ))
+
+    def test_curtain_intervals_api(self):
+        intervals.sincronizar(GreenhouseControl.objects.get())
+        self.assertUsaIndices(lambda: self.client.get('/api/curtain-intervals/'))
+
+    def test_controle_automatico(self):
+        SensorReading.objects.create(temperature=40, humidity=60)
+        # on_commit não dispara dentro do TestCase: descarta o estado em cache manualmente
+        cache.clear()
+        state.registrar_heartbeat(GreenhouseControl.objects.get(), '127.0.0.1')
+        self.assertUsaIndices(controller.avaliar)
+
+    def test_retencao(self):
+        self.assertUsaIndices(lambda: retention.aplicar(pausa=0))
+
+
+@override_settings(CACHES=LOCMEM)
+class IngestTests(TestCase):
+    """sensor_data_api: leitura única e lote (um INSERT, agregados por balde)."""
+
+    def setUp(self):
+        cache.clear()
+
+    def _enviar(self, corpo):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/sensor-data/', data=json.dumps(corpo), content_type='application/json')
+
+    def test_leitura_unica(self):
+        resposta = self._enviar({'temp': 24.5, 'umidade': 61})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {'success': True})
+        leitura = SensorReading.objects.get()
+        self.assertEqual((leitura.temperature, leitura.humidity), (24.5, 61))
+        self.assertEqual(self._enviar({'temperature': 'quente', 'humidity': 1}).status_code, 400)
+
+    def test_lote(self):
+        inicio = timezone.now().replace(second=0, microsecond=0) - timedelta(hours=2)
+        lote = [
+            {'temperature': 20 + i, 'humidity': 50, 'timestamp': (inicio + timedelta(seconds=30 * i)).isoformat()}
+            for i in range(4)
+        ]
+        lote += [
+            {'temperature': 30, 'humidity': 50, 'timestamp': (timezone.now() + timedelta(hours=1)).isoformat()},
+            {'humidity': 50},
+            {'temperature': 21, 'humidity': 50, 'timestamp': int(inicio.timestamp())},
+        ]
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self._enviar({'readings': lote})
+        dados = resposta.json()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual((dados['success'], dados['accepted'], dados['rejected']), (False, 5, 2))
+        self.assertEqual([r['index'] for r in dados['results'] if not r['success']], [4, 5])
+
+        self.assertEqual(SensorReading.objects.count(), 5)
+        tabela = 'INSERT INTO "greenhouse_sensorreading"'
+        self.assertEqual(sum(c['sql'].startswith(tabela) for c in consultas.captured_queries), 1)
+        # 0s, 30s e o epoch no 1º minuto; 60s e 90s no 2º
+        self.assertEqual(
+            list(MinuteAverage.objects.order_by('timestamp').values_list('count', 'temperature_sum')),
+            [(3, 62.0), (2, 45.0)],
+        )
+        self.assertEqual(sum(HourlyAverage.objects.values_list('count', flat=True)), 5)
+
+    def test_lote_invalido(self):
+        self.assertEqual(self._enviar([]).status_code, 400)
+        grande = [{'temperature': 20, 'humidity': 50}] * (views.MAX_LEITURAS_POR_LOTE + 1)
+        self.assertEqual(self._enviar(grande).status_code, 400)
+        resposta = self._enviar([{'humidity': 50}])
+        self.assertEqual((resposta.status_code, resposta.json()['rejected']), (400, 1))
+        self.assertFalse(SensorReading.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM)
+class StateCacheTests(TestCase):
+    """Estado em cache no caminho do status, trocado a cada gravação confirmada."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='senha')
+        self.client.force_login(self.user)
+        GreenhouseControl.objects.create(min_temperature=20, max_temperature=30)
+
+    def test_gravacao_invalida_o_cache(self):
+        self.client.get('/api/status/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/status/').json()['max_temperature'], 30)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/set-params/',
+                data=json.dumps({'min_temperature': 18, 'max_temperature': 28, 'curtain_move_time_seconds': 30}),
+                content_type='application/json',
+            )
+        self.assertEqual(self.client.get('/api/status/').json()['max_temperature'], 28)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/sensor-data/', data=json.dumps({'temperature': 22.5, 'humidity': 60}),
+                content_type='application/json',
+            )
+        self.assertEqual(self.client.get('/api/status/').json()['latest_reading']['temperature'], 22.5)
+
+    def test_leitura_nova_nao_invalida_o_controle(self):
+        agora = timezone.now()
+        self.client.get('/api/status/')
+        antes = state.versao()
+        velha = SensorReading(temperature=20, humidity=60, timestamp=agora - timedelta(minutes=1))
+        nova = SensorReading(temperature=22, humidity=60, timestamp=agora)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.salvar_leituras([velha, nova])
+        self.assertEqual(state.versao(), antes)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/status/').json()['latest_reading']['temperature'], 22)
+
+        # cópia carregada com o token anterior da leitura (leitor atrasado) é descartada
+        chave = state.CHAVE_LEITURA.format(DISPOSITIVO_PADRAO)
+        tag, _ = cache.get(chave)
+        cache.set(chave, (tag[:2] + ('antigo',), velha))
+        self.assertEqual(state.obter_ultima_leitura().temperature, 22)
+
+        # lote atrasado: a última leitura publicada continua a mais nova
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.salvar_leituras([
+                SensorReading(temperature=10, humidity=60, timestamp=agora - timedelta(minutes=5)),
+            ])
+        with self.assertNumQueries(0):
+            self.assertEqual(state.obter_ultima_leitura().temperature, 22)
+
+    def test_copia_vale_ate_invalidar(self):
+        control, _ = state.obter_estado()
+        # gravação fora dos caminhos do app (sem invalidar): o cache segue com a cópia
+        GreenhouseControl.objects.update(max_temperature=35)
+        self.assertEqual(state.obter_controle().max_temperature, control.max_temperature)
+        with self.captureOnCommitCallbacks(execute=True):
+            state.invalidar()
+        self.assertEqual(state.obter_controle().max_temperature, 35)
+
+
+@override_settings(CACHES=LOCMEM)
+class ConditionalStatusTests(TestCase):
+    """ETag/304 e long-poll do get_status_api."""
+
+    def setUp(self):
+        cache.clear()
+        GreenhouseControl.objects.create()
+
+    def test_etag_e_304(self):
+        primeira = self.client.get('/api/status/')
+        self.assertEqual(primeira['ETag'], f'"{primeira.json()["version"]}"')
+        self.assertEqual(primeira['Cache-Control'], 'no-cache')
+
+        igual = self.client.get('/api/status/', HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual((igual.status_code, igual.content), (304, b''))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/sensor-data/', data=json.dumps({'temperature': 22, 'humidity': 60}),
+                content_type='application/json',
+            )
+        mudou = self.client.get('/api/status/', HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(mudou.status_code, 200)
+        self.assertNotEqual(mudou['ETag'], primeira['ETag'])
+
+    def test_long_poll(self):
+        versao = self.client.get('/api/status/').json()['version']
+
+        inicio = time_mod.monotonic()
+        sem_mudanca = self.client.get('/api/status/', {'wait': 0.3, 'since': versao})
+        self.assertEqual(sem_mudanca.status_code, 304)
+        self.assertGreaterEqual(time_mod.monotonic() - inicio, 0.3)
+
+        def outro_worker_grava(segundos):
+            # a mudança chega durante a espera: a resposta sai na próxima volta
+            GreenhouseControl.objects.get().registrar_alteracao(max_temperature=33)
+            state._trocar_versao(DISPOSITIVO_PADRAO)
+
+        with mock.patch.object(views.time_mod, 'sleep', side_effect=outro_worker_grava) as espera:
+            resposta = self.client.get('/api/status/', {'wait': 30, 'since': versao})
+        self.assertEqual(espera.call_count, 1)
+        self.assertEqual((resposta.status_code, resposta.json()['max_temperature']), (200, 33))
+
+
+class AnalyticsTests(TestCase):
+    """Indicadores diários sobre um dia fechado com dados conhecidos."""
+
+    def setUp(self):
+        self.control = GreenhouseControl.objects.create(min_temperature=22, max_temperature=30)
+        self.dia = timezone.localdate() - timedelta(days=2)
+        self.meia_noite = datetime.combine(self.dia, time.min, tzinfo=timezone.get_current_timezone())
+        # uma hora por temperatura: 18, 19, ..., 41
+        HourlyAverage.objects.bulk_create([
+            HourlyAverage(
+                timestamp=self.meia_noite + timedelta(hours=h), count=2,
+                temperature_sum=2 * (18 + h), humidity_sum=100,
+                temperature_min=18 + h, temperature_max=18 + h, humidity_min=50, humidity_max=50,
+            )
+            for h in range(24)
+        ])
+
+    def _trecho(self, side, state, inicio, fim=None):
+        horas = lambda h: self.meia_noite + timedelta(hours=h) if h is not None else None
+        CurtainInterval.objects.create(side=side, state=state, start=horas(inicio), end=horas(fim))
+
+    def test_clima_e_cortinas(self):
+        # abertas desde antes da meia-noite; a esquerda fecha das 16h às 22h
+        self._trecho('left', 'open', -2, 16)
+        self._trecho('left', 'closed', 16, 22)
+        self._trecho('left', 'open', 22)
+        self._trecho('right', 'open', -2)
+        fim = self.meia_noite + timedelta(days=1) - timedelta(microseconds=1)
+
+        [dia] = analytics.diario(self.meia_noite, fim, self.control)
+
+        self.assertEqual(dia['date'], self.dia.isoformat())
+        self.assertEqual((dia['count'], dia['hours']), (48, 24))
+        self.assertEqual((dia['temperature_min'], dia['temperature_max']), (18, 41))
+        self.assertEqual(dia['temperature'], 29.5)
+        self.assertEqual((dia['hours_below'], dia['hours_above']), (4, 11))
+        self.assertEqual(dia['overheat_degree_hours'], 66)  # 1 + 2 + ... + 11
+        self.assertEqual(dia['curtain_open_seconds'], {'left': 18 * 3600, 'right': 24 * 3600})
+
+
+class CurtainIntervalTests(TestCase):
+    """Trechos mantidos pelos 'stop' do ESP."""
+
+    def setUp(self):
+        self.control = GreenhouseControl.objects.create()
+
+    def _esp(self, side, action):
+        self.client.post(
+            '/api/manual-control-esp/',
+            data=json.dumps({'side': side, 'action': action}),
+            content_type='application/json',
+        )
+
+    def test_stop_abre_e_fecha_trechos(self):
+        antes = timezone.now()
+        self._esp('left', 'stop')                       # primeiro registro: ambas fechadas
+        GreenhouseControl.objects.update(automatic_mode=False, manual_left_action='open')
+        self._esp('left', 'open')
+        self._esp('left', 'stop')                       # esquerda confirmada aberta
+        self._esp('right', 'stop')                      # direita continua fechada: nada muda
+
+        esquerda = list(CurtainInterval.objects.filter(side='left').order_by('start'))
+        self.assertEqual([t.state for t in esquerda], ['closed', 'open'])
+        self.assertEqual(esquerda[0].end, esquerda[1].start)
+        self.assertIsNone(esquerda[1].end)
+        self.assertEqual(CurtainInterval.objects.filter(side='right').count(), 1)
+
+        self.assertIsNone(intervals.trecho_em('left', antes))
+        self.assertEqual(intervals.trecho_em('left', timezone.now()).state, 'open')
+        self.assertEqual(
+            [t.state for t in intervals.sobrepostos('left', antes, timezone.now())], ['closed', 'open'],
+        )
+
+
+class SyntheticHistoryTests(TestCase):
+    """Carga em massa do generate_history: agregados coerentes com as leituras."""
+
+    def test_gerar(self):
+        fim = timezone.make_aware(datetime(2026, 1, 20, 18, 0))
+        leituras = synthetic.gerar(dias=3, passo=60, fim=fim, dias_por_bloco=2)
+
+        self.assertEqual(SensorReading.objects.count(), leituras)
+        self.assertEqual(leituras, 2 * 1440 + 18 * 60 + 1)
+        for model in (MinuteAverage, HourlyAverage, DailyAverage):
+            self.assertEqual(sum(model.objects.values_list('count', flat=True)), leituras)
+        self.assertEqual(DailyAverage.objects.count(), 3)
+        self.assertEqual(HourlyAverage.objects.count(), 2 * 24 + 19)
+
+        # verão: abre de dia, fecha de madrugada; um trecho atual por lado
+        self.assertTrue(CurtainLog.objects.filter(action='open').exists())
+        for lado in intervals.LADOS:
+            trechos = list(CurtainInterval.objects.filter(side=lado).order_by('start'))
+            self.assertEqual([t.end for t in trechos[:-1]], [t.start for t in trechos[1:]])
+            self.assertIsNone(trechos[-1].end)
+
+        with self.assertRaises(synthetic.BancoNaoVazio):
+            synthetic.gerar(dias=1, passo=60, fim=fim)
+
+
+class ExportTests(TestCase):
+    """Exportação em streaming (API e export_data) com limites por data ou data e hora."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('tester', password='senha'))
+        tz = timezone.get_current_timezone()
+        self.momentos = [
+            datetime(2026, 1, 5, 0, 0, tzinfo=tz), datetime(2026, 1, 5, 12, 0, tzinfo=tz),
+            datetime(2026, 1, 5, 23, 59, 59, tzinfo=tz), datetime(2026, 1, 6, 0, 0, tzinfo=tz),
+        ]
+        SensorReading.objects.bulk_create(
+            [SensorReading(temperature=20 + i, humidity=50, timestamp=m) for i, m in enumerate(self.momentos)]
+        )
+
+    def _corpo(self, resposta):
+        return b''.join(resposta.streaming_content)
+
+    def test_limites_por_data(self):
+        resposta = self.client.get('/api/export/readings/', {'start': '2026-01-05', 'end': '2026-01-05'})
+        self.assertEqual(
+            resposta['Content-Disposition'], 'attachment; filename="default_readings_20260105_20260105.csv"',
+        )
+        linhas = self._corpo(resposta).decode().splitlines()
+        # a data final vale até o último instante do dia
+        self.assertEqual(linhas[0], 'timestamp,temperature,humidity')
+        self.assertEqual([linha.split(',')[1] for linha in linhas[1:]], ['20.0', '21.0', '22.0'])
+
+    def test_limites_por_data_e_hora(self):
+        resposta = self.client.get('/api/export/readings/', {
+            'start': '2026-01-05T12:00', 'end': '2026-01-06T00:00', 'format': 'ndjson', 'gzip': '1',
+        })
+        self.assertEqual(resposta['Content-Type'], 'application/gzip')
+        linhas = [json.loads(linha) for linha in gzip.decompress(self._corpo(resposta)).splitlines()]
+        self.assertEqual([l['temperature'] for l in linhas], [21.0, 22.0, 23.0])
+        self.assertEqual(datetime.fromisoformat(linhas[-1]['timestamp']), self.momentos[-1])
+
+    def test_comando_igual_a_api(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            destino = os.path.join(diretorio, 'leituras.csv')
+            call_command(
+                'export_data', 'readings', '--start', '2026-01-05', '--end', '2026-01-05T23:59:59',
+                '--output', destino, stderr=io.StringIO(),
+            )
+            with open(destino, 'rb') as f:
+                arquivo = f.read()
+        api = self._corpo(self.client.get('/api/export/readings/', {'start': '2026-01-05', 'end': '2026-01-05'}))
+        self.assertEqual(arquivo, api)
+
+
+class RetentionTests(TestCase):
+    """Políticas de retenção e a remoção em lotes."""
+
+    def test_politicas_sobre_os_padroes(self):
+        with override_settings(GREENHOUSE_RETENTION={'SensorReading': timedelta(hours=6)}):
+            politicas = retention.politicas()
+        self.assertEqual(politicas['SensorReading'], timedelta(hours=6))
+        self.assertEqual(politicas['MinuteAverage'], retention.POLITICAS_PADRAO['MinuteAverage'])
+        self.assertEqual(set(politicas), set(retention.POLITICAS_PADRAO))
+
+    def test_limite_e_lotes(self):
+        limite = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        SensorReading.objects.bulk_create(
+            [SensorReading(temperature=20, humidity=50, timestamp=limite - timedelta(seconds=i)) for i in range(1, 6)]
+            + [SensorReading(temperature=21, humidity=50, timestamp=limite + timedelta(seconds=i)) for i in (0, 1)]
+        )
+        resultado = retention.apagar_anteriores(SensorReading, limite, tamanho_lote=2, pausa=0)
+        # estritamente anteriores ao limite; o próprio limite fica
+        self.assertEqual((resultado.removidos, resultado.lotes, resultado.interrompido), (5, 3, False))
+        self.assertEqual(
+            sorted(SensorReading.objects.values_list('timestamp', flat=True)), [limite, limite + timedelta(seconds=1)],
+        )
+
+    def test_prazo_esgotado(self):
+        antigo = timezone.now() - timedelta(days=1)
+        SensorReading.objects.bulk_create([SensorReading(temperature=20, humidity=50, timestamp=antigo)] * 3)
+        resultado = retention.apagar_anteriores(SensorReading, timezone.now(), tamanho_lote=1, pausa=0, prazo=0)
+        self.assertTrue(resultado.interrompido)
+        self.assertEqual(SensorReading.objects.count(), 3)
+
+    @override_settings(GREENHOUSE_RETENTION={'MinuteAverage': timedelta(days=1)})
+    def test_aplicar_invalida_caches(self):
+        agora = timezone.now()
+        rollups.registrar_leituras([
+            SensorReading(temperature=20, humidity=50, timestamp=agora - timedelta(days=2)),
+            SensorReading(temperature=20, humidity=50, timestamp=agora),
+        ])
+        SensorReading.objects.create(temperature=20, humidity=50, timestamp=agora - timedelta(hours=2))
+        with self.captureOnCommitCallbacks() as callbacks:
+            resultados = {r.modelo: r.removidos for r in retention.aplicar(pausa=0)}
+        self.assertEqual(resultados, {'SensorReading': 1, 'MinuteAverage': 1})
+        self.assertEqual(MinuteAverage.objects.count(), 1)
+        # leitura em cache (state) e época do cache de dias trocadas no commit
+        self.assertEqual(len(callbacks), 2)
+
+
+class PeriodTests(TestCase):
+    """Limites de período compartilhados pela API e pelo export_data."""
+
+    def test_data_e_data_hora(self):
+        tz = timezone.get_current_timezone()
+        self.assertEqual(periodos.parse_limite('2026-01-05'), datetime(2026, 1, 5, tzinfo=tz))
+        self.assertEqual(periodos.parse_limite('2026-01-05', fim=True), datetime.combine(
+            datetime(2026, 1, 5).date(), time.max, tzinfo=tz,
+        ))
+        self.assertEqual(periodos.parse_limite('2026-01-05T10:30'), datetime(2026, 1, 5, 10, 30, tzinfo=tz))
+        self.assertEqual(
+            periodos.parse_limite('2026-01-05T10:30:00+00:00'), datetime(2026, 1, 5, 10, 30, tzinfo=dt_timezone.utc),
+        )
+        for invalido in ('2026-13-01', 'ontem'):
+            with self.assertRaises(ValueError):
+                periodos.parse_limite(invalido)
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'readings', '--start', 'ontem')
+
+
+class RollupTests(TestCase):
+    """Upsert dos agregados: somas e extremos acumulados no banco, sem ler a linha antes."""
+
+    def _leituras(self, momento, *valores):
+        return [SensorReading(temperature=t, humidity=h, timestamp=momento) for t, h in valores]
+
+    def test_upsert_acumula(self):
+        momento = timezone.make_aware(datetime(2026, 1, 5, 10, 15))
+        for upsert in (rollups.upsert, rollups._upsert_orm):
+            with self.subTest(upsert=upsert.__name__):
+                HourlyAverage.objects.all().delete()
+                upsert(HourlyAverage, rollups.agrupar(
+                    self._leituras(momento, (20, 60), (24, 50)), rollups.inicio_da_hora,
+                ))
+                # balde já existente: um comando só, sem SELECT antes
+                with self.assertNumQueries(1):
+                    upsert(HourlyAverage, rollups.agrupar(
+                        self._leituras(momento + timedelta(minutes=30), (18, 70)), rollups.inicio_da_hora,
+                    ))
+                balde = HourlyAverage.objects.get()
+                self.assertEqual(balde.timestamp, rollups.inicio_da_hora(momento))
+                self.assertEqual((balde.count, balde.temperature_sum, balde.humidity_sum), (3, 62, 180))
+                self.assertEqual((balde.temperature_min, balde.temperature_max), (18, 24))
+                self.assertEqual((balde.humidity_min, balde.humidity_max), (50, 70))
+
+    def test_baldes_por_comando(self):
+        inicio = timezone.make_aware(datetime(2026, 1, 5))
+        leituras = [
+            SensorReading(temperature=20, humidity=50, timestamp=inicio + timedelta(minutes=i))
+            for i in range(rollups.BALDES_POR_COMANDO + 1)
+        ]
+        with self.assertNumQueries(2):
+            rollups.upsert(MinuteAverage, rollups.agrupar(leituras, rollups.inicio_do_minuto))
+        self.assertEqual(MinuteAverage.objects.count(), rollups.BALDES_POR_COMANDO + 1)
+
+
+@override_settings(CACHES=LOCMEM)
+class HistoryApiTests(TestCase):
+    """historico_api em streaming com paginação por chave (?limit=&after=)."""
+
+    def setUp(self):
+        cache.clear()
+        daycache.lru.limpar()
+        self.client.force_login(User.objects.create_user('tester', password='senha'))
+        self.inicio = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=10)
+        rollups.registrar_leituras([
+            SensorReading(temperature=20 + i, humidity=50, timestamp=self.inicio + timedelta(minutes=i))
+            for i in range(5)
+        ])
+
+    def _pagina(self, **parametros):
+        resposta = self.client.get('/api/historico/', {
+            'resolution': 'minute', 'start': (self.inicio - timedelta(minutes=1)).isoformat(), **parametros,
+        })
+        return json.loads(b''.join(resposta.streaming_content))
+
+    def test_paginas_por_chave(self):
+        temperaturas, cursores = [], []
+        pagina = self._pagina(limit=2)
+        while True:
+            temperaturas += [p['temperature'] for p in pagina['points']]
+            if pagina['next'] is None:
+                break
+            cursores.append(pagina['next'])
+            pagina = self._pagina(limit=2, after=pagina['next'])
+        self.assertEqual(temperaturas, [20, 21, 22, 23, 24])
+        self.assertEqual(cursores, [(self.inicio + timedelta(minutes=i)).isoformat() for i in (1, 3)])
+        self.assertEqual([p['temperature'] for p in self._pagina()['points']], temperaturas)
+
+    def test_resumo_do_dia_na_pagina_que_o_termina(self):
+        tz = timezone.get_current_timezone()
+        dias = [timezone.localdate() - timedelta(days=n) for n in (3, 2)]
+        rollups.registrar_leituras([
+            SensorReading(
+                temperature=20 + i, humidity=50, timestamp=datetime.combine(dia, time(12, i), tzinfo=tz),
+            )
+            for dia in dias for i in range(3)
+        ])
+        parametros = {'start': dias[0].isoformat(), 'end': dias[1].isoformat()}
+        paginas = [self._pagina(limit=2, **parametros)]
+        while paginas[-1]['next']:
+            paginas.append(self._pagina(limit=2, after=paginas[-1]['next'], **parametros))
+        # 3 pontos por dia em páginas de 2: cada dia sai uma vez, na página do seu último ponto
+        self.assertEqual(
+            [[d['date'] for d in pagina['days']] for pagina in paginas],
+            [[], [dias[0].isoformat()], [dias[1].isoformat()]],
+        )
+
+    def test_reducao_limita_a_entrada(self):
+        # points=N carrega no máximo FATOR_ENTRADA_REDUCAO * N baldes: minute vira um nível mais grosso
+        inicio = (timezone.now() - timedelta(days=2)).isoformat()
+        self.assertEqual(self._pagina(points=1000)['resolution'], 'minute')
+        self.assertEqual(self._pagina(points=100, start=inicio)['resolution'], 'hour')
+        self.assertEqual(self._pagina(points=3, start=inicio)['resolution'], 'day')
+
+    def test_parametros_invalidos(self):
+        for parametros in ({'limit': 5001}, {'limit': -1}, {'limit': 2, 'points': 10}, {'after': 'ontem'}):
+            with self.subTest(**parametros):
+                resposta = self.client.get('/api/historico/', parametros)
+                self.assertEqual(resposta.status_code, 400)
+
+
+class ResolutionChoiceTests(TestCase):
+    """escolher_nivel: mais fino que caiba no limite de pontos e ainda tenha dados pela retenção."""
+
+    def test_respeita_retencao(self):
+        agora = timezone.now()
+        recente = rollups.escolher_nivel(agora - timedelta(hours=6), agora, agora=agora)
+        self.assertEqual(recente.nome, 'minute')
+        # 6 horas de 8 dias atrás: os minutos já foram apagados (7 dias)
+        antigo = rollups.escolher_nivel(agora - timedelta(days=8), agora - timedelta(days=8, hours=-6), agora=agora)
+        self.assertEqual(antigo.nome, 'hour')
+        with override_settings(GREENHOUSE_RETENTION={'MinuteAverage': None}):
+            self.assertEqual(
+                rollups.escolher_nivel(agora - timedelta(days=8), agora - timedelta(days=8, hours=-6)).nome, 'minute',
+            )
+
+
+@override_settings(CACHES=LOCMEM)
+class DayCacheTests(TestCase):
+    """Cache por dia do histórico: dias encerrados do LRU, invalidados pelas marcas."""
+
+    def setUp(self):
+        cache.clear()
+        daycache.lru.limpar()
+        self.ontem = timezone.localdate() - timedelta(days=1)
+
+    def _momento(self, hora):
+        return timezone.make_aware(datetime.combine(self.ontem, time(hora)))
+
+    def _serie(self):
+        inicio, fim = self._momento(0), self._momento(23)
+        return [p['temperature'] for p in daycache.iterar_pontos(rollups.MINUTO, inicio, fim)]
+
+    def test_marca_descartada_invalida(self):
+        rollups.registrar_leituras([SensorReading(temperature=20, humidity=50, timestamp=self._momento(10))])
+        self.assertEqual(self._serie(), [20])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.salvar_leituras([SensorReading(temperature=22, humidity=50, timestamp=self._momento(11))])
+        # o cache "default" descartou a marca antes de alguém ler o dia
+        cache.delete(daycache._chave_marca(DISPOSITIVO_PADRAO, self.ontem))
+        self.assertEqual(self._serie(), [20, 22])
+
+    def test_dia_encerrado_vem_do_lru(self):
+        rollups.registrar_leituras([SensorReading(temperature=20, humidity=50, timestamp=self._momento(10))])
+        self.assertEqual(self._serie(), [20])
+        # só a ida ao cache das marcas; hoje (fora do intervalo) não entra
+        with self.assertNumQueries(0):
+            self.assertEqual(self._serie(), [20])
+
+        resumos = []
+        list(daycache.iterar_pontos(rollups.MINUTO, self._momento(0), self._momento(23), resumos=resumos))
+        self.assertEqual(resumos[0]['date'], self.ontem.isoformat())
+        self.assertEqual((resumos[0]['count'], resumos[0]['temperature_max']), (1, 20))
+
+    def test_hoje_sempre_do_banco(self):
+        agora = timezone.now()
+        inicio = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+        rollups.registrar_leituras([SensorReading(temperature=20, humidity=50, timestamp=inicio)])
+        list(daycache.iterar_pontos(rollups.MINUTO, inicio, agora))
+        with self.assertNumQueries(1):
+            list(daycache.iterar_pontos(rollups.MINUTO, inicio, agora))
+
+    def test_epoca_invalida_todos_os_dias(self):
+        rollups.registrar_leituras([SensorReading(temperature=20, humidity=50, timestamp=self._momento(10))])
+        self.assertEqual(self._serie(), [20])
+        MinuteAverage.objects.all().delete()
+        self.assertEqual(self._serie(), [20])
+        with self.captureOnCommitCallbacks(execute=True):
+            daycache.marcar_epoca()
+        self.assertEqual(self._serie(), [])
+
+    @override_settings(GREENHOUSE_DAY_CACHE_MAX_POINTS=3)
+    def test_lru_limitado_por_pontos(self):
+        anteontem = self.ontem - timedelta(days=1)
+        rollups.registrar_leituras([
+            SensorReading(temperature=20, humidity=50, timestamp=timezone.make_aware(datetime.combine(dia, time(h))))
+            for dia in (anteontem, self.ontem) for h in (8, 9)
+        ])
+        inicio = timezone.make_aware(datetime.combine(anteontem, time.min))
+        list(daycache.iterar_pontos(rollups.MINUTO, inicio, self._momento(23)))
+        # 4 pontos não cabem em 3: o dia menos recente sai
+        self.assertEqual(daycache.lru.pontos, 2)
+        self.assertEqual([chave[-1] for chave in daycache.lru.itens], [self.ontem])
+
+
+class DownsampleTests(TestCase):
+    """Redução LTTB: nunca passa do alvo, usa o orçamento e guarda bordas e picos."""
+
+    def _serie(self, n):
+        inicio = timezone.make_aware(datetime(2026, 1, 1))
+        return [
+            {
+                'timestamp': (inicio + timedelta(minutes=i)).isoformat(),
+                'temperature': 20 + (i % 37) / 10 + (15 if i == n // 3 else 0),
+                'humidity': 60 + (i % 53) / 10 - (20 if i == 2 * n // 3 else 0),
+            }
+            for i in range(n)
+        ]
+
+    def test_lttb_mantem_bordas(self):
+        x = np.arange(100, dtype=np.float64)
+        y = np.sin(x / 7)
+        for alvo in (3, 4, 10, 99):
+            indices = downsample.lttb(x, y, alvo)
+            self.assertEqual(len(indices), alvo)
+            self.assertEqual((indices[0], indices[-1]), (0, 99))
+            self.assertTrue((np.diff(indices) > 0).all())
+        with self.assertRaises(ValueError):
+            downsample.lttb(x, y, 2)
+
+    def test_alvos_pequenos(self):
+        pontos = self._serie(500)
+        for alvo in range(3, 8):
+            with self.subTest(alvo=alvo):
+                reduzidos = downsample.reduzir_serie(pontos, alvo)
+                self.assertLessEqual(len(reduzidos), alvo)
+                self.assertIs(reduzidos[0], pontos[0])
+                self.assertIs(reduzidos[-1], pontos[-1])
+        # com 4 pontos cabem as bordas e os dois picos
+        self.assertEqual(
+            [pontos.index(p) for p in downsample.reduzir_serie(pontos, 4)], [0, 500 // 3, 2 * 500 // 3, 499],
+        )
+
+    def test_usa_o_orcamento(self):
+        pontos = self._serie(5000)
+        for alvo in (50, 999):
+            with self.subTest(alvo=alvo):
+                reduzidos = downsample.reduzir_serie(pontos, alvo)
+                self.assertLessEqual(len(reduzidos), alvo)
+                self.assertGreaterEqual(len(reduzidos), alvo * 0.95)
+                self.assertEqual(reduzidos, sorted(reduzidos, key=lambda p: p['timestamp']))
+
+
+class MetricsTests(TestCase):
+    """Contadores por view e soma dos arquivos de vários processos."""
+
+    def setUp(self):
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.diretorio.cleanup)
+        ajuste = override_settings(GREENHOUSE_METRICS_DIR=self.diretorio.name, CACHES=LOCMEM)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        cache.clear()
+        metrics.registro.reiniciar()
+        GreenhouseControl.objects.create()
+
+    def test_metrics(self):
+        self.client.post(
+            '/api/sensor-data/',
+            data=json.dumps({'readings': [{'temperature': 25, 'humidity': 60}] * 3}),
+            content_type='application/json',
+        )
+        self.client.get('/api/status/')
+        # outro worker que já gravou o seu arquivo
+        with open(os.path.join(self.diretorio.name, 'outro.json'), 'w') as f:
+            json.dump({
+                'contadores': [['greenhouse_readings_ingested_total', [], 7]],
+                'histogramas': [],
+            }, f)
+
+        self.client.force_login(User.objects.create_user('tester', password='senha'))
+        texto = self.client.get('/metrics').content.decode()
+
+        self.assertIn('greenhouse_readings_ingested_total 10', texto)
+        self.assertIn('greenhouse_rollup_buckets_upserted_total{tier="minute"} 1', texto)
+        self.assertIn('greenhouse_http_requests_total{method="GET",status="200",view="get_status_api"} 1', texto)
+        self.assertIn('greenhouse_http_request_duration_seconds_count{view="sensor_data_api"} 1', texto)
+        self.assertIn('greenhouse_http_request_duration_seconds_bucket{view="get_status_api",le="+Inf"} 1', texto)
+        self.assertRegex(texto, r'greenhouse_db_queries_total\{view="sensor_data_api"\} [1-9]')
+        self.assertIn('greenhouse_esp_online{device="default"} 0', texto)
+
+    def test_acesso_restrito(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(GREENHOUSE_METRICS_TOKEN='segredo'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer outro').status_code, 403)
+            resposta = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('greenhouse_esp_online{device="default"} 0', resposta.content.decode())
+
+    def test_arquivos_de_processos_encerrados(self):
+        processo = subprocess.Popen(['true'])
+        processo.wait()
+        morto = os.path.join(self.diretorio.name, f'{processo.pid}-abcd1234.json')
+        for _ in range(2):
+            with open(morto, 'w') as f:
+                json.dump({'contadores': [['greenhouse_readings_ingested_total', [], 4]], 'histogramas': []}, f)
+            texto = metrics.exportar()
+            # somado em encerrados.json e apagado: o total continua crescendo
+            self.assertFalse(os.path.exists(morto))
+        self.assertIn('greenhouse_readings_ingested_total 8', texto)
+        self.assertTrue(os.path.exists(os.path.join(self.diretorio.name, metrics.ARQUIVO_ENCERRADOS)))
+
+    def test_middleware_assincrono(self):
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        resposta = async_to_sync(middleware)(RequestFactory().get('/qualquer'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn(
+            'greenhouse_http_requests_total{method="GET",status="200",view="unmatched"} 1', metrics.exportar(),
+        )
+
+
+class StateSegmentTests(TestCase):
+    """Estado e heartbeat no segmento compartilhado (GREENHOUSE_STATE_SEGMENT)."""
+
+    def setUp(self):
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.diretorio.cleanup)
+        ajuste = override_settings(
+            GREENHOUSE_STATE_SEGMENT=os.path.join(self.diretorio.name, 'estado.seg'), CACHES=LOCMEM,
+        )
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.addCleanup(shm.fechar)
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            state.provisionar(DISPOSITIVO_PADRAO)
+
+    def test_status_do_segmento(self):
+        self.client.get('/api/status/', {'device': 'esp32'})
+        with self.assertNumQueries(0):
+            dados = self.client.get('/api/status/').json()
+        self.assertTrue(dados['esp_online'])
+        self.assertEqual(dados['esp_ip'], '127.0.0.1')
+
+        # leitura nova: publicada no segmento após o commit, sem recarregar o controle
+        geracao = shm.segmento().ler_estado(DISPOSITIVO_PADRAO)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/sensor-data/',
+                data=json.dumps({'temperature': 25.5, 'humidity': 60}),
+                content_type='application/json',
+            )
+        with self.assertNumQueries(0):
+            control, latest = state.obter_estado()
+        self.assertEqual(latest.temperature, 25.5)
+        self.assertEqual(control.pk, GreenhouseControl.objects.get().pk)
+        # um leitor que carregou antes da leitura nova não a sobrescreve
+        self.assertFalse(shm.segmento().publicar(DISPOSITIVO_PADRAO, geracao, control, None))
+        self.assertEqual(state.obter_ultima_leitura().temperature, 25.5)
+
+        # gravação no controle: a geração muda no commit e o próximo leitor recarrega uma vez
+        with self.captureOnCommitCallbacks(execute=True):
+            state.invalidar(DISPOSITIVO_PADRAO)
+        with self.assertNumQueries(2):
+            state.obter_estado()
+
+    def test_segmento_cheio_usa_o_cache(self):
+        with override_settings(GREENHOUSE_MAX_DEVICES=1):
+            shm.fechar()
+            self.client.get('/api/status/', {'device': 'esp32'})
+            with self.assertLogs('greenhouse', 'WARNING') as avisos, self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    '/api/sensor-data/',
+                    data=json.dumps({'device_id': 'estufa-b', 'temperature': 25, 'humidity': 60}),
+                    content_type='application/json',
+                )
+            self.assertIn('greenhouse.shm', [registro.name for registro in avisos.records])
+            self.client.get('/api/status/', {'device': 'esp32', 'device_id': 'estufa-b'})
+            # o excedente fica no cache: heartbeat preservado e estado sem consulta
+            with self.assertNumQueries(0):
+                dados = self.client.get('/api/status/', {'device_id': 'estufa-b'}).json()
+            self.assertTrue(dados['esp_online'])
+            self.assertFalse(shm.segmento().tem_registro('estufa-b'))
+            shm.fechar()
+
+    def test_layout_novo_em_outro_arquivo(self):
+        caminho = os.path.join(self.diretorio.name, 'layout.seg')
+        antigo = shm.Segmento(caminho, 2)
+        self.addCleanup(antigo.fechar)
+        agora = timezone.now()
+        antigo.reservar('esp')
+        antigo.gravar_heartbeat('esp', agora, '10.0.0.1', agora)
+
+        novo = shm.Segmento(caminho, 3)
+        self.addCleanup(novo.fechar)
+        self.assertNotEqual(antigo.arquivo, novo.arquivo)
+        self.assertIsNone(novo.ler_heartbeat('esp'))
+        # o worker antigo continua com o seu mapeamento intacto
+        self.assertEqual(antigo.ler_heartbeat('esp')[1], '10.0.0.1')
+
+    def test_status_desconhecido_nao_reserva_registro(self):
+        resposta = self.client.get('/api/status/', {'device': 'esp32', 'device_id': 'qualquer'})
+        self.assertEqual(resposta.status_code, 404)
+        self.assertFalse(GreenhouseControl.objects.filter(device_id='qualquer').exists())
+        self.assertFalse(shm.segmento().tem_registro('qualquer'))
+
+        # o primeiro lote de leituras provisiona o dispositivo e o seu registro
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/sensor-data/',
+                data=json.dumps({'device_id': 'qualquer', 'temperature': 25, 'humidity': 60}),
+                content_type='application/json',
+            )
+        self.assertTrue(shm.segmento().tem_registro('qualquer'))
+        self.assertEqual(self.client.get('/api/status/', {'device_id': 'qualquer'}).status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM)
+class MultiDeviceTests(TestCase):
+    """Vários ESPs no mesmo servidor: dados, estado e comandos separados por device_id."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='senha')
+        self.client.force_login(self.user)
+
+    def _enviar(self, dispositivo, temperatura):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                '/api/sensor-data/',
+                data=json.dumps({'device_id': dispositivo, 'temperature': temperatura, 'humidity': 60}),
+                content_type='application/json',
+            )
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_dispositivos_independentes(self):
+        self._enviar('estufa-a', 20)
+        self._enviar('estufa-b', 30)
+
+        # primeiro contato cria o controle de cada ESP
+        self.assertEqual(
+            list(GreenhouseControl.objects.order_by('device_id').values_list('device_id', flat=True)),
+            ['estufa-a', 'estufa-b'],
+        )
+        a = self.client.get('/api/status/', {'device_id': 'estufa-a'}).json()
+        b = self.client.get('/api/status/', {'device_id': 'estufa-b'}).json()
+        self.assertEqual((a['device_id'], a['latest_reading']['temperature']), ('estufa-a', 20))
+        self.assertEqual((b['device_id'], b['latest_reading']['temperature']), ('estufa-b', 30))
+        self.assertNotEqual(a['version'], b['version'])
+
+        # mesmo minuto, um balde por dispositivo
+        self.assertEqual(MinuteAverage.objects.filter(device_id='estufa-a').get().temperature_sum, 20)
+        self.assertEqual(MinuteAverage.objects.filter(device_id='estufa-b').get().temperature_sum, 30)
+        resposta = self.client.get('/api/historico/', {'device_id': 'estufa-b', 'resolution': 'minute'})
+        pontos = json.loads(b''.join(resposta.streaming_content))['points']
+        self.assertEqual([p['temperature'] for p in pontos], [30])
+
+        # comando manual só afeta a estufa escolhida
+        state.registrar_heartbeat(GreenhouseControl.objects.get(device_id='estufa-a'), '10.0.0.1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/manual-left/?device_id=estufa-a',
+                data=json.dumps({'action': 'open'}),
+                content_type='application/json',
+            )
+        self.assertEqual(self.client.get('/api/status/', {'device_id': 'estufa-a'}).json()['left'], 'open')
+        self.assertEqual(self.client.get('/api/status/', {'device_id': 'estufa-b'}).json()['left'], 'stop')
+
+        invalido = self.client.post(
+            '/api/sensor-data/',
+            data=json.dumps({'device_id': 'a b', 'temperature': 1, 'humidity': 1}),
+            content_type='application/json',
+        )
+        self.assertEqual(invalido.status_code, 400)
+
+        # status e comandos não criam dispositivos: só o primeiro lote de leituras
+        self.assertEqual(self.client.get('/api/status/', {'device_id': 'estufa-c'}).status_code, 404)
+        desconhecido = self.client.post(
+            '/api/manual-left/?device_id=estufa-c',
+            data=json.dumps({'action': 'open'}),
+            content_type='application/json',
+        )
+        self.assertEqual(desconhecido.status_code, 404)
+        self.assertFalse(GreenhouseControl.objects.filter(device_id='estufa-c').exists())
+
+    def test_consultas_nao_crescem_com_dispositivos(self):
+        self._enviar('estufa-a', 20)
+        with CaptureQueriesContext(connection) as antes:
+            self._enviar('estufa-a', 21)
+        GreenhouseControl.objects.bulk_create(
+            [GreenhouseControl(device_id=f'esp-{i:03d}') for i in range(100)]
+        )
+        with CaptureQueriesContext(connection) as depois:
+            self._enviar('estufa-a', 22)
+        self.assertEqual(len(antes), len(depois))
+
+
+@override_settings(CACHES=LOCMEM)
+class AutomaticControlTests(TestCase):
+    """avaliar decide pelo estado em cache e só trava/grava quando o comando muda."""
+
+    def setUp(self):
+        cache.clear()
+        self.control = GreenhouseControl.objects.create(min_temperature=20, max_temperature=30)
+        state.registrar_heartbeat(self.control, '10.0.0.1')
+
+    def _ler(self, temperatura):
+        SensorReading.objects.create(temperature=temperatura, humidity=60)
+        # on_commit não dispara dentro do TestCase: troca a versão manualmente
+        state._trocar_versao(None)
+
+    def test_sem_mudanca_nao_consulta(self):
+        self._ler(25)
+        self.assertEqual(controller.avaliar(), 'stop')
+        with self.assertNumQueries(0):
+            self.assertEqual(controller.avaliar(), 'stop')
+        self.assertFalse(CurtainLog.objects.exists())
+
+    def test_mudanca_grava_comando_e_log(self):
+        self._ler(35)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(controller.avaliar(), 'open')
+        self.control.refresh_from_db()
+        self.assertEqual(
+            (self.control.auto_left_action, self.control.auto_right_action, self.control.curtain_status),
+            ('open', 'open', 'open'),
+        )
+        self.assertEqual(CurtainLog.objects.get().action, 'open')
+
+        # a cópia em cache já tem o comando novo: nada a gravar de novo
+        with self.assertNumQueries(2):
+            self.assertEqual(controller.avaliar(), 'open')
+        self.assertEqual(CurtainLog.objects.count(), 1)
+
+    def test_cache_atrasado_rechecado_sob_trava(self):
+        self._ler(35)
+        state.obter_estado()
+        # outro worker já gravou o comando; a cópia em cache ainda não sabe
+        GreenhouseControl.objects.update(auto_left_action='open', auto_right_action='open', curtain_status='open')
+        self.assertEqual(controller.avaliar(), 'open')
+        self.assertFalse(CurtainLog.objects.exists())
+
+
+@override_settings(
+    CACHES=LOCMEM, GREENHOUSE_WRITE_BEHIND=True, GREENHOUSE_WRITE_BEHIND_QUEUE=3,
+    GREENHOUSE_WRITE_BEHIND_INTERVAL_MS=60_000, GREENHOUSE_WRITE_BEHIND_MAX_ROWS=1000,
+)
+class WriteBehindTests(TestCase):
+    """Leituras enfileiradas (202), fila cheia (503) e gravação em grupo ao parar."""
+
+    def setUp(self):
+        cache.clear()
+        GreenhouseControl.objects.create()
+        self.addCleanup(writebehind.parar)
+
+    def _lote(self, *temperaturas):
+        minuto = timezone.now().replace(second=0, microsecond=0)
+        return self.client.post(
+            '/api/sensor-data/',
+            data=json.dumps([
+                {'temperature': t, 'humidity': 60, 'timestamp': (minuto + timedelta(seconds=i)).isoformat()}
+                for i, t in enumerate(temperaturas)
+            ]),
+            content_type='application/json',
+        )
+
+    def test_fila(self):
+        self.assertEqual(self._lote(20, 22).status_code, 202)
+        self.assertFalse(SensorReading.objects.exists())
+
+        cheia = self._lote(24, 26)
+        self.assertEqual(cheia.status_code, 503)
+        self.assertEqual(cheia['Retry-After'], '1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            writebehind.parar()
+        self.assertEqual(SensorReading.objects.count(), 2)
+        minuto = MinuteAverage.objects.get()
+        self.assertEqual((minuto.count, minuto.temperature_sum), (2, 42))
+        self.assertEqual(state.obter_ultima_leitura().temperature, 22)
+
+
+@override_settings(CACHES=LOCMEM)
+class WireFormatTests(TestCase):
+    """Formato binário do ESP (wire.py) negociado por Content-Type/Accept."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_leituras_e_status(self):
+        momento = timezone.now().replace(microsecond=0) - timedelta(minutes=1)
+        corpo = wire.codificar_leituras([(21.5, 55.25, momento), (22.75, 54.0, None)], 'esp-bin')
+        self.assertEqual(len(corpo), 4 + len('esp-bin') + 2 * 8)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post('/api/sensor-data/', data=corpo, content_type=wire.TIPO)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(wire.RESULTADO.unpack(resposta.content), (2, 0))
+        self.assertEqual(
+            sorted(SensorReading.objects.filter(device_id='esp-bin').values_list('temperature', flat=True)),
+            [21.5, 22.75],
+        )
+        self.assertTrue(SensorReading.objects.filter(timestamp=momento).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            binario = self.client.get(
+                '/api/status/', {'device': 'esp32', 'device_id': 'esp-bin'}, HTTP_ACCEPT=wire.TIPO,
+            )
+        self.assertEqual(binario['Content-Type'], wire.TIPO)
+        self.assertEqual(len(binario.content), wire.STATUS.size)
+        status = wire.decodificar_status(binario.content)
+        json_ = self.client.get('/api/status/', {'device_id': 'esp-bin'}).json()
+        for campo in ('version', 'esp_online', 'left', 'right', 'automatic_mode', 'min_temperature',
+                      'move_timeout_ms'):
+            self.assertEqual(status[campo], json_[campo], campo)
+        # timestamp com resolução de segundos no binário
+        self.assertEqual(status['latest_reading']['temperature'], json_['latest_reading']['temperature'])
+
+        nao_mudou = self.client.get(
+            '/api/status/', {'device_id': 'esp-bin'},
+            HTTP_ACCEPT=wire.TIPO, HTTP_IF_NONE_MATCH=binario['ETag'],
+        )
+        self.assertEqual(nao_mudou.status_code, 304)
+
+        truncado = self.client.post('/api/sensor-data/', data=corpo[:-1], content_type=wire.TIPO)
+        self.assertEqual(truncado.status_code, 400)
+
+    def test_valores_nos_limites(self):
+        # cabe exatamente; um centésimo além vira sentinela, como ausente e NaN
+        _, leituras = wire.decodificar_leituras(wire.codificar_leituras([
+            (327.67, 655.34, None), (-327.67, 0, None), (327.68, 655.35, None),
+            (-327.68, -0.01, None), (math.nan, math.inf, None),
+        ]))
+        self.assertEqual(
+            [(l['temperature'], l['humidity']) for l in leituras],
+            [(327.67, 655.34), (-327.67, 0.0), (None, None), (None, None), (None, None)],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                '/api/sensor-data/',
+                data=wire.codificar_leituras([(21.0, 50.0, None), (400.0, 50.0, None)]),
+                content_type=wire.TIPO,
+            )
+        self.assertEqual(wire.RESULTADO.unpack(resposta.content), (1, 1))
+
+        status = self.client.get('/api/status/').json()
+        status.update({'min_temperature': -1000.0, 'max_temperature': None, 'latest_reading': None})
+        decodificado = wire.decodificar_status(wire.codificar_status(status))
+        self.assertEqual((decodificado['min_temperature'], decodificado['max_temperature']), (None, None))
+        self.assertIsNone(decodificado['latest_reading'])
+
+
+@override_settings(CACHES=LOCMEM)
+class DeltaStatusTests(TestCase):
+    """get_status_api?delta=1: só os campos alterados desde a versão do cliente, pelo jornal."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='senha')
+        self.client.force_login(self.user)
+        GreenhouseControl.objects.create()
+
+    def _status(self, versao=None):
+        parametros = {'delta': 1, 'since': versao} if versao else {}
+        return self.client.get('/api/status/', parametros)
+
+    def test_delta(self):
+        completo = self._status().json()
+        self.assertEqual(self._status(completo['version']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/set-params/',
+                data=json.dumps({'min_temperature': 18, 'max_temperature': 30, 'curtain_move_time_seconds': 120}),
+                content_type='application/json',
+            )
+        delta = self._status(completo['version']).json()
+        self.assertEqual(delta, {'min_temperature': 18.0, 'version': delta['version'], 'delta': True})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/sensor-data/',
+                data=json.dumps({'temperature': 25, 'humidity': 60}),
+                content_type='application/json',
+            )
+        leitura = self._status(delta['version']).json()
+        self.assertEqual(leitura['latest_reading']['temperature'], 25)
+        self.assertNotIn('min_temperature', leitura)
+        self.assertNotIn('move_timeout_ms', leitura)
+
+        # versão anterior ao jornal: status completo
+        ControlChange.objects.all().delete()
+        antigo = self._status(completo['version']).json()
+        self.assertNotIn('delta', antigo)
+        self.assertEqual(set(antigo), set(completo))
+        self.assertEqual(antigo['min_temperature'], 18.0)
+
+    def test_instancia_antiga_nao_volta_a_versao(self):
+        antiga = GreenhouseControl.objects.get()
+        concorrente = GreenhouseControl.objects.get()
+        concorrente.min_temperature = 19
+        concorrente.save()
+
+        # só campos fora do status: não pode regravar o state_version lido antes
+        antiga.curtain_is_open = True
+        antiga.save()
+        self.assertEqual(GreenhouseControl.objects.get().state_version, 1)
+
+        nova = GreenhouseControl.objects.get()
+        nova.max_temperature = 31
+        nova.save()
+        self.assertEqual(nova.state_version, 2)
+        self.assertEqual(list(ControlChange.objects.values_list('version', flat=True).order_by('version')), [1, 2])
+
+
+class StatusStreamTests(TestCase):
+    """Difusor do stream SSE e a view status_stream (que só funciona sob ASGI)."""
+
+    def _eventos(self, difusor, quantidade, mudar=None):
+        async def coletar():
+            eventos = difusor.eventos()
+            recebidos = []
+            try:
+                while len(recebidos) < quantidade:
+                    recebidos.append(await eventos.__anext__())
+                    if mudar and len(recebidos) == 1:
+                        mudar()
+            finally:
+                await eventos.aclose()
+            return recebidos
+        return async_to_sync(coletar)()
+
+    def test_status_depois_delta(self):
+        atual = {'left': 'stop', 'right': 'stop', 'last_contact_seconds': 1}
+        difusor = stream.Difusor(lambda: dict(atual), intervalo=0.01)
+
+        def mudar():
+            atual.update(left='open', last_contact_seconds=2)
+
+        primeiro, segundo = self._eventos(difusor, 2, mudar)
+        self.assertEqual(
+            primeiro, stream.formatar('status', {'left': 'stop', 'right': 'stop', 'last_contact_seconds': 1}),
+        )
+        # last_contact_seconds sozinho não gera delta: só o campo que mudou
+        self.assertEqual(segundo, stream.formatar('delta', {'left': 'open'}))
+        self.assertFalse(difusor.inscritos)
+
+    def test_ping_sem_mudancas(self):
+        difusor = stream.Difusor(lambda: {'left': 'stop', 'last_contact_seconds': 3}, intervalo=0.01)
+        with mock.patch.object(stream, 'INTERVALO_PING', 0.05):
+            _, ping = self._eventos(difusor, 2)
+        self.assertEqual(ping, stream.formatar('ping', {'last_contact_seconds': 3}))
+
+    def test_cliente_lento_recomeca_do_status(self):
+        difusor = stream.Difusor(lambda: {})
+        difusor.ultimo = {'left': 'open'}
+
+        async def encher():
+            fila = asyncio.Queue(maxsize=stream.TAMANHO_FILA)
+            for i in range(stream.TAMANHO_FILA):
+                fila.put_nowait(('delta', {'i': i}))
+            difusor._enviar(fila, 'delta', {'left': 'open'})
+            return [fila.get_nowait() for _ in range(fila.qsize())]
+
+        self.assertEqual(async_to_sync(encher)(), [('status', {'left': 'open'})])
+
+    def test_wsgi_e_login(self):
+        url = reverse('status_stream')
+        anonimo = self.client.get(url)
+        self.assertEqual(anonimo.status_code, 302)
+        self.assertTrue(anonimo['Location'].startswith(reverse('login')))
+
+        self.client.force_login(User.objects.create_user('tester', password='senha'))
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 503)
+        self.assertFalse(resposta.json()['success'])
+
+
+@override_settings(CACHES=LOCMEM, GREENHOUSE_HEARTBEAT_PERSIST_INTERVAL=60)
+class HeartbeatPersistTests(TestCase):
+    """Heartbeat no cache; o banco só é gravado no intervalo, ao voltar online ou ao trocar de IP."""
+
+    def setUp(self):
+        cache.clear()
+        self.inicio = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._registrar(0, '10.0.0.1')
+
+    def _registrar(self, segundos, ip):
+        with mock.patch('django.utils.timezone.now', return_value=self.inicio + timedelta(seconds=segundos)):
+            return state.registrar_heartbeat(state.obter_controle(), ip)
+
+    def _banco(self):
+        return GreenhouseControl.objects.values_list('last_esp_ping', 'esp_ip').get()
+
+    def test_poll_dentro_do_intervalo_nao_grava(self):
+        self.assertEqual(self._banco(), (self.inicio, '10.0.0.1'))
+        with mock.patch('django.utils.timezone.now', return_value=self.inicio + timedelta(seconds=10)):
+            with CaptureQueriesContext(connection) as consultas:
+                resposta = self.client.get('/api/status/', {'device': 'esp32'}, REMOTE_ADDR='10.0.0.1')
+        self.assertTrue(resposta.json()['esp_online'])
+        self.assertFalse([c['sql'] for c in consultas.captured_queries if c['sql'].startswith('UPDATE')])
+        with self.assertNumQueries(0):
+            self.assertFalse(self._registrar(15, '10.0.0.1'))
+        self.assertEqual(self._banco(), (self.inicio, '10.0.0.1'))
+
+    def test_grava_depois_do_intervalo(self):
+        # polls a cada 15s: o ESP segue online e só o intervalo dispara a gravação
+        for segundos in (15, 30, 45, 59):
+            self.assertFalse(self._registrar(segundos, '10.0.0.1'))
+        self.assertEqual(self._banco(), (self.inicio, '10.0.0.1'))
+        self.assertTrue(self._registrar(60, '10.0.0.1'))
+        self.assertEqual(self._banco(), (self.inicio + timedelta(seconds=60), '10.0.0.1'))
+
+    def test_grava_na_hora_ao_voltar_e_ao_trocar_de_ip(self):
+        # 30s sem contato: estava offline, grava mesmo antes do intervalo
+        self.assertTrue(self._registrar(30, '10.0.0.1'))
+        self.assertEqual(self._banco(), (self.inicio + timedelta(seconds=30), '10.0.0.1'))
+
+        versoes = ControlChange.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self._registrar(35, '10.0.0.2'))
+        self.assertEqual(self._banco(), (self.inicio + timedelta(seconds=35), '10.0.0.2'))
+        self.assertEqual(ControlChange.objects.count(), versoes + 1)
+        self.assertEqual(state.obter_controle().esp_ip, '10.0.0.2')
+
+
+class HeartbeatCacheTests(TestCase):
+    """O heartbeat fica só no cache: com a configuração de settings ele não pode ser descartado."""
+
+    def test_heartbeat_sobrevive_a_muitas_chaves(self):
+        from django.conf import settings as configuracao
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        ajuste = override_settings(CACHES={
+            alias: {**opcoes, 'LOCATION': os.path.join(diretorio.name, alias)}
+            for alias, opcoes in configuracao.CACHES.items()
+        })
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        controles = GreenhouseControl.objects.bulk_create(
+            [GreenhouseControl(device_id=f'esp-{i:03d}') for i in range(120)]
+        )
+        for control in controles:
+            state.registrar_heartbeat(control, '10.0.0.1')
+            with self.captureOnCommitCallbacks(execute=True):
+                state.obter_estado(control.device_id)
+        # bem acima do MAX_ENTRIES padrão (300) do FileBasedCache
+        self.assertGreater(len(os.listdir(os.path.join(diretorio.name, configuracao.GREENHOUSE_STATE_CACHE))), 300)
+        for control in controles:
+            self.assertTrue(state.online(state.ultimo_heartbeat(control)[0]), control.device_id)
+
+    @override_settings(CACHES=LOCMEM, GREENHOUSE_MAX_DEVICES=2)
+    def test_aviso_acima_do_limite(self):
+        for i in range(2):
+            state.provisionar(f'esp-{i}')
+        with self.assertLogs('greenhouse.state', 'WARNING'):
+            state.provisionar('esp-2')
+
+
+class _RelogioParado:
+    """Relógio simulado fixo: o tempo só anda quando o teste muda `agora`."""
+
+    def __init__(self, agora=0.0):
+        self.agora = agora
+
+    def segundos(self):
+        return self.agora
+
+    async def dormir(self, segundos_simulados):
+        pass
+
+
+class _ClienteFalso:
+    def __init__(self):
+        self.enviados = []
+
+    async def requisitar(self, nome, metodo, caminho, dados=None):
+        self.enviados.append((dados['side'], dados['action']))
+        return 200, b'{}'
+
+
+class SimulatorTests(TestCase):
+    """Peças do simulador de ESP (run_greenhouse_logic): HTTP, cortinas e obediência ao status."""
+
+    def test_conexao_http(self):
+        respostas = [
+            b'HTTP/1.1 200 OK\r\nContent-Length: 7\r\n\r\n{"a":1}',
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n3;x=1\r\nabc\r\n2\r\nde\r\n0\r\n\r\n',
+            b'HTTP/1.1 304 Not Modified\r\nETag: "x"\r\n\r\n',
+        ]
+        abertas = []
+
+        async def atender(leitor, escritor):
+            abertas.append(escritor)
+            try:
+                while respostas:
+                    cabecalho = await leitor.readuntil(b'\r\n\r\n')
+                    tamanho = re.search(rb'Content-Length: (\d+)', cabecalho)
+                    if tamanho:
+                        await leitor.readexactly(int(tamanho.group(1)))
+                    escritor.write(respostas.pop(0))
+                    await escritor.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                escritor.close()
+
+        async def cenario():
+            servidor = await asyncio.start_server(atender, '127.0.0.1', 0)
+            conexao = simulator.ConexaoHttp('127.0.0.1', servidor.sockets[0].getsockname()[1])
+            try:
+                resultados = [
+                    await conexao.requisitar('POST', '/api/sensor-data/', b'{}'),
+                    await conexao.requisitar('GET', '/api/status/'),
+                ]
+                # depois de fechar(), a próxima requisição abre outra conexão
+                conexao.fechar()
+                resultados.append(await conexao.requisitar('GET', '/api/status/'))
+                return resultados
+            finally:
+                conexao.fechar()
+                servidor.close()
+                await servidor.wait_closed()
+
+        resultados = async_to_sync(cenario)()
+        self.assertEqual(resultados, [(200, b'{"a":1}'), (200, b'abcde'), (304, b'')])
+        self.assertEqual(len(abertas), 2)
+
+    def test_cortina_movimento_parcial(self):
+        cortina = simulator.Cortina()
+        self.assertEqual(cortina.atual(0), 0.0)
+        cortina.mover(1.0, agora=0, duracao=100)
+        self.assertAlmostEqual(cortina.atual(50), 0.5)
+        # volta do meio do caminho: leva só a fração que falta do tempo de curso
+        cortina.mover(0.0, agora=50, duracao=100)
+        self.assertAlmostEqual(cortina.duracao, 50)
+        self.assertAlmostEqual(cortina.atual(75), 0.25)
+        self.assertEqual(cortina.atual(200), 0.0)
+
+    def _esp(self):
+        esp = simulator.EspVirtual(0, _ClienteFalso(), _RelogioParado(), random.Random(0), 10, 2, 1)
+        return esp, esp.cliente.enviados
+
+    def test_obedecer(self):
+        async def cenario():
+            esp, enviados = self._esp()
+            # fechada e mandada fechar: só confirma, sem movimento
+            esp._obedecer({'left': 'close', 'right': 'stop', 'move_timeout_ms': 60000})
+            await asyncio.gather(*esp.movimentos)
+            self.assertEqual(enviados, [('left', 'stop')])
+            self.assertEqual(esp.estufa.cortinas['left'].duracao, 0)
+
+            # o mesmo comando repetido durante o movimento é ignorado
+            enviados.clear()
+            status = {'left': 'stop', 'right': 'open', 'move_timeout_ms': 60000}
+            esp._obedecer(status)
+            esp._obedecer(status)
+            self.assertEqual(esp.tempo_curso, 60)
+            await asyncio.gather(*esp.movimentos)
+            self.assertEqual(enviados, [('right', 'open'), ('right', 'stop')])
+            self.assertEqual(esp.movendo, {'left': None, 'right': None})
+
+        async_to_sync(cenario)()
+
+
+class BenchmarkSmokeTests(TestCase):
+    """run_benchmark com um ciclo curtíssimo: formato do relatório e consultas por requisição."""
+
+    def test_ciclo_curto(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            destino = os.path.join(diretorio, 'resultado.json')
+            # processo próprio: o benchmark cria e destrói o seu banco de teste
+            subprocess.run(
+                [
+                    sys.executable, 'manage.py', 'run_benchmark', '--esps', '2', '--dashboards', '1',
+                    '--rounds', '10', '--warmup', '1', '--output', destino,
+                ],
+                cwd=settings.BASE_DIR, check=True, capture_output=True, timeout=120,
+            )
+            with open(destino) as f:
+                resultado = json.load(f)
+
+        self.assertEqual(
+            resultado['meta']['parameters'], {'esps': 2, 'dashboards': 1, 'rounds': 10, 'warmup': 1, 'seed': 0},
+        )
+        endpoints = resultado['endpoints']
+        # por rodada: leitura e status de cada ESP e status do dashboard; confirmação a cada 5, histórico a cada 10
+        esperados = {
+            'sensor_data_api': 20, 'get_status_api[esp]': 20, 'manual_control_esp_api': 4,
+            'get_status_api[dashboard]': 10, 'historico_api': 1,
+        }
+        self.assertEqual({nome: dados['requests'] for nome, dados in endpoints.items()}, esperados)
+        self.assertEqual(resultado['requests'], sum(esperados.values()))
+        self.assertGreater(resultado['throughput_rps'], 0)
+        for nome, dados in endpoints.items():
+            self.assertEqual(dados['status'], {'200': dados['requests']}, nome)
+            self.assertLessEqual(dados['p50_ms'], dados['p95_ms'])
+            self.assertGreaterEqual(dados['queries_per_request'], 0)
+        # o status vem do cache: no máximo a recarga depois de alguma gravação
+        for nome in ('get_status_api[esp]', 'get_status_api[dashboard]'):
+            self.assertLessEqual(endpoints[nome]['queries_per_request'], 2, nome)
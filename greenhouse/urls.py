@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     # --- API ESP ---
     path('api/status/', views.get_status_api, name='get_status_api'),
+    path('api/status/stream/', views.status_stream, name='status_stream'),
     path('api/sensor-data/', views.sensor_data_api, name='sensor_data_api'),
     path('api/manual-left/', views.manual_left_api, name='manual_left_api'),
     path('api/manual-right/', views.manual_right_api, name='manual_right_api'),
@@ -11,6 +12,12 @@ urlpatterns = [
 
     path('api/set-params/', views.set_parameters_api, name='set_parameters_api'),
     path('api/toggle-automatic/', views.toggle_automatic_mode, name='toggle_automatic_mode'),
+    path('api/historico/', views.historico_api, name='historico_api'),
+    path('api/analytics/', views.analytics_api, name='analytics_api'),
+    path('api/curtain-intervals/', views.curtain_intervals_api, name='curtain_intervals_api'),
+    path('api/export/<str:fonte>/', views.export_api, name='export_api'),
+
+    path('metrics', views.metrics_view, name='metrics'),
 
     # --- Páginas frontend ---
     path('dashboard/', views.dashboard_view, name='dashboard'),
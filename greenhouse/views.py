@@ -1,91 +1,92 @@
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.conf import settings
+from django.http import (
+    HttpResponse, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound,
+    HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from django.db.models.functions import TruncHour
 from django.db.models import Avg
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta, timezone as dt_timezone
+import functools
+import hashlib
+import hmac
 import json
-import threading
+import re
+import time as time_mod
 
-from .models import SensorReading, HourlyAverage, GreenhouseControl, CurtainLog
+from .models import DISPOSITIVO_PADRAO, SensorReading, GreenhouseControl, CurtainLog
+from . import (
+    controller, daycache, export, ingest, intervals, metrics, periodos, rollups, state, stream, wire, writebehind,
+)
 
-# Guarda o timer ativo para evitar agendamentos duplicados
-timer_limpeza = None
 
-def limpar_leituras_antigas():
-    """Apaga apenas registros de leitura com mais de 1 hora."""
-    from .models import SensorReading
-    limite = timezone.now() - timedelta(hours=1)
-    apagados, _ = SensorReading.objects.filter(timestamp__lt=limite).delete()
-    print(f"{apagados} leituras antigas removidas (anteriores a {limite}).")
+# ---------- Controle ----------
+# Estufa/ESP de cada requisição: "device_id" no JSON ou ?device_id=; sem ele, o padrão
+DISPOSITIVO_VALIDO = re.compile(r'^[A-Za-z0-9_.-]{1,32}$')
 
-    # Libera para novo agendamento
-    global timer_limpeza
-    timer_limpeza = None
 
-# ---------- Controle ----------
-def _ensure_control():
-    control = GreenhouseControl.objects.first()
-    if not control:
-        control = GreenhouseControl.objects.create()
-    return control
+def _dispositivo(request, payload=None):
+    valor = payload.get('device_id') if isinstance(payload, dict) else None
+    valor = valor or request.GET.get('device_id') or DISPOSITIVO_PADRAO
+    if not isinstance(valor, str) or not DISPOSITIVO_VALIDO.match(valor):
+        raise ValueError('device_id inválido.')
+    return valor
+
+
+def _dispositivo_desconhecido():
+    # o controle só é criado pelo primeiro lote de leituras do ESP (sensor_data_api)
+    return JsonResponse({'success': False, 'error': 'Dispositivo desconhecido.'}, status=404)
+
 
 def esp_online(control):
     """Retorna True se o ESP enviou ping nos últimos 20 segundos."""
-    if not control.last_esp_ping:
-        return False
-    return (timezone.now() - control.last_esp_ping).total_seconds() < 20
+    ultimo_ping, _ = state.ultimo_heartbeat(control)
+    return state.online(ultimo_ping)
 
 @login_required
 def dashboard_view(request):
-    control = _ensure_control()
-    return render(request, 'dashboard.html', {'control': control})
+    try:
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    control = state.obter_controle(dispositivo)
+    if control is None:
+        return HttpResponseNotFound('Dispositivo desconhecido.')
+    return render(request, 'dashboard.html', {
+        'control': control,
+        'device_id': dispositivo,
+        'devices': GreenhouseControl.objects.order_by('device_id').values_list('device_id', flat=True),
+    })
+
+def _periodo(request):
+    """Intervalo (start_dt, end_dt) dos filtros da URL; padrão: últimos 7 dias."""
+    return periodos.periodo(request.GET.get('start'), request.GET.get('end'))
+
 
 @login_required
 def historico(request):
     # filtros de datas vindos da URL
-    start_date_str = request.GET.get('start')
-    end_date_str = request.GET.get('end')
-
-    today = timezone.localdate()
-
-    if start_date_str:
-        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
-    else:
-        # padrão: últimos 7 dias
-        start_date = today - timedelta(days=7)
+    start_dt, end_dt = _periodo(request)
+    try:
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
-    if end_date_str:
-        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
-    else:
-        end_date = today
-
-    # datas como datetime com timezone
-    tz = timezone.get_current_timezone()
-    start_dt = datetime.combine(start_date, time.min, tzinfo=tz)
-    end_dt = datetime.combine(end_date, time.max, tzinfo=tz)
-
-    # === leituras de sensor para o gráfico ===
-    leituras = (
-        HourlyAverage.objects
-        .filter(timestamp__range=(start_dt, end_dt))
-        .order_by("timestamp")
-    )
+    # o gráfico carrega a série reduzida pela historico_api (nível conforme o período)
+    nivel = rollups.escolher_nivel(start_dt, end_dt)
 
-    dados = [
-        {
-            "timestamp": leitura.timestamp.isoformat(),
-            "temperature": round(leitura.temperature, 2),
-            "humidity": round(leitura.humidity, 2),
-        }
-        for leitura in leituras
-    ]
     # === últimos 10 logs (sem 'stop'), já com texto pronto ===
     logs_qs = (
         CurtainLog.objects
+        .filter(device_id=dispositivo)
         .exclude(action="stop")
         .order_by("-timestamp")[:10]
     )
@@ -129,35 +130,247 @@ def historico(request):
         })
 
     context = {
-        "leituras_json": json.dumps(dados),
-        "start_date": start_date.strftime("%Y-%m-%d"),
-        "end_date": end_date.strftime("%Y-%m-%d"),
+        "resolucao": nivel.nome,
+        "start_iso": start_dt.isoformat(),
+        "end_iso": end_dt.isoformat(),
+        "start_date": timezone.localtime(start_dt).strftime("%Y-%m-%d"),
+        "end_date": timezone.localtime(end_dt).strftime("%Y-%m-%d"),
         "logs": logs,
+        "device_id": dispositivo,
     }
     return render(request, "historico.html", context)
 
 
-# ---------- API de status (ESP e browser consultam esse endpoint) ----------
+# Tamanho máximo de página da historico_api (?limit=)
+MAX_PONTOS_POR_PAGINA = 5000
+# Alvo máximo da redução LTTB (?points=)
+MAX_PONTOS_REDUCAO = 10000
+# A redução carrega a série inteira na memória: o nível é escolhido para ter no
+# máximo FATOR_ENTRADA_REDUCAO baldes por ponto pedido (e MAX_ENTRADA_REDUCAO no total)
+FATOR_ENTRADA_REDUCAO = 8
+MAX_ENTRADA_REDUCAO = 40000
+
+
+def _stream_serie(cabecalho, pontos, limite, resumos=None):
+    """
+    Corpo JSON gerado aos poucos: {...cabecalho, "points": [...], "days": [...], "next": cursor}.
+    "next" é o timestamp do último ponto quando há mais páginas, senão null.
+    "days" (resumo diário) sai no fim, já preenchido pelo percurso dos pontos:
+    só os dias entregues por inteiro nesta página.
+    """
+    yield json.dumps(cabecalho)[:-1] + ', "points": ['
+
+    bloco = []
+    entregues = 0
+    ultimo = None
+    proximo = None
+    for ponto in pontos:
+        if limite and entregues == limite:
+            proximo = ultimo
+            break
+        bloco.append(json.dumps(ponto))
+        entregues += 1
+        ultimo = ponto["timestamp"]
+        if len(bloco) == rollups.TAMANHO_CHUNK:
+            yield ("," if entregues > len(bloco) else "") + ",".join(bloco)
+            bloco = []
+    if bloco:
+        yield ("," if entregues > len(bloco) else "") + ",".join(bloco)
+
+    yield '], "days": ' + json.dumps(resumos or []) + ', "next": ' + json.dumps(proximo) + '}'
+
+
+@login_required
 @require_GET
-def get_status_api(request):
-   
-    control = _ensure_control()
+def historico_api(request):
+    """
+    Série do gráfico em JSON, transmitida em streaming (memória limitada ao chunk).
+    ?start=&end= (data ou data e hora ISO);
+    ?resolution=minute|hour|day força o nível, senão é escolhido pelo período;
+    ?limit=N pagina a resposta; ?after=<next da página anterior> busca a seguinte;
+    ?points=N reduz a série (LTTB, temperatura e umidade) a no máximo N pontos,
+    numa única resposta (não combina com limit); se o nível tiver baldes demais
+    para a redução, usa o mais fino que caiba (ver FATOR_ENTRADA_REDUCAO).
+    """
+    try:
+        start_dt, end_dt = _periodo(request)
+        dispositivo = _dispositivo(request)
+        depois = periodos.parse_limite(request.GET['after']) if request.GET.get('after') else None
+        limite = int(request.GET.get('limit', 0))
+        alvo = int(request.GET.get('points', 0))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if alvo and (limite or not 3 <= alvo <= MAX_PONTOS_REDUCAO):
+        return JsonResponse(
+            {'success': False, 'error': f'points deve estar entre 3 e {MAX_PONTOS_REDUCAO}, sem limit.'},
+            status=400,
+        )
+    if limite < 0 or limite > MAX_PONTOS_POR_PAGINA:
+        return JsonResponse(
+            {'success': False, 'error': f'limit deve estar entre 0 (sem paginação) e {MAX_PONTOS_POR_PAGINA}.'},
+            status=400,
+        )
+
+    resolucao = request.GET.get('resolution')
+    if resolucao:
+        nivel = rollups.NIVEIS_POR_NOME.get(resolucao)
+        if nivel is None:
+            return JsonResponse({'success': False, 'error': 'Resolução inválida.'}, status=400)
+    else:
+        nivel = rollups.escolher_nivel(start_dt, end_dt)
+    if alvo:
+        maximo = min(FATOR_ENTRADA_REDUCAO * alvo, MAX_ENTRADA_REDUCAO)
+        if (end_dt - start_dt) / nivel.passo > maximo:
+            # o nível diário é o último recurso: uma linha por dia com dados
+            nivel = rollups.escolher_nivel(start_dt, end_dt, maximo)
+
+    cabecalho = {
+        "device_id": dispositivo,
+        "resolution": nivel.nome,
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+    }
+    # dias encerrados vêm do cache por dia; só hoje e faltas consultam o banco
+    resumos = []
+    pontos = daycache.iterar_pontos(nivel, start_dt, end_dt, depois, resumos, dispositivo)
+    if alvo:
+        # NumPy só é necessário quando a redução é pedida
+        from .downsample import reduzir_serie
+        pontos = reduzir_serie(list(pontos), alvo)
+    return StreamingHttpResponse(_stream_serie(cabecalho, pontos, limite, resumos), content_type="application/json")
 
-    device = request.GET.get("device")
+
+# ---------- Indicadores diários ----------
+@login_required
+@require_GET
+def analytics_api(request):
+    """
+    Um item por dia local de ?start=&end= (como no histórico): média e extremos,
+    horas fora da faixa ideal atual, graus-hora acima da máxima e segundos de
+    cortina aberta por lado.
+    """
+    try:
+        start_dt, end_dt = _periodo(request)
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if end_dt < start_dt:
+        return JsonResponse({'success': False, 'error': 'end deve ser posterior a start.'}, status=400)
+
+    # NumPy só é necessário aqui
+    from . import analytics
+    control = state.obter_controle(dispositivo)
+    if control is None:
+        return _dispositivo_desconhecido()
+    return JsonResponse({
+        "device_id": dispositivo,
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "min_temperature": control.min_temperature,
+        "max_temperature": control.max_temperature,
+        "days": analytics.diario(start_dt, end_dt, control),
+    })
+
+
+@login_required
+@require_GET
+def curtain_intervals_api(request):
+    """
+    Trechos aberta/fechada de cada cortina que tocam ?start=&end= (como no
+    histórico), para sobrepor ao gráfico; ?side=left|right filtra um lado.
+    "end": null é o estado atual.
+    """
+    try:
+        start_dt, end_dt = _periodo(request)
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    lado = request.GET.get('side')
+    if lado and lado not in intervals.LADOS:
+        return JsonResponse({'success': False, 'error': 'Lado inválido.'}, status=400)
+
+    trechos = []
+    for side in ([lado] if lado else intervals.LADOS):
+        trechos.extend(
+            {
+                "side": trecho.side,
+                "state": trecho.state,
+                "start": trecho.start.isoformat(),
+                "end": trecho.end.isoformat() if trecho.end else None,
+            }
+            for trecho in intervals.sobrepostos(side, start_dt, end_dt, dispositivo)
+        )
+    return JsonResponse({
+        "device_id": dispositivo,
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "intervals": trechos,
+    })
+
+
+# ---------- Exportação (CSV/NDJSON em streaming) ----------
+@login_required
+@require_GET
+def export_api(request, fonte):
+    """
+    fonte: readings | minute | hourly | daily | curtain.
+    ?start=&end= como no histórico; ?format=csv|ndjson; ?gzip=1 comprime na hora.
+    """
+    if fonte not in export.FONTES:
+        return JsonResponse({'success': False, 'error': 'Fonte inválida.'}, status=400)
+    formato = request.GET.get('format', 'csv')
+    if formato not in export.FORMATOS:
+        return JsonResponse({'success': False, 'error': 'Formato inválido.'}, status=400)
+    try:
+        start_dt, end_dt = _periodo(request)
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    comprimir = request.GET.get('gzip') in ('1', 'true')
+
+    nome = f"{dispositivo}_{fonte}_{timezone.localtime(start_dt):%Y%m%d}_{timezone.localtime(end_dt):%Y%m%d}.{formato}"
+    if comprimir:
+        content_type = "application/gzip"
+        nome += ".gz"
+    else:
+        content_type = "text/csv; charset=utf-8" if formato == 'csv' else "application/x-ndjson"
+
+    resposta = StreamingHttpResponse(
+        export.gerar(fonte, start_dt, end_dt, formato, comprimir, dispositivo),
+        content_type=content_type,
+    )
+    resposta["Content-Disposition"] = f'attachment; filename="{nome}"'
+    return resposta
+
+
+# ---------- API de status (ESP e browser consultam esse endpoint) ----------
+# Long-poll: espera máxima aceita em ?wait= e intervalo entre verificações
+MAX_ESPERA_STATUS = 30
+INTERVALO_LONG_POLL = 0.25
+# durante o long-poll do ESP, renova o heartbeat para ele não parecer offline
+INTERVALO_HEARTBEAT_LONG_POLL = 5
+
+
+def _montar_status(device=None, ip=None, heartbeat=True, dispositivo=DISPOSITIVO_PADRAO):
+    """Status do dispositivo; None se ele não foi provisionado."""
+    # estado vem do cache compartilhado; só vai ao banco depois de alguma gravação
+    control, latest = state.obter_estado(dispositivo)
+    if control is None:
+        return None
 
     # === HEARTBEAT DO ESP ===
-    if device == "esp32":
-        control.last_esp_ping = timezone.now()
-        control.esp_ip = request.META.get("REMOTE_ADDR", "desconhecido")
-        control.save(update_fields=["last_esp_ping", "esp_ip"])
+    # fica no cache; o banco só é gravado no intervalo configurado ou quando o ESP volta
+    if device == "esp32" and heartbeat:
+        state.registrar_heartbeat(control, ip or "desconhecido")
 
     # calcula se o esp está online
-    esp_is_online = esp_online(control)
+    ultimo_ping, esp_ip = state.ultimo_heartbeat(control)
+    esp_is_online = state.online(ultimo_ping)
 
     # tempo desde último contato
     last_contact_seconds = None
-    if control.last_esp_ping:
-        last_contact_seconds = int((timezone.now() - control.last_esp_ping).total_seconds())
+    if ultimo_ping:
+        last_contact_seconds = int((timezone.now() - ultimo_ping).total_seconds())
 
     # === CALCULA FAIL-SAFE ===
     fail_safe_active = False
@@ -165,67 +378,6 @@ def get_status_api(request):
         # ESP sumiu — ativar failsafe
         fail_safe_active = True
 
-    # === LER ÚLTIMA LEITURA DO SENSOR ===
-    latest = SensorReading.objects.order_by('-timestamp').first()
-
-    # === LÓGICA DO MODO AUTOMÁTICO ===
-    if latest and control.automatic_mode and esp_is_online:
-        temperatura = latest.temperature
-        min_t = control.min_temperature
-        max_t = control.max_temperature
-
-
-        if temperatura < min_t:
-            # fecha só se tiver algo aberto
-            if control.left_is_open or control.right_is_open:
-                desired_action = 'close'
-            else:
-                desired_action = 'stop'
-
-        elif temperatura > max_t:
-            # abre só se ainda não estiver totalmente aberta
-            if not (control.left_is_open and control.right_is_open):
-                desired_action = 'open'
-            else:
-                desired_action = 'stop'
-
-        else:
-            # entre min e max: não manda abrir nem fechar
-            desired_action = 'stop'
-
-        # guarda o status anterior para saber se o comando mudou
-        previous_status = control.curtain_status
-
-        control.auto_left_action = desired_action
-        control.auto_right_action = desired_action
-        control.curtain_status = desired_action
-        control.save(update_fields=["auto_left_action", "auto_right_action", "curtain_status"])
-
-        # REGISTRA LOG AUTOMÁTICO SOMENTE QUANDO O COMANDO MUDA
-        if desired_action in ['open', 'close'] and desired_action != previous_status:
-            temp = latest.temperature
-            hum = latest.humidity
-
-            # evita log idêntico em sequência
-            ultimo_log = CurtainLog.objects.order_by("-timestamp").first()
-            criar_log = True
-            if (
-                ultimo_log and
-                ultimo_log.action == desired_action and
-                ultimo_log.side in ['both'] and
-                ultimo_log.triggered_by is None
-            ):
-                criar_log = False
-
-            if criar_log:
-                CurtainLog.objects.create(
-                    side='both',              # ou 'left'/'right' se você quiser separar
-                    action=desired_action,    # 'open' ou 'close'
-                    temperature=temp,
-                    humidity=hum,
-                    triggered_by=None,        # marca como "modo automático" no histórico
-                )
-
     # qual comando enviar para cada lado?
     if control.automatic_mode:
         left_action = control.auto_left_action
@@ -236,9 +388,10 @@ def get_status_api(request):
 
     # === PREPARA RESPOSTA ===
     response = {
+        "device_id": control.device_id,
         "esp_online": esp_is_online,
         "fail_safe": fail_safe_active,
-        "esp_ip": control.esp_ip,
+        "esp_ip": esp_ip,
         "last_contact_seconds": last_contact_seconds,
 
         # posição real das cortinas (apenas confirmada quando ESP envia "stop")
@@ -267,54 +420,321 @@ def get_status_api(request):
             "timestamp": latest.timestamp.isoformat()
         }
 
-    return JsonResponse(response)
+    response["version"] = _versao_status(response, control.state_version)
+    return response
+
+
+# Campos do status que não vêm do GreenhouseControl (sem jornal): entram no hash da versão.
+# last_contact_seconds muda a cada segundo e fica de fora da versão e do delta.
+CAMPOS_VOLATEIS = ("esp_online", "fail_safe", "latest_reading")
+
+
+def _versao_status(response, versao_controle):
+    """
+    16 hex: state_version do controle (8) + hash dos campos voláteis (8). A
+    primeira metade diz ao delta quais mudanças do jornal o cliente já viu.
+    """
+    dados = [response["device_id"]] + [response[campo] for campo in CAMPOS_VOLATEIS]
+    volateis = hashlib.sha1(json.dumps(dados, sort_keys=True).encode()).hexdigest()[:8]
+    return f"{versao_controle:08x}{volateis}"
+
+
+def _delta_status(response, conhecida):
+    """
+    Só os campos que mudaram desde a versão `conhecida` (mais "version" e
+    "delta": true); None quando ela é inválida ou mais antiga que o jornal.
+    """
+    if len(conhecida) != 16:
+        return None
+    try:
+        versao_cliente = int(conhecida[:8], 16)
+    except ValueError:
+        return None
+    campos = set()
+    atual = int(response["version"][:8], 16)
+    if versao_cliente != atual:
+        campos = state.campos_alterados(response["device_id"], versao_cliente, atual)
+        if campos is None:
+            return None
+    if conhecida[8:] != response["version"][8:]:
+        campos.update(CAMPOS_VOLATEIS)
+    delta = {campo: response[campo] for campo in sorted(campos)}
+    delta["version"] = response["version"]
+    delta["delta"] = True
+    return delta
+
+
+def _versao_do_cliente(request):
+    """Versão que o cliente já tem: ?since= ou If-None-Match."""
+    since = request.GET.get("since")
+    if since:
+        return since
+    etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    return etags[0].removeprefix("W/").strip('"') if etags else None
+
+
+@require_GET
+def get_status_api(request):
+    """
+    Status para o ESP e o dashboard. A resposta traz "version" (também no ETag):
+    - If-None-Match com a versão atual -> 304 sem corpo;
+    - ?wait=N&since=<version> (long-poll, N <= 30s) segura a requisição até o
+      estado mudar e responde na hora; se nada mudar no prazo, responde 304.
+    O long-poll ocupa o worker durante a espera. ?device_id= escolhe a estufa.
+    Com "Accept: application/vnd.greenhouse.v1+binary" o corpo vem no layout de wire.py.
+    Com ?delta=1 e uma versão conhecida (since/If-None-Match), a resposta JSON traz
+    só os campos que mudaram desde ela, com "delta": true; se a versão for antiga
+    demais para o jornal, vem o status completo.
+    """
+    device = request.GET.get("device")
+    ip = request.META.get("REMOTE_ADDR", "desconhecido")
+    try:
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    response = _montar_status(device, ip, dispositivo=dispositivo)
+    if response is None:
+        return _dispositivo_desconhecido()
+    conhecida = _versao_do_cliente(request)
+
+    try:
+        espera = min(float(request.GET.get("wait", 0)), MAX_ESPERA_STATUS)
+    except ValueError:
+        espera = 0
+
+    if espera > 0 and conhecida:
+        inicio = time_mod.monotonic()
+        ultimo_heartbeat = inicio
+        while response["version"] == conhecida and time_mod.monotonic() - inicio < espera:
+            time_mod.sleep(INTERVALO_LONG_POLL)
+            renovar = time_mod.monotonic() - ultimo_heartbeat >= INTERVALO_HEARTBEAT_LONG_POLL
+            if renovar:
+                ultimo_heartbeat = time_mod.monotonic()
+            response = _montar_status(device, ip, heartbeat=renovar, dispositivo=dispositivo)
+            if response is None:
+                return _dispositivo_desconhecido()
+
+    etag = f'"{response["version"]}"'
+    if conhecida == response["version"]:
+        resposta = HttpResponseNotModified()
+    elif wire.aceita(request):
+        resposta = HttpResponse(wire.codificar_status(response), content_type=wire.TIPO)
+    else:
+        delta = None
+        if conhecida and request.GET.get("delta") == "1":
+            delta = _delta_status(response, conhecida)
+        resposta = JsonResponse(delta or response)
+    resposta["ETag"] = etag
+    resposta["Vary"] = "Accept"
+    # clientes (e proxies) devem revalidar sempre: o 304 sai barato
+    resposta["Cache-Control"] = "no-cache"
+    return resposta
+
+
+# ---------- Métricas (formato texto do Prometheus) ----------
+def _metricas_autorizadas(request):
+    """Usuário logado ou o token de GREENHOUSE_METRICS_TOKEN em "Authorization: Bearer"."""
+    if request.user.is_authenticated:
+        return True
+    token = getattr(settings, 'GREENHOUSE_METRICS_TOKEN', None)
+    enviado = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(enviado.encode(), f'Bearer {token}'.encode())
+
+
+@require_GET
+def metrics_view(request):
+    """Soma das métricas de todos os processos, mais o estado de cada ESP calculado agora."""
+    # a lista de dispositivos e o estado de cada ESP não são públicos
+    if not _metricas_autorizadas(request):
+        return HttpResponseForbidden('Acesso às métricas negado.')
+    agora = timezone.now()
+    medidores = []
+    # uma consulta para a lista; o heartbeat de cada um vem do cache/segmento
+    for control in GreenhouseControl.objects.order_by("device_id"):
+        ultimo_ping, _ = state.ultimo_heartbeat(control)
+        rotulos = (("device", control.device_id),)
+        medidores.append(("greenhouse_esp_online", rotulos, int(state.online(ultimo_ping, agora))))
+        if ultimo_ping:
+            medidores.append(
+                ("greenhouse_esp_last_contact_seconds", rotulos, (agora - ultimo_ping).total_seconds())
+            )
+    if writebehind.ativo():
+        medidores.append(("greenhouse_write_behind_queued", (), len(writebehind.fila())))
+    return HttpResponse(metrics.exportar(medidores), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ---------- Stream de status para o dashboard (SSE, requer ASGI) ----------
+# Um difusor por dispositivo em cada processo, compartilhado pelas conexões daquele dispositivo
+difusores_status = {}
+
+
+def _difusor(dispositivo):
+    difusor = difusores_status.get(dispositivo)
+    if difusor is None:
+        difusor = difusores_status[dispositivo] = stream.Difusor(
+            functools.partial(_montar_status, dispositivo=dispositivo)
+        )
+    return difusor
+
+
+@login_required
+async def status_stream(request):
+    """
+    Eventos "status" (estado completo), "delta" (só os campos que mudaram) e
+    "ping" (last_contact_seconds, a cada 15s sem mudanças). Sob WSGI responde
+    503 e o dashboard volta para o polling de get_status_api.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"success": False, "error": "Stream disponível apenas sob ASGI."}, status=503)
+    try:
+        dispositivo = _dispositivo(request)
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+    # um difusor por device_id: só para dispositivos que existem
+    if await sync_to_async(state.obter_controle)(dispositivo) is None:
+        return _dispositivo_desconhecido()
+
+    resposta = StreamingHttpResponse(_difusor(dispositivo).eventos(), content_type="text/event-stream")
+    resposta["Cache-Control"] = "no-cache"
+    resposta["X-Accel-Buffering"] = "no"
+    return resposta
 
 
 # ---------- Recebe leituras do ESP32 ----------
+# Tamanho máximo de um lote enviado pelo ESP (buffer de 30–60 amostras + folga)
+MAX_LEITURAS_POR_LOTE = 500
+
+# Tolerância para relógio adiantado no ESP
+TOLERANCIA_FUTURO = timedelta(minutes=5)
+
+
+def _primeiro_valor(payload, *chaves):
+    """Retorna o primeiro valor presente entre as chaves aceitas (aliases do ESP)."""
+    for chave in chaves:
+        valor = payload.get(chave)
+        if valor is not None:
+            return valor
+    return None
+
+
+def _parse_timestamp(valor, agora):
+    """Aceita epoch (segundos) ou ISO 8601; sem valor usa o horário do servidor."""
+    if valor is None:
+        return agora
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        ts = datetime.fromtimestamp(valor, tz=dt_timezone.utc)
+    else:
+        ts = parse_datetime(str(valor))
+        if ts is None:
+            raise ValueError(f"timestamp inválido: {valor}")
+        if timezone.is_naive(ts):
+            ts = timezone.make_aware(ts)
+    if ts > agora + TOLERANCIA_FUTURO:
+        raise ValueError("timestamp no futuro")
+    return ts
+
+
+def _parse_leitura(item, agora, dispositivo=DISPOSITIVO_PADRAO):
+    if not isinstance(item, dict):
+        raise ValueError("leitura deve ser um objeto JSON")
+    temperature = float(_primeiro_valor(item, 'temperature', 'temp'))
+    humidity = float(_primeiro_valor(item, 'humidity', 'hum', 'umidade'))
+    timestamp = _parse_timestamp(item.get('timestamp'), agora)
+    return SensorReading(device_id=dispositivo, temperature=temperature, humidity=humidity, timestamp=timestamp)
+
+
+def _gravar_leituras(leituras):
+    """Grava já ou, com a escrita adiada, só enfileira; devolve o status HTTP (200, 202 ou 503)."""
+    if not writebehind.ativo():
+        ingest.salvar_leituras(leituras)
+        return 200
+    return 202 if writebehind.enfileirar(leituras) else 503
+
+
+def _fila_cheia():
+    resposta = JsonResponse({'success': False, 'error': 'Fila de gravação cheia, tente de novo.'}, status=503)
+    resposta['Retry-After'] = '1'
+    return resposta
+
+
 @csrf_exempt
 @require_POST
 def sensor_data_api(request):
-    global timer_limpeza
-
+    """
+    Aceita uma leitura {"temperature": .., "humidity": ..} ou um lote:
+    [{"temperature": .., "humidity": .., "timestamp": ..}, ...] (ou {"readings": [...]}).
+    No lote, "timestamp" é o horário da amostra no ESP (epoch ou ISO 8601).
+    O ESP se identifica com "device_id" no objeto (ou ?device_id=); sem ele, o padrão.
+    Com GREENHOUSE_WRITE_BEHIND a resposta é 202 (na fila) ou 503 (fila cheia).
+    Com "Content-Type: application/vnd.greenhouse.v1+binary" o corpo é um lote no
+    layout de wire.py e a resposta traz só (aceitas, recusadas).
+    """
+    binario = request.content_type == wire.TIPO
     try:
-        payload = json.loads(request.body)
-        temperature = float(payload.get('temperature') or payload.get('temp'))
-        humidity = float(payload.get('humidity') or payload.get('hum') or payload.get('umidade'))
-
+        if binario:
+            dispositivo, payload = wire.decodificar_leituras(request.body)
+            dispositivo = _dispositivo(request, {'device_id': dispositivo})
+        else:
+            payload = json.loads(request.body)
+            dispositivo = _dispositivo(request, payload)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
 
-        # Salva leitura bruta
-        SensorReading.objects.create(temperature=temperature, humidity=humidity)
+    if isinstance(payload, dict) and 'readings' in payload:
+        payload = payload['readings']
 
-        # Atualiza média horária
-        agora = timezone.now()
-        hora_inicio = agora.replace(minute=0, second=0, microsecond=0)
+    # === LEITURA ÚNICA (formato original) ===
+    if not isinstance(payload, list):
+        try:
+            leitura = _parse_leitura(payload, timezone.now(), dispositivo)
+            status = _gravar_leituras([leitura])
+            if status == 503:
+                return _fila_cheia()
+            return JsonResponse({'success': True}, status=status)
+        except Exception as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
 
-        media_hora, created = HourlyAverage.objects.get_or_create(
-            timestamp=hora_inicio,
-            defaults={'temperature': temperature, 'humidity': humidity, 'count': 1}
+    # === LOTE ===
+    if not payload:
+        return JsonResponse({'success': False, 'error': 'Lote vazio.'}, status=400)
+    if len(payload) > MAX_LEITURAS_POR_LOTE:
+        return JsonResponse(
+            {'success': False, 'error': f'Lote maior que {MAX_LEITURAS_POR_LOTE} leituras.'},
+            status=400,
         )
 
-        if not created:
-            total_temp = media_hora.temperature * media_hora.count + temperature
-            total_hum = media_hora.humidity * media_hora.count + humidity
-            media_hora.count += 1
-            media_hora.temperature = total_temp / media_hora.count
-            media_hora.humidity = total_hum / media_hora.count
-            media_hora.save()
-        else:
-            # Agendar limpeza das leituras antigas em 1 hora se não agendado
-            if timer_limpeza is None or not timer_limpeza.is_alive():
-                timer_limpeza = threading.Timer(3600, limpar_leituras_antigas)
-                timer_limpeza.daemon = True
-                timer_limpeza.start()
-                print("Limpeza das leituras antigas agendada para 1 hora.")
-            else:
-                print("Já há uma limpeza agendada — não criou outra.")
+    agora = timezone.now()
+    leituras = []
+    resultados = []
+    for indice, item in enumerate(payload):
+        try:
+            leituras.append(_parse_leitura(item, agora, dispositivo))
+            resultados.append({'index': indice, 'success': True})
+        except Exception as e:
+            resultados.append({'index': indice, 'success': False, 'error': str(e)})
 
-        return JsonResponse({'success': True})
+    if not leituras:
+        return JsonResponse(
+            {'success': False, 'accepted': 0, 'rejected': len(resultados), 'results': resultados},
+            status=400,
+        )
 
+    try:
+        status = _gravar_leituras(leituras)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if status == 503:
+        return _fila_cheia()
+
+    rejeitadas = len(resultados) - len(leituras)
+    if binario:
+        return HttpResponse(wire.codificar_resultado(len(leituras), rejeitadas), content_type=wire.TIPO, status=status)
+    return JsonResponse({
+        'success': rejeitadas == 0,
+        'accepted': len(leituras),
+        'rejected': rejeitadas,
+        'results': resultados,
+    }, status=status)
 
 
 # ---------- Atualiza parâmetros ----------
@@ -326,11 +746,16 @@ def set_parameters_api(request):
         min_t = float(payload.get('min_temperature'))
         max_t = float(payload.get('max_temperature'))
         move_time = payload.get('curtain_move_time_seconds')
-        control = _ensure_control()
+        dispositivo = _dispositivo(request, payload)
+        control = state.carregar_controle(dispositivo)
+        if control is None:
+            return _dispositivo_desconhecido()
         control.min_temperature = min_t
         control.max_temperature = max_t
         control.curtain_move_time_seconds = int(move_time)
         control.save()
+        state.invalidar(dispositivo)
+        controller.avaliar(dispositivo)
         return JsonResponse({'success': True, 'message': 'Parâmetros atualizados!'})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
@@ -340,9 +765,12 @@ def set_parameters_api(request):
 @csrf_exempt
 def toggle_automatic_mode(request):
     if request.method == "POST":
-        control = _ensure_control()
         try:
             data = json.loads(request.body.decode("utf-8"))
+            dispositivo = _dispositivo(request, data)
+            control = state.carregar_controle(dispositivo)
+            if control is None:
+                return _dispositivo_desconhecido()
             automatic_mode = bool(data.get("automatic_mode", True))
             control.automatic_mode = automatic_mode
             # When switching to automatic, reset manual actions to stop
@@ -350,11 +778,19 @@ def toggle_automatic_mode(request):
                 control.manual_left_action = 'stop'
                 control.manual_right_action = 'stop'
             control.save()
+            state.invalidar(dispositivo)
+            if automatic_mode:
+                controller.avaliar(dispositivo)
             return JsonResponse({"automatic_mode": control.automatic_mode})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=400)
     else:
-        control = _ensure_control()
+        try:
+            control = state.obter_controle(_dispositivo(request))
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        if control is None:
+            return _dispositivo_desconhecido()
         return JsonResponse({"automatic_mode": control.automatic_mode})
 
 
@@ -365,7 +801,14 @@ def manual_left_api(request):
     """
     POST: {"action":"open"|"close"|"stop"}
     """
-    control = _ensure_control()
+    try:
+        payload = json.loads(request.body)
+        dispositivo = _dispositivo(request, payload)
+    except Exception as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+    control = state.carregar_controle(dispositivo)
+    if control is None:
+        return _dispositivo_desconhecido()
 
     if not esp_online(control):
         return JsonResponse(
@@ -377,7 +820,6 @@ def manual_left_api(request):
         )
 
     try:
-        payload = json.loads(request.body)
         action = payload.get("action")
         if action not in ["open", "close", "stop"]:
             return HttpResponseBadRequest("Ação inválida")
@@ -386,10 +828,12 @@ def manual_left_api(request):
         control.manual_left_action = action
         control.automatic_mode = False
         control.save()
+        state.invalidar(dispositivo)
 
         # Log simples sempre que um comando manual é enviado
-        latest = SensorReading.objects.order_by("-timestamp").first()
+        latest = state.obter_ultima_leitura(dispositivo)
         CurtainLog.objects.create(
+            device_id=dispositivo,
             side="left",
             action=action,
             temperature=latest.temperature if latest else 0,
@@ -423,7 +867,14 @@ def manual_right_api(request):
     """
     POST: {"action":"open"|"close"|"stop"}
     """
-    control = _ensure_control()
+    try:
+        payload = json.loads(request.body)
+        dispositivo = _dispositivo(request, payload)
+    except Exception as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+    control = state.carregar_controle(dispositivo)
+    if control is None:
+        return _dispositivo_desconhecido()
 
     if not esp_online(control):
         return JsonResponse(
@@ -435,7 +886,6 @@ def manual_right_api(request):
         )
 
     try:
-        payload = json.loads(request.body)
         action = payload.get("action")
         if action not in ["open", "close", "stop"]:
             return HttpResponseBadRequest("Ação inválida")
@@ -444,10 +894,12 @@ def manual_right_api(request):
         control.manual_right_action = action
         control.automatic_mode = False
         control.save()
+        state.invalidar(dispositivo)
 
         # Log simples sempre que um comando manual é enviado
-        latest = SensorReading.objects.order_by("-timestamp").first()
+        latest = state.obter_ultima_leitura(dispositivo)
         CurtainLog.objects.create(
+            device_id=dispositivo,
             side="right",
             action=action,
             temperature=latest.temperature if latest else 0,
@@ -484,16 +936,19 @@ def manual_control_esp_api(request):
     Espera JSON: {"side":"left"|"right"|"both", "action":"open"|"close"|"stop"}
     Quando action == 'stop' o ESP está confirmando posição final — atualizamos left_is_open/right_is_open.
     """
-    control = _ensure_control()
     try:
         payload = json.loads(request.body.decode("utf-8"))
+        dispositivo = _dispositivo(request, payload)
+        control = state.carregar_controle(dispositivo)
+        if control is None:
+            return _dispositivo_desconhecido()
         side = payload.get("side", "both")
         action = payload.get("action")
 
         if action not in ['open', 'close', 'stop']:
             return JsonResponse({"success": False, "message": "Ação inválida."}, status=400)
 
-        latest = SensorReading.objects.order_by("-timestamp").first()
+        latest = state.obter_ultima_leitura(dispositivo)
         temp = latest.temperature if latest else 0
         hum = latest.humidity if latest else 0
 
@@ -540,9 +995,13 @@ def manual_control_esp_api(request):
             # não mexe em automatic_mode aqui
 
         control.save()
+        state.invalidar(dispositivo)
+        if action == "stop":
+            # posição confirmada: fecha o trecho atual se ela mudou
+            intervals.sincronizar(control)
 
         # Evita log duplicado
-        ultimo_log = CurtainLog.objects.order_by("-timestamp").first()
+        ultimo_log = CurtainLog.objects.filter(device_id=dispositivo).order_by("-timestamp").first()
         criar_log = True
         is_manual = not control.automatic_mode
         triggered_by_user = None
@@ -553,6 +1012,7 @@ def manual_control_esp_api(request):
 
         if criar_log:
             CurtainLog.objects.create(
+                device_id=dispositivo,
                 side=side if side in ['left', 'right', 'both'] else 'both',
                 action=final_action,
                 temperature=temp,
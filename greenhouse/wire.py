@@ -0,0 +1,159 @@
+"""
+Formato binário compacto para o ESP32 (alternativa ao JSON em links celulares).
+
+Negociado pelo tipo de mídia TIPO: no Content-Type do envio de leituras e no
+Accept da consulta de status. Sem ele tudo continua em JSON. Inteiros
+little-endian, sem alinhamento (layout do struct com '<').
+
+Envio de leituras (POST /api/sensor-data/, Content-Type: TIPO):
+    cabeçalho  B versão (1) | B tamanho do device_id (0 = padrão) | H quantidade
+               device_id em UTF-8 (tamanho acima)
+    leitura    I timestamp epoch em segundos (0 = horário do servidor)
+               h temperatura em centésimos de °C
+               H umidade em centésimos de %
+8 bytes por leitura. Resposta (mesmo status HTTP do JSON): H aceitas | H recusadas.
+
+Status (GET /api/status/, Accept: TIPO), 33 bytes:
+    B versão do formato (1)
+    8s versão do estado (os 16 hex de "version", em bytes; a mesma do ETag)
+    B bits: esp_online, fail_safe, left_is_open, right_is_open, automatic_mode, latest_reading
+    B left | B right | B curtain_status  (0 stop, 1 open, 2 close)
+    h min_temperature | h max_temperature  (centésimos de °C)
+    I move_timeout_ms
+    i last_contact_seconds (-1 = nunca)
+    h temperatura | H umidade (centésimos) | I timestamp epoch da última leitura
+esp_ip e device_id ficam de fora: o ESP já sabe os seus.
+
+Centésimos em h vão de -327,67 a 327,67 e em H de 0 a 655,34. O menor h
+(-32768) e o maior H (65535) são reservados para "sem valor": ausente,
+NaN ou fora da faixa. Na leitura enviada, o servidor recusa o item; no
+status, o campo decodificado é null.
+"""
+import math
+import struct
+from datetime import datetime, timezone as dt_timezone
+
+TIPO = 'application/vnd.greenhouse.v1+binary'
+VERSAO = 1
+
+CABECALHO_LEITURAS = struct.Struct('<BBH')
+LEITURA = struct.Struct('<IhH')
+RESULTADO = struct.Struct('<HH')
+STATUS = struct.Struct('<B8sBBBBhhIihHI')
+
+ACOES = ('stop', 'open', 'close')
+BITS_STATUS = ('esp_online', 'fail_safe', 'left_is_open', 'right_is_open', 'automatic_mode')
+
+# (mínimo, máximo, sem valor) dos campos em centésimos
+FAIXA_H = (-0x7FFF, 0x7FFF, -0x8000)
+FAIXA_UH = (0, 0xFFFE, 0xFFFF)
+
+
+def aceita(request):
+    """O cliente pediu o status em binário (Accept)?"""
+    return TIPO in request.META.get('HTTP_ACCEPT', '')
+
+
+def _centesimos(valor, faixa):
+    """Valor em centésimos no campo da `faixa`; o sentinela se ausente, NaN ou fora dela."""
+    minimo, maximo, sem_valor = faixa
+    if valor is None or not math.isfinite(valor):
+        return sem_valor
+    centesimos = round(valor * 100)
+    return centesimos if minimo <= centesimos <= maximo else sem_valor
+
+
+def _de_centesimos(valor, faixa):
+    return None if valor == faixa[2] else valor / 100
+
+
+def decodificar_leituras(corpo):
+    """
+    (device_id ou None, [{"temperature", "humidity", "timestamp"}]) no formato
+    dos itens JSON do lote, para seguirem a mesma validação.
+    """
+    if len(corpo) < CABECALHO_LEITURAS.size:
+        raise ValueError('corpo binário curto demais')
+    versao, tamanho, quantidade = CABECALHO_LEITURAS.unpack_from(corpo)
+    if versao != VERSAO:
+        raise ValueError(f'versão do formato binário não suportada: {versao}')
+    inicio = CABECALHO_LEITURAS.size + tamanho
+    if len(corpo) != inicio + quantidade * LEITURA.size:
+        raise ValueError('tamanho do corpo binário não confere com a quantidade de leituras')
+    dispositivo = corpo[CABECALHO_LEITURAS.size:inicio].decode() if tamanho else None
+    leituras = [
+        {'temperature': _de_centesimos(t, FAIXA_H), 'humidity': _de_centesimos(h, FAIXA_UH), 'timestamp': ts or None}
+        for ts, t, h in LEITURA.iter_unpack(corpo[inicio:])
+    ]
+    return dispositivo, leituras
+
+
+def codificar_leituras(leituras, dispositivo=None):
+    """Corpo do envio: [(temperatura, umidade, datetime ou None)] (lado do cliente)."""
+    nome = dispositivo.encode() if dispositivo else b''
+    partes = [CABECALHO_LEITURAS.pack(VERSAO, len(nome), len(leituras)), nome]
+    for temperatura, umidade, momento in leituras:
+        partes.append(LEITURA.pack(
+            int(momento.timestamp()) if momento else 0,
+            _centesimos(temperatura, FAIXA_H), _centesimos(umidade, FAIXA_UH),
+        ))
+    return b''.join(partes)
+
+
+def codificar_resultado(aceitas, recusadas):
+    return RESULTADO.pack(aceitas, recusadas)
+
+
+def codificar_status(status):
+    """O dict de _montar_status no layout STATUS."""
+    bits = 0
+    for i, campo in enumerate(BITS_STATUS):
+        bits |= bool(status[campo]) << i
+    latest = status['latest_reading']
+    temperatura, umidade, momento = FAIXA_H[2], FAIXA_UH[2], 0
+    if latest:
+        bits |= 1 << len(BITS_STATUS)
+        temperatura = _centesimos(latest['temperature'], FAIXA_H)
+        umidade = _centesimos(latest['humidity'], FAIXA_UH)
+        momento = int(datetime.fromisoformat(latest['timestamp']).timestamp())
+    contato = status['last_contact_seconds']
+    return STATUS.pack(
+        VERSAO,
+        bytes.fromhex(status['version']),
+        bits,
+        ACOES.index(status['left']),
+        ACOES.index(status['right']),
+        ACOES.index(status['curtain_status']),
+        _centesimos(status['min_temperature'], FAIXA_H),
+        _centesimos(status['max_temperature'], FAIXA_H),
+        status['move_timeout_ms'],
+        -1 if contato is None else contato,
+        temperatura,
+        umidade,
+        momento,
+    )
+
+
+def decodificar_status(corpo):
+    """Inverso de codificar_status (lado do cliente)."""
+    (_, versao, bits, left, right, curtain, t_min, t_max, move, contato,
+     temperatura, umidade, momento) = STATUS.unpack(corpo)
+    status = {campo: bool(bits >> i & 1) for i, campo in enumerate(BITS_STATUS)}
+    status.update({
+        'version': versao.hex(),
+        'left': ACOES[left],
+        'right': ACOES[right],
+        'curtain_status': ACOES[curtain],
+        'min_temperature': _de_centesimos(t_min, FAIXA_H),
+        'max_temperature': _de_centesimos(t_max, FAIXA_H),
+        'move_timeout_ms': move,
+        'last_contact_seconds': None if contato < 0 else contato,
+        'latest_reading': None,
+    })
+    if bits >> len(BITS_STATUS) & 1:
+        status['latest_reading'] = {
+            'temperature': _de_centesimos(temperatura, FAIXA_H),
+            'humidity': _de_centesimos(umidade, FAIXA_UH),
+            'timestamp': datetime.fromtimestamp(momento, dt_timezone.utc).isoformat(),
+        }
+    return status
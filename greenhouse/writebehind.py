@@ -0,0 +1,169 @@
+"""
+Escrita adiada das leituras (GREENHOUSE_WRITE_BEHIND): commit em grupo.
+
+Com o modo ligado, sensor_data_api só coloca as leituras numa fila em
+memória do processo e responde 202; uma thread as grava em grupos, a cada
+GREENHOUSE_WRITE_BEHIND_INTERVAL_MS milissegundos ou assim que juntar
+GREENHOUSE_WRITE_BEHIND_MAX_ROWS leituras. Cada grupo é uma transação (um
+fsync) com um INSERT e um upsert por balde de agregado, em vez de uma
+transação por requisição.
+
+A fila é limitada (GREENHOUSE_WRITE_BEHIND_QUEUE leituras): cheia, o lote é
+recusado inteiro e o ESP recebe 503 para reenviar depois. No encerramento
+do processo (atexit) a thread para e o que restou na fila é gravado.
+
+Uma leitura aceita e ainda não gravada se perde se o processo morrer sem
+encerrar (kill -9, queda de energia): é a troca por não esperar o commit.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+
+from . import ingest, metrics
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_PADRAO_MS = 200
+MAX_LINHAS_PADRAO = 500
+CAPACIDADE_PADRAO = 10_000
+# espera pela thread no encerramento antes de gravar o resto na thread atual
+TEMPO_PARADA = 10.0
+
+
+def ativo():
+    return getattr(settings, 'GREENHOUSE_WRITE_BEHIND', False)
+
+
+class Fila:
+    def __init__(self, intervalo_ms=None, max_linhas=None, capacidade=None):
+        self.intervalo = (intervalo_ms or getattr(
+            settings, 'GREENHOUSE_WRITE_BEHIND_INTERVAL_MS', INTERVALO_PADRAO_MS)) / 1000
+        self.max_linhas = max_linhas or getattr(settings, 'GREENHOUSE_WRITE_BEHIND_MAX_ROWS', MAX_LINHAS_PADRAO)
+        self.capacidade = capacidade or getattr(settings, 'GREENHOUSE_WRITE_BEHIND_QUEUE', CAPACIDADE_PADRAO)
+        self.pendentes = deque()
+        self.condicao = threading.Condition()
+        # monotonic da leitura mais antiga na fila (prazo do próximo grupo)
+        self.desde = None
+        self.parando = False
+        self.thread = None
+
+    def __len__(self):
+        return len(self.pendentes)
+
+    def enfileirar(self, leituras):
+        """Coloca o lote na fila; False (nada entra) se não couber."""
+        with self.condicao:
+            if self.parando or len(self.pendentes) + len(leituras) > self.capacidade:
+                metrics.incrementar('greenhouse_write_behind_rejected_total', len(leituras))
+                return False
+            if not self.pendentes:
+                self.desde = time.monotonic()
+            self.pendentes.extend(leituras)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, name='greenhouse-write-behind', daemon=True)
+                self.thread.start()
+            self.condicao.notify()
+        return True
+
+    def _retirar(self):
+        """Até max_linhas leituras do começo da fila; só com a condição."""
+        quantidade = min(len(self.pendentes), self.max_linhas)
+        grupo = [self.pendentes.popleft() for _ in range(quantidade)]
+        # o que sobrou já venceu: o próximo grupo sai em seguida
+        if not self.pendentes:
+            self.desde = None
+        return grupo
+
+    def _executar(self):
+        try:
+            while True:
+                with self.condicao:
+                    while not self.parando:
+                        if len(self.pendentes) >= self.max_linhas:
+                            break
+                        if self.desde is not None:
+                            restante = self.desde + self.intervalo - time.monotonic()
+                            if restante <= 0:
+                                break
+                            self.condicao.wait(restante)
+                        else:
+                            self.condicao.wait()
+                    if self.parando:
+                        return
+                    grupo = self._retirar()
+                self._gravar(grupo)
+        finally:
+            connections.close_all()
+
+    def _gravar(self, grupo):
+        inicio = time.perf_counter()
+        try:
+            ingest.salvar_leituras(grupo)
+        except Exception:
+            logger.exception('Falha ao gravar grupo de %d leituras adiadas', len(grupo))
+            metrics.incrementar('greenhouse_write_behind_dropped_total', len(grupo))
+            return
+        metrics.incrementar('greenhouse_write_behind_groups_total')
+        metrics.observar('greenhouse_write_behind_flush_seconds', time.perf_counter() - inicio)
+
+    def descarregar(self):
+        """Grava agora, na thread atual, tudo o que está na fila."""
+        while True:
+            with self.condicao:
+                grupo = self._retirar()
+            if not grupo:
+                return
+            self._gravar(grupo)
+
+    def parar(self):
+        """Para a thread (recusando novas leituras) e grava o que restou."""
+        with self.condicao:
+            self.parando = True
+            self.condicao.notify()
+            thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(TEMPO_PARADA)
+        self.descarregar()
+
+
+_fila = None
+_lock_fila = threading.Lock()
+
+
+def fila():
+    global _fila
+    if _fila is None:
+        with _lock_fila:
+            if _fila is None:
+                _fila = Fila()
+    return _fila
+
+
+def enfileirar(leituras):
+    return fila().enfileirar(leituras)
+
+
+def parar():
+    """Encerra a fila deste processo; a próxima leitura abre uma nova."""
+    global _fila
+    with _lock_fila:
+        atual, _fila = _fila, None
+    if atual is not None:
+        atual.parar()
+
+
+def _descartar_no_filho():
+    # a thread não existe no filho e as leituras na fila são do pai
+    global _fila, _lock_fila
+    _fila = None
+    _lock_fila = threading.Lock()
+
+
+atexit.register(parar)
+os.register_at_fork(after_in_child=_descartar_no_filho)